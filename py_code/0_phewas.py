@@ -9,140 +9,74 @@ import argparse
 #-----------------------------------------
 parser = argparse.ArgumentParser(description='New_depression project')
 parser.add_argument('--number', type=int)
+parser.add_argument('--compress', action='store_true', help='collapse identical subjects within strata before fitting')
+parser.add_argument('--resume', action='store_true', help='skip the phecodes already persisted in a result shard of this run')
+parser.add_argument('--run', type=str, default='', help='name of the run: the same name (and inputs) joins or resumes it, a new one starts a new run')
+parser.add_argument('--score_cutoff', type=float, help='fit only the phecodes whose score test p-value against the covariate-only model is below this cutoff')
 args = parser.parse_args()
 number = args.number
+compress = args.compress
+resume = args.resume
+score_cutoff = args.score_cutoff
 #-----------------------------------------
+import os
 import pandas as pd
 import numpy as np
-import time
-from lifelines import CoxPHFitter
-cph = CoxPHFitter()
 import warnings
 warnings.filterwarnings("ignore")
-from statsmodels.duration.hazard_regression import PHReg
+from cox_engine import fit_stratified_cox, fit_batch
+from score_screen import cox_null, cox_score_test, screened, screen_note
+from phewas_screen import screen
+from cohort_index import CohortIndex
+from cohort_store import CohortStore
+from phecode_index import PhecodeIndex, HistoryMatrix, EligibilityCache
+from work_queue import WorkQueue, input_signature
+from result_sink import ResultSink, read_shard, persisted_keys
 
 path = r'~/depression/'
 
-def range_d(x):
+year = 365.25*24*3600
+
+def outcomes(diseases):
     """
-    phecode merge
-    examples：254.2 --> 254.29
-    241.0 --> 241.99
-    241.23 --> 241.23
+    (disease, rows, time, status) of every phecode of a task: the eligible rows
+    in the matched sets with an event, the follow-up in years to the outcome
+    (the earliest over the phecode and its children) or time_end
     """
-    x_str = str(x)
-    if x_str.split('.')[1] == '0':
-        return round(x+0.99,2)
-    elif len(x_str.split('.')[1]) == 1:
-        return round(x+0.09,2)
-    else:
-        return x
-    
-    
-def cox(disease, dataset, date_start_variable, threshold):
-    id_='eid'
-    inpatient_variable = 'inpatient'
-    exposure_variable = 'outcome'
-    date_end_variable = 'time_end'
-    history_variable = 'history'
-    co_vars_all = co_vars + ['age'] ###
-    result = [disease]
-    match_variable = 'match_2'
-    
-    dataset_analysis = dataset[co_vars_all+['sex',id_,exposure_variable,date_start_variable,   
-                                            date_end_variable, inpatient_variable, history_variable, match_variable]].copy()
-    #
-    exl_range = phecode_cate.loc[phecode_cate['phecode'] == disease]['phecode_exclude_range'].values[0]
-    if pd.isna(exl_range):
-        dataset_analysis['flag_exl'] = 0
-    else:
-        exl_list = []
-        for range_ in exl_range.split(','):
-            exl_lower,exl_higher = float(range_.split('-')[0]), float(range_.split('-')[1])
-            exl_list_index = np.where(np.all([phecode_lst >= exl_lower, phecode_lst <= exl_higher], axis=0))[0]
-            exl_list_temp = phecode_lst[exl_list_index]
-            exl_list += [x for x in exl_list_temp]
-        dataset_analysis['flag_exl'] = dataset_analysis[history_variable].apply(lambda x: 
-                                                                                1 if np.any([i in x for i in exl_list]) 
-                                                                                else 0)
-            
-    dataset_analysis['flag_exl'] = dataset_analysis.apply(lambda row: 1 if disease in exc_sex[row['sex']] 
-                                                          else row['flag_exl'],axis=1)
-    #
-    dataset_analysis = dataset_analysis.loc[dataset_analysis['flag_exl']==0]
-    #
-    if len(dataset_analysis) == 0:
-        result += ['Sex specific']
-        return result
+    for disease in diseases:
+        rows = np.flatnonzero(eligible_mask(disease))
+        d_time = inpatient_index.first_time(phecode_index.children(disease), rows=rows)
+        status = ~np.isnan(d_time)
+        time = (np.fmin(d_time, time_end[rows]) - dia_date[rows])/year
+        with_event = np.isin(match[rows], match[rows][status])
+        yield disease, rows[with_event], time[with_event], status[with_event].astype(np.float64)
 
-    #outcome
-    disease_upper = range_d(disease)
-    disease_lst = [x for x in phecode_lst if x>=disease and x<=disease_upper]
-    dataset_analysis['d_time'] = dataset_analysis[inpatient_variable].apply(lambda x: 
-                                                                            np.nanmin([x.get(j,np.NaN) for j in disease_lst]))
-        
-    dataset_analysis['outcome_'] = dataset_analysis['d_time'].apply(lambda x: 0 if pd.isna(x) else 1)
-    length = len(dataset_analysis.loc[(dataset_analysis[exposure_variable]==1) & 
-                                              (dataset_analysis['outcome_']==1)])
-
-    result += [length]
-    #
-    dataset_analysis['date_final'] = np.nanmin(dataset_analysis[['d_time',
-                                                                 date_end_variable]],axis=1)
-    dataset_analysis['time'] = (dataset_analysis['date_final'] - 
-                                dataset_analysis[date_start_variable])/(365.25*24*3600)
-    dataset_analysis['time'] = dataset_analysis['time'].astype(float)
-    #time at risk
-    n_exp = len(dataset_analysis.loc[(dataset_analysis[exposure_variable]==1) & (dataset_analysis['outcome_']==1)])
-    n_unexp = len(dataset_analysis.loc[(dataset_analysis[exposure_variable]==0) & (dataset_analysis['outcome_']==1)])
-    time_exp = dataset_analysis.groupby(by=exposure_variable).sum()['time'].loc[1]/1000
-    time_unexp = dataset_analysis.groupby(by=exposure_variable).sum()['time'].loc[0]/1000
-    
-    if length < threshold:
-        result += ['less than threshold','%i/%.2f (%.2f)' % (n_exp,time_exp,n_exp/time_exp),
-                   '%i/%.2f (%.2f)' % (n_unexp,time_unexp,n_unexp/time_unexp)]
-        return result
-    #variance
-    for var in co_vars_all:
-        if dataset_analysis[var].var() == 0:
-            co_vars_all.remove(var)
-    #
-    match_id = dataset_analysis[dataset_analysis['outcome_']==1][match_variable]
-    dataset_analysis = dataset_analysis[dataset_analysis[match_variable].isin(match_id)]
+def fit_cox(time, status, X, strata, weights):
+    """
+    the stratified Cox fit of one phecode, after the score test screen if score_cutoff is given
+    returns [describe, coef, se, p]
+    """
     try:
-        model = PHReg(np.asarray(dataset_analysis['time'],dtype=np.float32),
-                      np.asarray(dataset_analysis[[exposure_variable]+co_vars_all],dtype=np.float32),
-                      status=np.asarray(dataset_analysis['outcome_'],dtype=np.int32), 
-                      strata=np.asarray(dataset_analysis[match_variable],dtype=np.float32))
-        model_result = model.fit(method='bfgs',maxiter=300,disp=1)
-        if pd.isna(model_result.params[0]) or pd.isna(model_result.bse[0]):
-            model = cph.fit(dataset_analysis[['time','outcome_',exposure_variable,match_variable]+co_vars_all],
-                            fit_options=dict(step_size=0.2), duration_col='time', event_col='outcome_',strata=[match_variable])
-            result_temp = model.summary.loc[exposure_variable]
-            result += ['fitted_lifelines','%i/%.2f (%.2f)' % (n_exp,time_exp,n_exp/time_exp),
-                        '%i/%.2f (%.2f)' % (n_unexp,time_unexp,n_unexp/time_unexp)]
-            result += [x for x in result_temp[['coef','se(coef)','p']]]
-        else:
-            result += ['fitted','%i/%.2f (%.2f)' % (n_exp,time_exp,n_exp/time_exp),
-                                '%i/%.2f (%.2f)' % (n_unexp,time_unexp,n_unexp/time_unexp)]
-            result += [model_result.params[0],model_result.bse[0],model_result.pvalues[0]]
-    except:
-        try:
-            model = cph.fit(dataset_analysis[['time','outcome_',exposure_variable,match_variable]+co_vars_all],
-                             fit_options=dict(step_size=0.2), duration_col='time', event_col='outcome_',strata=[match_variable])
-            result_temp = model.summary.loc[exposure_variable]
-            result += ['fitted_lifelines','%i/%.2f (%.2f)' % (n_exp,time_exp,n_exp/time_exp),
-                        '%i/%.2f (%.2f)' % (n_unexp,time_unexp,n_unexp/time_unexp)]
-            result += [x for x in result_temp[['coef','se(coef)','p']]]
-        except Exception as e:
-            print(e)
-            result += [e,'%i/%.2f (%.2f)' % (n_exp,time_exp,n_exp/time_exp),
-                        '%i/%.2f (%.2f)' % (n_unexp,time_unexp,n_unexp/time_unexp)]
-    return result
+        beta0 = None
+        if score_cutoff is not None:
+            #score test of the exposure against the covariate-only model, the full fit only for the
+            #candidates passing it, started from that null fit
+            null_params = cox_null(time, status, X, strata, weights=weights)
+            statistic, p_score = cox_score_test(time, status, X, strata, null_params=null_params, weights=weights)
+            if screened(p_score, score_cutoff):
+                return [screen_note(statistic,p_score),np.nan,np.nan,np.nan]
+            beta0 = np.r_[0, null_params]
+        model_result = fit_stratified_cox(time, status, X, strata, weights=weights, beta0=beta0)
+        describe = 'fitted' if model_result.converged else 'not converged: %s' % (model_result.message)
+        return [describe,model_result.params[0],model_result.bse[0],model_result.pvalues[0]]
+    except Exception as e:
+        print(e)
+        return [str(e),np.nan,np.nan,np.nan]
 #-------------------------------------------------------------------------------------------------------------------------
-values = np.load(path + 'age/df_merged.npy', allow_pickle=True)
-columns = np.load(path + 'age/df_merged_columns.npy', allow_pickle=True)
-df_matched = pd.DataFrame(values, columns=columns)
+cohort_store = CohortStore(path + 'age/df_merged_store')
+df_matched = cohort_store.read(['eid','outcome','sex','age','dia_date','time_end','match_2',
+                                'civil','famIncome','education'])
+inpatient_index = CohortIndex.load(path + 'age/inpatient_index.npz')
 
 
 co_vars = []
@@ -153,42 +87,72 @@ for var in ['civil','famIncome','education']:
     df_matched = pd.concat([df_matched,temp],axis=1)
     
 phecode_cate = pd.read_csv(path+ 'originData/phecode_definitions1.2.csv')
-phecode_lst = np.array([x for x in phecode_cate.phecode.values])
-exc_sex = {}
-exc_sex[0] = list(phecode_cate.loc[phecode_cate['sex']=='Female'].phecode.values)
-exc_sex[1] = list(phecode_cate.loc[phecode_cate['sex']=='Male'].phecode.values)
+phecode_index = PhecodeIndex.load(path + 'age/phecode_index.npz')
+history_matrix = HistoryMatrix.load(path + 'age/history_matrix.npz')
+eligible_mask = EligibilityCache(phecode_index, history_matrix, df_matched['sex'].values)
 phecode_cate_ = phecode_cate.loc[(~phecode_cate['category'].isin(['symptoms','congenital anomalies','pregnancy complications'])) & 
                                 (~phecode_cate['category'].isna())]
 
-#level1phecode
+#level 2 phecodes, and the level 1 phecodes without any level 2 phecode (the L1L2 table)
 phecode_cate_['level'] = phecode_cate_['phecode'].apply(lambda x: 1 if str(x).split('.')[1]=='0' 
                                           else 2 if len(str(x).split('.')[1])==1 
                                           else 3)
 
 phecode_cate_2 = phecode_cate_.loc[phecode_cate_['level']==2]
-phecode_cate_ = phecode_cate_.loc[phecode_cate_['level']==1] #level == 2
+phecode_cate_1 = phecode_cate_.loc[phecode_cate_['level']==1]
 
-phecode_lst_2 = np.array([int(x) for x in phecode_cate_2.phecode.values])
-phecode_lst_ = np.array([x for x in phecode_cate_.phecode.values if int(x) not in phecode_lst_2])
+phecode_lst_2 = np.array([x for x in phecode_cate_2.phecode.values])
+phecode_int_2 = set(int(x) for x in phecode_lst_2)
+phecode_lst_1 = np.array([x for x in phecode_cate_1.phecode.values if int(x) not in phecode_int_2])
+phecode_lst_ = np.concatenate([phecode_lst_1, phecode_lst_2])
 threshold_phewas = 200
+os.makedirs(os.path.expanduser(path + 'age/result/phewas'), exist_ok=True)
 #-------------------------------------------------------------------------------------
-result_final = []
+#counts and person-years of all phecodes in one pass, only those above threshold are fitted
+screen_df = screen(phecode_lst_, df_matched, 'dia_date', threshold_phewas, inpatient_index,
+                   phecode_index, history_matrix)
+to_fit = screen_df['describe'].isna() & screen_df['exp'].notna()
+screen_file = os.path.expanduser(path + 'age/result/phewas/cox_result_L1L2_screen.csv')
+screen_df.loc[~to_fit].to_csv(screen_file + '.%i.tmp' % (number))
+os.replace(screen_file + '.%i.tmp' % (number), screen_file)
+#one task per phecode family, so the phecodes sharing exclusion masks run in one worker
+phecode_dict = {}
+for x in screen_df.loc[to_fit, 'disease'].values:
+    phecode_dict.setdefault(str(int(x)), []).append(x)
+family_lst = list(phecode_dict.keys())
 np.random.seed(number)
-np.random.shuffle(phecode_lst_)
-total_length = len(phecode_lst_)
-result_final = []
-for i in range(len(phecode_lst_)):
-    d_ = phecode_lst_[i]
-    with open (path+'age/temp.cache','r') as f:
-        d_exl = f.read()
-    if str(d_) not in d_exl.split(','):
-        with open (path+'age/temp.cache','a') as f:
-            f.write(',%s' % str(d_))
-        progress = (len(d_exl.split(','))+1)/len(phecode_lst_)
-        print('%i: %.2f%% in phewas1' % (number,progress*100))
-        result_final.append(cox(d_,df_matched,'dia_date',threshold_phewas))
-    else:
-        continue
-phe_result = pd.DataFrame(result_final, columns=['disease','number','describe','exp','unexp',
-                                                 'coef','se','p'])
-phe_result.to_csv(path + 'age/result/phewas1/cox_result_level1_del_%i.csv' % (number))
\ No newline at end of file
+np.random.shuffle(family_lst)
+queue = WorkQueue(path + 'age/work_queue.db', 'phewas')
+#the covariate block shared by all the phecodes, built once; the counts and person-years come from the screen
+covariates = np.asarray(df_matched[co_vars+['age']], dtype=np.float64)
+exposure = df_matched['outcome'].values
+match = df_matched['match_2'].values
+dia_date = df_matched['dia_date'].values.astype(np.float64)
+time_end = df_matched['time_end'].values.astype(np.float64)
+screen_rows = {x[0]:list(x) for x in screen_df.loc[to_fit, ['disease','number','describe','exp','unexp']].values}
+result_columns = ['disease','number','describe','exp','unexp','coef','se','p']
+#a new run starts by itself when the phecodes, the options or the inputs change; the shards of an
+#earlier run are started empty, a rerun of this run keeps its shard
+run = queue.start(family_lst, input_signature((args.run, compress, score_cutoff, threshold_phewas),
+                                              [path + x for x in ['age/df_merged_store', 'age/inpatient_index.npz',
+                                                                  'originData/phecode_definitions1.2.csv',
+                                                                  'age/phecode_index.npz', 'age/history_matrix.npz']]))
+sink = ResultSink(path + 'age/result/phewas/cox_result_L1L2_del_%i.sqlite' % (number), result_columns, run=run)
+persisted = persisted_keys(path + 'age/result/phewas/cox_result_L1L2_del_*.sqlite', run=run) if resume else set()
+#the phecodes of a task are fitted in one batch against the shared block; the lease is renewed
+#per phecode, and a failed task is given back to the queue
+for key in queue.drain(number):
+    with queue.holding(key):
+        done, total = queue.progress()
+        print('%i: %.2f%% in phewas' % (number,done/total*100))
+        diseases = [d_ for d_ in phecode_dict[key] if str(d_) not in persisted]
+        for d_, fitted, _ in fit_batch(covariates, match, outcomes(diseases), exposure=exposure,
+                                       compress=compress, fit=fit_cox):
+            sink.append(str(d_), screen_rows[d_][:2] + fitted[:1] + screen_rows[d_][3:] + fitted[1:])
+            queue.heartbeat(key)
+        if not queue.complete(key):
+            print('%i: lease of %s lost to another worker, its results here are dropped' % (number,key))
+            sink.discard([str(d_) for d_ in diseases])
+sink.close()
+phe_result = read_shard(sink.file)
+phe_result.to_csv(path + 'age/result/phewas/cox_result_L1L2_del_%i.csv' % (number))
\ No newline at end of file
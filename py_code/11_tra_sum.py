@@ -7,23 +7,36 @@ Created on Tue Jul  6 14:38:47 2021
 import argparse
 #------------------
 parser = argparse.ArgumentParser(description='New_depression project')
-parser.add_argument("--coe", type=float)
+parser.add_argument("--coe", type=float, nargs='+', help='one or more penalties of the logistic stage')
+parser.add_argument("--max_length", type=int, help='longest trajectory (edges) enumerated')
+parser.add_argument("--min_support", type=int, help='fewest patients with all the diseases of a trajectory in order')
 args = parser.parse_args()
-coe = args.coe
+coe_lst = args.coe
+max_length = args.max_length
+min_support = args.min_support
 import pandas as pd
 import numpy as np
+from pair_index import PairIndex
+from trajectory_graph import TrajectoryGraph
 path = r'~/depression/'
 
-def long_tra(name):
-    global tra_result
-    
-    d2 = int(name.split('-')[-1])
-    d_lst = conlogistic.loc[conlogistic['d1']==d2].d2.values
-    if len(d_lst) == 0:
-        tra_result.append(name)
+def tra_paths(conlogistic):
+    """
+    the maximal trajectories from the group node through the directed edges,
+    with the patients having all their diseases in order
+    """
+    graph = TrajectoryGraph.from_frame(conlogistic)
+    cycles = graph.cycles()
+    if cycles:
+        print('trajectory graph has %i cycles: %s' % (len(cycles),cycles))
     else:
-        for d in d_lst:
-            long_tra('%s-%i' % (name,d))
+        print('%i trajectories from the group node' % (graph.path_counts(max_length).get(group_dict[group], 0)))
+    #the group node precedes every disease of the exposed patients, it does not restrict them
+    postings = lambda d1, d2: None if d1 == group_dict[group] else pair_index.patients(d1, d2)
+    tra_result = [['-'.join('%s' % (x) for x in tra),len(tra)-1,number] for tra,number in
+                  graph.paths([group_dict[group]], max_length=max_length, min_support=min_support,
+                              postings=postings)]
+    return pd.DataFrame(tra_result, columns=['path','length','number'])
 
 group_dict = {'depression':999}
 group = 'depression'
@@ -36,44 +49,45 @@ d_com.update(d_com_)
 d_num = {i:j for i,j in phewas[['disease','number']].values}
 d_coef = {i:j for i,j in phewas[['disease','coef']].values}
 #
-array = np.load(path + 'age/result/baseline_merged_main_group.npy', allow_pickle=True)
-array_columns = np.load(path + 'age/result/baseline_merged_columns_main_group.npy', allow_pickle=True)
-df_matched_group = pd.DataFrame(array, columns=array_columns)
-d1d2_array = df_matched_group['d1d2'].values
+#the posting lists are saved by 3_tra_identify.py, built here for an older index
+pair_index = PairIndex.load(path + 'age/result/pair_index_main_group.npz').invert()
 
-#-------------------------------------------------------------------------------------------
-#conditional logistic
-conlogistic = pd.read_csv(path + 'age/result/conlogistic_summary_%s.csv' % (coe),index_col=0)
-conlogistic['d1'] = conlogistic['name'].apply(lambda x: float(x.split('-')[0]))
-conlogistic['d2'] = conlogistic['name'].apply(lambda x: float(x.split('-')[1]))
-conlogistic['link_type'] = 'dir'
-#d0-d1
-d_first = conlogistic.loc[~conlogistic['d1'].isin(conlogistic.d2.values)]
-d_first_lst = set(d_first.d1.values)
-d0_d1 = []
-for d in d_first_lst:
-    d0_d1.append(['%i-%i' % (group_dict[group],d),group_dict[group],d,'dir'])
-d0_d1 = pd.DataFrame(d0_d1,columns=['name','d1','d2','link_type'])
-conlogistic = pd.concat([conlogistic,d0_d1])
-#
-for var in ['d1','d2']:
-    conlogistic['number_'+var] = conlogistic[var].apply(lambda x: d_num.get(x))
-    conlogistic['coef_'+var] = conlogistic[var].apply(lambda x: d_coef.get(x))
-conlogistic['number'] = conlogistic['name'].apply(lambda x: len([c for c in d1d2_array if x in c]))
-#conlogistic['coef'] = logistic['name'].apply(lambda x: d_com.get(x))
-conlogistic.to_csv(path + 'age/result/tra_summary_%s.csv' % (coe))
+#one set of summaries per penalty
+for coe in coe_lst:
+    #-------------------------------------------------------------------------------------------
+    #conditional logistic
+    conlogistic = pd.read_csv(path + 'age/result/conlogistic_summary_%s.csv' % (coe),index_col=0)
+    conlogistic['d1'] = conlogistic['name'].apply(lambda x: float(x.split('-')[0]))
+    conlogistic['d2'] = conlogistic['name'].apply(lambda x: float(x.split('-')[1]))
+    conlogistic['link_type'] = 'dir'
+    #d0-d1
+    d_first = conlogistic.loc[~conlogistic['d1'].isin(conlogistic.d2.values)]
+    d_first_lst = set(d_first.d1.values)
+    d0_d1 = []
+    for d in d_first_lst:
+        d0_d1.append(['%i-%i' % (group_dict[group],d),group_dict[group],d,'dir'])
+    d0_d1 = pd.DataFrame(d0_d1,columns=['name','d1','d2','link_type'])
+    conlogistic = pd.concat([conlogistic,d0_d1])
+    #
+    for var in ['d1','d2']:
+        conlogistic['number_'+var] = conlogistic[var].apply(lambda x: d_num.get(x))
+        conlogistic['coef_'+var] = conlogistic[var].apply(lambda x: d_coef.get(x))
+    conlogistic['number'] = conlogistic['name'].apply(lambda x: pair_index.ordered_count(*[float(d) for d in x.split('-')]))
+    #conlogistic['coef'] = logistic['name'].apply(lambda x: d_com.get(x))
+    conlogistic.to_csv(path + 'age/result/tra_summary_%s.csv' % (coe))
+    tra_paths(conlogistic).to_csv(path + 'age/result/tra_path_%s.csv' % (coe))
 
-#-------------------------------------------------------------------------------------------------------
+    #-------------------------------------------------------------------------------------------------------
 
-#-------------------------------------------------------------------------------------------
-#unconditional logistic
-unconlogistic = pd.read_csv(path + 'age/result/unconlogistic_summary_%s.csv' % (coe),index_col=0)
-unconlogistic['d1'] = unconlogistic['name'].apply(lambda x: float(x.split('-')[0]))
-unconlogistic['d2'] = unconlogistic['name'].apply(lambda x: float(x.split('-')[1]))
-unconlogistic['link_type'] = 'bi-dir'
-#
-for var in ['d1','d2']:
-    unconlogistic['number_'+var] = unconlogistic[var].apply(lambda x: d_num.get(x))
-    unconlogistic['coef_'+var] = unconlogistic[var].apply(lambda x: d_coef.get(x))
-unconlogistic['coef'] = unconlogistic['coef_1']
-unconlogistic.to_csv(path + 'age/result/com_summary_%s.csv' % (coe))
\ No newline at end of file
+    #-------------------------------------------------------------------------------------------
+    #unconditional logistic
+    unconlogistic = pd.read_csv(path + 'age/result/unconlogistic_summary_%s.csv' % (coe),index_col=0)
+    unconlogistic['d1'] = unconlogistic['name'].apply(lambda x: float(x.split('-')[0]))
+    unconlogistic['d2'] = unconlogistic['name'].apply(lambda x: float(x.split('-')[1]))
+    unconlogistic['link_type'] = 'bi-dir'
+    #
+    for var in ['d1','d2']:
+        unconlogistic['number_'+var] = unconlogistic[var].apply(lambda x: d_num.get(x))
+        unconlogistic['coef_'+var] = unconlogistic[var].apply(lambda x: d_coef.get(x))
+    unconlogistic['coef'] = unconlogistic['coef_1']
+    unconlogistic.to_csv(path + 'age/result/com_summary_%s.csv' % (coe))
\ No newline at end of file
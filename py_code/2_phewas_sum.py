@@ -6,57 +6,15 @@ Created on Wed Jun 30 19:29:34 2021
 """
 
 import pandas as pd
-import os
 import numpy as np
+from result_catalog import read_catalog
 path = r'~/depression/'
 
-phe = []
-for dir_,_,files in os.walk(path+'age/result/phewas1'):
-    for file in files:
-        if 'level1' in file:
-            path_file = os.path.join(dir_,file)
-            csv = pd.read_csv(path_file,index_col=0)
-        else:
-            continue
-        try:
-            phe = pd.concat([csv,phe])
-        except:
-            phe = csv.copy()
-phe.to_csv(path + 'age/result/cox_result_level1_del.csv')
-
-phe = []
-for dir_,_,files in os.walk(path+'age/result/phewas2'):
-    for file in files:
-        if 'level2' in file:
-            path_file = os.path.join(dir_,file)
-            csv = pd.read_csv(path_file,index_col=0)
-        else:
-            continue
-        try:
-            phe = pd.concat([csv,phe])
-        except:
-            phe = csv.copy()
-phe.to_csv(path + 'age/result/cox_result_level2_del.csv')
-
-level_1 =  pd.read_csv(path + 'age/result/cox_result_level1_del.csv')
-level_2 =  pd.read_csv(path + 'age/result/cox_result_level2_del.csv')
-
-def merge(L1, L2):
-    L2['disease'] = L2['disease'].apply(lambda x: str(x).split('.')[0])
-    L2_ = L2.drop_duplicates(subset='disease')
-    merge_df = []
-    for dis in L1['disease']:
-        if dis not in [float(x) for x in L2_['disease']]:
-            try:
-                merge_df = pd.concat([merge_df, L1.loc[L1['disease']==dis]])
-            except:
-                merge_df = L1.loc[L1['disease']==dis]
-    return merge_df
-
-merge_ = merge(level_1, level_2)
-level_2 =  pd.read_csv(path + 'age/result/cox_result_level2_del.csv')
-all_df = pd.concat([level_2, merge_])
-phe = all_df
+#level 2 phecodes and the level 1 phecodes without level 2 phecodes, from one PheWAS run
+phe = read_catalog(path+'age/result/phewas', '**/*L1L2*.csv', 'cox_result_L1L2',
+                   dtype={'disease':float,'coef':float,'se':float,'p':float})
+phe.to_csv(path + 'age/result/cox_result_L1L2_del.csv')
+phe = phe.reset_index(drop=True)
 phe_ = phe.loc[~phe['p'].isna()]
 phe_ = phe_.sort_values(by=['p'])
 phe_['order'] = np.arange(len(phe_))+1
@@ -79,7 +37,7 @@ def new_format(x):
         n = x[0].split('/')
         return '{0:,}/{1:,} {2:s}'.format(int(n[0]),float(n[1]),x[1])
     except:
-        return np.NaN
+        return np.nan
 
 for col in ['exp','unexp']:
     phe[col] = phe[col].apply(lambda x: new_format(x))
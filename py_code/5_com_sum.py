@@ -4,35 +4,13 @@ Created on Sun Jul  4 10:08:43 2021
 
 @author: Can Hou, Haowen Liu
 """
-import argparse
-#-----------------------------------------
-parser = argparse.ArgumentParser(description='New_depression project')
-parser.add_argument('--number', type=int)
-args = parser.parse_args()
-number = args.number
-#-----------------------------------------------
 import pandas as pd
 import numpy as np
-import os
+from result_catalog import read_catalog
 path = r'~/depression/'
 
-array = np.load(path + 'age/result/baseline_merged_main_group.npy', allow_pickle=True)
-array_columns = np.load(path + 'age/result/baseline_merged_columns_main_group.npy', allow_pickle=True)
-
-df_matched_group = pd.DataFrame(array, columns=array_columns)
-
-phe = []
-for dir_,_,files in os.walk(path+'age/result/comorbidityResult'):
-    for file in files:
-        if 'comorbidity_' in file:
-            path_file = os.path.join(dir_,file)
-            csv = pd.read_csv(path_file,index_col=0)
-        else:
-            continue
-        try:
-            phe = pd.concat([csv,phe])
-        except: 
-            phe = csv.copy()
+phe = read_catalog(path + 'age/result/comorbidityResult', 'comorbidity_all.csv', 'comorbidity',
+                   dtype={'d1':float,'d2':float,'RR':float,'p_rr':float,'phi':float,'p_phi':float})
 #
 phe_ = phe.loc[~phe['p_rr'].isna()]
 #RR
@@ -6,22 +6,12 @@ Created on Mon Jul  5 21:25:33 2021
 """
 import pandas as pd
 import numpy as np
-import os
+from result_catalog import read_catalog
 
 path = r'~/depression/'
-phe = []
-for dir_,_,files in os.walk(path+'age/result/binomial'):
-    for file in files:
-        if 'binomial_' in file:
-            path_file = os.path.join(dir_,file)
-            csv = pd.read_csv(path_file,index_col=0)
-        else:
-            continue
-        try:
-            phe = pd.concat([csv,phe])
-        except:
-            phe = csv.copy()
-            
+phe = read_catalog(path+'age/result/binomial', '**/*binomial_*.csv', 'binomial',
+                   dtype={'d1':float,'d2':float,'p':float})
+
 phe_ = phe.copy()
 phe_ = phe_.sort_values(by=['p'])
 phe_['order'] = np.arange(len(phe_))+1
@@ -9,130 +9,141 @@ import argparse
 #------------------
 parser = argparse.ArgumentParser(description='New_depression project')
 parser.add_argument("--number", type=int)
-parser.add_argument("--coe", type=float)
+parser.add_argument("--coe", type=float, nargs='+', help='one or more L1 penalties, fitted as one path')
+parser.add_argument("--resume", action='store_true', help='skip the pairs already persisted in a result shard of this run')
+parser.add_argument("--cache", type=float, default=1, help='memory (GB) of the matched-set cache')
+parser.add_argument("--run", type=str, default='', help='name of the run: the same name (and inputs) joins or resumes it, a new one starts a new run')
+parser.add_argument("--score_cutoff", type=float, help='fit only the pairs whose score test p-value is below this cutoff')
+parser.add_argument("--compress", action='store_true', help='collapse identical matched sets before fitting')
 args = parser.parse_args()
 number = args.number
 coe = args.coe
+resume = args.resume
+score_cutoff = args.score_cutoff
+compress = args.compress
 
 #logistic
 import pandas as pd
 import numpy as np
-import statsmodels.discrete.conditional_models as sm
 import warnings
-from statsmodels.stats.outliers_influence import variance_inflation_factor
 warnings.filterwarnings('ignore')
+from cohort_index import CohortIndex
+from cohort_store import CohortStore
+from phecode_index import EligibilityMatrix
+from risk_set import RiskSetMatcher, MatchedSetCache, one_year
+from conditional_logit import MatchedStrata, fit, fit_regularized_path
+from collinearity import vif_screen
+from score_screen import (NullFitCache, conditional_logit_null, conditional_logit_score_test, screened,
+                          screen_note)
+from work_queue import WorkQueue, input_signature
+from result_sink import ResultSink, read_shard, persisted_keys
 
 path = r'~/depression/'
+match_spec = {'exact':('sex','famIncome'), 'caliper_var':'birth_date', 'caliper':one_year, 'end_var':'time_end'}
+match_vars = list(match_spec['exact']) + [match_spec['caliper_var'], match_spec['end_var']]
+match_n, match_seed = 2, 0
+match_key = (tuple(sorted(match_spec.items())), match_n)
+matched_sets = MatchedSetCache(memory=int(args.cache*2**30))
+null_fits = NullFitCache()
 
-def defination(sick, history, inpatient):
-    if float(sick) in history or float(sick) in inpatient:
-        return 1
-    else:
-        return 0
+def defination(sick, history, inpatient_index):
+    """
+    1 if the disease is in the medical history or in the inpatient records
+    """
+    in_history = history.apply(lambda x: float(sick) in x).values.astype(bool)
+    return (in_history | inpatient_index.has_any([float(sick)])).astype(int)
 
 def d_match(dataset,time_var):
-    var1 = 'sex'
-    var2 = 'birth_date'
-    var3 = 'famIncome'
-    date_death = 'time_end'
-    n = 2
-    
+    """
+    2 controls per case from its risk set: same sex and famIncome, birth_date within
+    one year, alive and not yet a case at the case's event time
+    returns the match table indexed by the dataset rows
+    """
     print('Start matching')
-    one_year = 365.25*24*3600
-    case = dataset.loc[~dataset[time_var].isna()]
-    result = []
-    iter_ = 0
-    for j in case.index:
-        time_ = case.loc[j, time_var]
-        try:
-            t = dataset.loc[(dataset[var1]==case.loc[j,var1]) & 
-                             (np.abs(dataset[var2]-case.loc[j,var2])<=one_year) & 
-                             (dataset[var3]==case.loc[j,var3]) & 
-                             ~(dataset[date_death]<=time_) & 
-                             ~(dataset[time_var]<=time_)].sample(n,random_state=0)
-        except:
-            t = dataset.loc[(dataset[var1]==case.loc[j,var1]) & 
-                             (np.abs(dataset[var2]-case.loc[j,var2])<=one_year) & 
-                             (dataset[var3]==case.loc[j,var3]) & 
-                             ~(dataset[date_death]<=time_) & 
-                             ~(dataset[time_var]<=time_)]
-            
-        result.append([case.loc[j,'eid'],1,time_,iter_])
-        result += [[x,0,time_,iter_] for x in t.eid.values]
-        iter_ += 1
-    result = pd.DataFrame(result,columns=['eid','outcome_conlo','date_start_conlo','match_2_conlo'])
-    result = pd.merge(result,dataset,on='eid',how='left')
-    return result
+    return RiskSetMatcher(dataset, time_var, **match_spec).match(n=match_n, seed=match_seed)
+
+def matched_set_key(d1, d2):
+    return (d2, eligibility.signature(d1, d2), match_key, match_seed)
+
+def matched_set(d1, d2, df_matched_group):
+    """
+    match table of the population eligible for d1 and d2 with d2 as the outcome,
+    shared by the pairs with the same d2 and the same eligible population
+    """
+    key = matched_set_key(d1, d2)
+    def build():
+        dataset_d = df_matched_group.loc[eligibility.mask(d1, d2), ['eid'] + match_vars]
+        dataset_d['d2_time'] = inpatient_index.first_time([d2], rows=dataset_d.index.values)
+        return d_match(dataset_d,'d2_time')
+    return matched_sets(key, build)
 
 def logistic_conditional(d1d2, df_matched_group, illList):
-    dataset = df_matched_group.copy()
-    inpatient_variable = 'inpatient_level1'
-    eligible_variable = 'd_eligible'
     d1 = float(d1d2.split('-')[0])
     d2 = float(d1d2.split('-')[1])
     
     delDiseaseList = illList.copy()
     delDiseaseList.remove(str(d1)), delDiseaseList.remove(str(d2))
 
-    dataset['flag'] = dataset[eligible_variable].apply(lambda x: d1 in x and d2 in x)
-    dataset_d = dataset.loc[dataset['flag']==True]
-    
-    dataset_d['d2_time'] = dataset_d[inpatient_variable].apply(lambda x: x.get(d2,np.NaN))
-    dataset_d['d1_time'] = dataset_d[inpatient_variable].apply(lambda x: x.get(d1,np.NaN))
-    dataset_d_matched = d_match(dataset_d,'d2_time')
-    dataset_d_matched['exposure'] = dataset_d_matched.apply(lambda row: 1 if 
-                                                            row['d1_time']<row['date_start_conlo'] else 0,
-                                                            axis=1)
+    match_table = matched_set(d1, d2, df_matched_group)
+    #controls can be matched to several cases, so the rows are taken by position
+    dataset_d_matched = df_matched_group.loc[match_table.index].reset_index(drop=True)
+    dataset_d_matched = dataset_d_matched.assign(**{x:match_table[x].values for x in
+                                                    ['outcome_conlo','date_start_conlo','match_2_conlo']})
+    d1_time = inpatient_index.first_time([d1], rows=match_table.index.values)
+    dataset_d_matched['exposure'] = (d1_time < match_table['date_start_conlo'].values).astype(int)
  
     var_co_vars_lst_d = dataset_d_matched[co_vars].var()
     co_vars_selected = var_co_vars_lst_d[var_co_vars_lst_d != 0].index
     var_covar_lst_d = dataset_d_matched[delDiseaseList].var()
     delDiseaseList = var_covar_lst_d[var_covar_lst_d != 0].index
     
-    model = sm.ConditionalLogit(np.asarray(dataset_d_matched['outcome_conlo'],dtype=int),
-                        np.asarray(dataset_d_matched[['exposure'] + list(co_vars_selected) + list(delDiseaseList)],dtype=int),
-                        groups=dataset_d_matched['match_2_conlo'].values)
+    covar_lst = ['exposure'] + list(co_vars_selected) + list(delDiseaseList)
+    strata = MatchedStrata(dataset_d_matched['outcome_conlo'].values, dataset_d_matched[covar_lst].values,
+                           dataset_d_matched['match_2_conlo'].values)
+    if compress:
+        strata = strata.collapse()
     len_d_other, len_cov = len(delDiseaseList), 1 + len(co_vars_selected)
-    result = model.fit_regularized(method='elastic_net',alpha=[0]*len_cov+[coe]*len_d_other)
-    
-    ii = np.flatnonzero(result.params)
-    covar_lst_all = dataset_d_matched[['exposure'] + list(co_vars_selected) + list(delDiseaseList)].iloc[:,ii].columns
-    covar_lst_all_d = [x for x in covar_lst_all if x in list(delDiseaseList)]
-    
-    new_dataset = dataset_d_matched[covar_lst_all_d]
-    new_dataset['constant'] = 1
-    covar_lst_all_d1 = []
-    for i in range(len(new_dataset.columns)-1):
-        try:
-            vif = variance_inflation_factor(new_dataset.values, i)
-            if vif < 5:
-                covar_lst_all_d1.append(new_dataset.columns[i])
-        except:
-            covar_lst_all_d1.append(new_dataset.columns[i])
-        
-    model_refit = sm.ConditionalLogit(np.asarray(dataset_d_matched['outcome_conlo'],dtype=int),
-                                      np.asarray(dataset_d_matched[['exposure'] + list(co_vars_selected) + list(covar_lst_all_d1)],dtype=int),
-                                      groups=dataset_d_matched['match_2_conlo'].values)
-    
+    if score_cutoff is not None:
+        #the null model (covariates only) is shared by all the pairs on the same matched sets
+        strata_cov = strata.take(np.arange(len_cov))
+        null_params = null_fits(matched_set_key(d1, d2), lambda: conditional_logit_null(strata_cov))
+        statistic, p_score = conditional_logit_score_test(strata_cov, null_params)
+        if screened(p_score, score_cutoff):
+            return [[d1d2,c,np.nan,np.nan,np.nan,screen_note(statistic,p_score)] for c in coe]
+    #one warm-started penalty path for all the coe values, one refit per distinct selection
+    path_ = fit_regularized_path(strata, [[0]*len_cov+[c]*len_d_other for c in coe])
+    refits = {}
+    records = []
+    for c, (params, _, _) in zip(coe, path_):
+        ii = np.flatnonzero(params)
+        covar_lst_all = dataset_d_matched[covar_lst].iloc[:,ii].columns
+        covar_lst_all_d = tuple(x for x in covar_lst_all if x in list(delDiseaseList))
+        if covar_lst_all_d not in refits:
+            refits[covar_lst_all_d] = refit(strata, covar_lst, list(co_vars_selected),
+                                            vif_screen(dataset_d_matched[list(covar_lst_all_d)], threshold=5))
+        records.append([d1d2,c] + refits[covar_lst_all_d])
+    return records
+
+def refit(strata, covar_lst, co_vars_selected, covar_lst_all_d1):
+    """
+    unpenalized refit on the exposure, the covariates and the selected diseases
+    returns [coef, p, OR_CI, note]
+    """
     try:
-        try:
-            result_refit = model_refit.fit(maxiter=300)
-            return [d1d2,result_refit.params[0],result_refit.pvalues[0],'%.2f (%.2f-%.2f)' % (np.exp(result_refit.params[0]),
-                                                          np.exp(result_refit.conf_int()[0][0]),
-                                                          np.exp(result_refit.conf_int()[0][1])),np.NaN]
-        except:
-            result_refit = model_refit.fit(method='cg', maxiter=300)
-            return [d1d2,result_refit.params[0],result_refit.pvalues[0],'%.2f (%.2f-%.2f)' % (np.exp(result_refit.params[0]),
-                                                          np.exp(result_refit.conf_int()[0][0]),
-                                                          np.exp(result_refit.conf_int()[0][1])),np.NaN]
+        refit_lst = ['exposure'] + co_vars_selected + covar_lst_all_d1
+        result_refit = fit(strata.take([covar_lst.index(x) for x in refit_lst]), maxiter=300)
+        coef, se = result_refit.params[0], result_refit.bse[0]
+        return [coef,result_refit.pvalues[0],'%.2f (%.2f-%.2f)' % (np.exp(coef),np.exp(coef-1.96*se),
+                                                                   np.exp(coef+1.96*se)),
+                np.nan if result_refit.converged else result_refit.message]
     except Exception as e:
         print(e)
-        return [d1d2,np.NaN,np.NaN,np.NaN,e]
-
-array = np.load(path +'result/baseline_merged_main_group.npy', allow_pickle=True)
-array_columns = np.load(path + 'result/baseline_merged_columns_main_group.npy', allow_pickle=True)
+        return [np.nan,np.nan,np.nan,str(e)]
 
-df_matched_group = pd.DataFrame(array, columns=array_columns)
+df_matched_group = CohortStore(path + 'result/main_group_store').read(['eid','sex','birth_date','famIncome','time_end',
+                                                                       'civil','education','history_level1'])
+eligibility = EligibilityMatrix.load(path + 'result/eligibility_main_group.npz')
+inpatient_index = CohortIndex.load(path + 'result/inpatient_level1_index_main_group.npz')
 binomial_directional = pd.read_csv(path + 'result/binomial_directional.csv', index_col=0)
 have_binomial_directional = pd.read_csv(path + 'result/have_binomial_directional.csv', index_col=0)
 
@@ -152,31 +163,55 @@ for i in range(len(all_trajactory_list)):
     illnessList.append(str(all_trajactory_list[i].split('-')[1]))
 illnessList = list(set(illnessList))
 for ill in illnessList:    
-    df_matched_group[str(ill)] = df_matched_group.apply(lambda row: defination(ill, row['history_level1'], [value for key, value in enumerate(row['inpatient_level1'])]), axis=1)
+    df_matched_group[str(ill)] = defination(ill, df_matched_group['history_level1'], inpatient_index)
 
 np.random.seed(number)
 np.random.shuffle(trajactory_list)
-total_length = len(trajactory_list)
 
 have_pair_conlo = pd.read_csv(path + 'result/have_conlogistic.csv', index_col=0)
 have_pair_conlo = have_pair_conlo.loc[~have_pair_conlo['p'].isna()]
 have_pair_conlo_list = [x for x in have_pair_conlo['name']]
 
-result_final = []
-for i in range(len(trajactory_list)):
-    pair = trajactory_list[i]
-    with open (path+'temp.cache','r') as f:
-        pair_exl = f.read()
-    if pair not in pair_exl.split(','):
-        with open (path+'temp.cache','a') as f:
-            f.write(',%s' % (pair))
-        progress = (len(pair_exl.split(','))+1)/len(trajactory_list)
-        print('%i: %.2f%% in condition logistic' % (number,progress*100))
-        if pair in have_pair_conlo_list:
-            result_final.append(have_pair_conlo.loc[have_pair_conlo['name']==pair][['name','coef','p','OR_CI','note']])
-        else:
-            result_final.append(logistic_conditional(pair, df_matched_group, illnessList))
-    else:
-        continue
-logistic_result = pd.DataFrame(result_final,columns=['name','coef','p','OR_CI','note'])
-logistic_result.to_csv(path + 'result/conlogistic/logistic_%i.csv' % (number))
+#pairs with the same outcome disease share their matched sets, so a task is one d2
+pair_dict = {}
+for pair in trajactory_list:
+    pair_dict.setdefault(pair.split('-')[1], []).append(pair)
+queue = WorkQueue(path + 'work_queue.db', 'conlogistic')
+result_columns = ['name','coe','coef','p','OR_CI','note']
+#a new run starts by itself when the pairs, the options or the inputs change; the shards of an
+#earlier run are started empty, a rerun of this run keeps its shard
+run = queue.start(pair_dict.keys(), input_signature((args.run, coe, score_cutoff, compress),
+                                                    [path + 'result/' + x for x in ['main_group_store',
+                                                     'eligibility_main_group.npz', 'inpatient_level1_index_main_group.npz',
+                                                     'binomial_directional.csv', 'have_binomial_directional.csv',
+                                                     'have_conlogistic.csv']]))
+sink = ResultSink(path + 'result/conlogistic/logistic_%i.sqlite' % (number), result_columns, run=run)
+persisted = persisted_keys(path + 'result/conlogistic/logistic_*.sqlite', run=run) if resume else set()
+#the lease is renewed per pair, and a failed task is given back to the queue
+for key in queue.drain(number):
+    with queue.holding(key):
+        done, total = queue.progress()
+        print('%i: %.2f%% in condition logistic' % (number,done/total*100))
+        written = []
+        for pair in pair_dict[key]:
+            #results are keyed by pair and coe
+            if all('%s_%s' % (pair,c) in persisted for c in coe):
+                continue
+            if pair in have_pair_conlo_list:
+                record = have_pair_conlo.loc[have_pair_conlo['name']==pair][['coef','p','OR_CI','note']].values[0]
+                records = [[pair,c] + list(record) for c in coe]
+            else:
+                records = logistic_conditional(pair, df_matched_group, illnessList)
+            for record in records:
+                sink.append('%s_%s' % (pair,record[1]), record)
+                written.append('%s_%s' % (pair,record[1]))
+            queue.heartbeat(key)
+        if not queue.complete(key):
+            print('%i: lease of %s lost to another worker, its results here are dropped' % (number,key))
+            sink.discard(written)
+sink.close()
+print('%i: matched sets %i built, %i reused' % (number,matched_sets.misses,matched_sets.hits))
+if score_cutoff is not None:
+    print('%i: null models %i fitted, %i reused' % (number,null_fits.misses,null_fits.hits))
+logistic_result = read_shard(sink.file)
+logistic_result.to_csv(path + 'result/conlogistic/logistic_%i.csv' % (number))
\ No newline at end of file
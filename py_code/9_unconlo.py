@@ -9,90 +9,152 @@ import argparse
 #------------------
 parser = argparse.ArgumentParser(description='New_depression project')
 parser.add_argument("--number", type=int)
-parser.add_argument("--coe", type=float)
+parser.add_argument("--coe", type=float, nargs='+', help='one or more L1 penalties, fitted as one path')
+parser.add_argument("--resume", action='store_true', help='skip the pairs already persisted in a result shard of this run')
+parser.add_argument("--compress", action='store_true', help='collapse identical covariate patterns before fitting')
+parser.add_argument("--processes", type=int, default=1, help='processes fitting the pairs of this worker')
+parser.add_argument("--run", type=str, default='', help='name of the run: the same name (and inputs) joins or resumes it, a new one starts a new run')
+parser.add_argument("--score_cutoff", type=float, help='fit only the pairs whose score test p-value is below this cutoff')
 args = parser.parse_args()
 number = args.number
 coe = args.coe
+resume = args.resume
+compress = args.compress
+processes = args.processes
+score_cutoff = args.score_cutoff
 #logistic
 import pandas as pd
 import numpy as np
 import statsmodels.api as sm
 import warnings
-from statsmodels.stats.outliers_influence import variance_inflation_factor
 warnings.filterwarnings('ignore')
-from sklearn.linear_model import LogisticRegression as LR
 import time
+import collections
+import multiprocessing
+from cohort_index import CohortIndex
+from cohort_store import CohortStore
+from phecode_index import EligibilityMatrix
+from work_queue import WorkQueue, input_signature
+from result_sink import ResultSink, read_shard, persisted_keys
+from pattern_compression import compress_patterns, weighted_logit
+from penalized import l1_logit_path
+from collinearity import vif_screen
+from rpcn import SharedDesign, warm_start
+from score_screen import NullFitCache, logit_null, logit_score_test, screened, screen_note
 
 path = r'~/depression/'
-
-def defination(sick, history, inpatient):
-    if float(sick) in history or float(sick) in inpatient:
-        return 1
-    else:
-        return 0
-
-def logistic_unconditional(d1d2, df_matched_group, illList):
+null_fits = NullFitCache()
+
+def defination(sick, history, inpatient_index):
+    """
+    1 if the disease is in the medical history or in the inpatient records
+    """
+    in_history = history.apply(lambda x: float(sick) in x).values.astype(bool)
+    return (in_history | inpatient_index.has_any([float(sick)])).astype(int)
+
+def logistic_unconditional(d1d2, beta0):
+    """
+    L1 path over coe and unpenalized refits of one pair on the shared design
+    beta0: {column: coefficient} of the previous pair, the warm start
+    returns (records, coefficients at the largest coe)
+    """
     time1 = time.time()
-    dataset = df_matched_group
-    inpatient_variable = 'inpatient_level1'
-    eligible_variable = 'd_eligible'
     temp = []
     
     d1 = float(d1d2.split('-')[0])
     d2 = float(d1d2.split('-')[1])
     
-    delDiseaseList = illList.copy()
-    try:
-        delDiseaseList.remove(str(d1))
-    except:
-        delDiseaseList = delDiseaseList
-    try:
-        delDiseaseList.remove(str(d2))
-    except:
-        delDiseaseList = delDiseaseList
-        
-    dataset['flag'] = dataset[eligible_variable].apply(lambda x: d1 in x and d2 in x)
-    dataset_d = dataset.loc[dataset['flag']==True]
-    var_co_vars_lst_d = dataset_d[co_vars].var()
-    co_vars_selected = var_co_vars_lst_d[var_co_vars_lst_d != 0].index
-    var_covar_lst_d = dataset_d[delDiseaseList].var()
-    delDiseaseList = var_covar_lst_d[var_covar_lst_d != 0].index
-
-    dataset_d['d1'] = dataset_d[inpatient_variable].apply(lambda x: 1 if d1 in x.keys() else 0)    
-    dataset_d['d2'] = dataset_d[inpatient_variable].apply(lambda x: 1 if d2 in x.keys() else 0)
-    dataset_d['constant'] = 1
-
-    model = LR(solver='saga', penalty='l1', random_state=42, C=coe**(-1), n_jobs=1)
-    model.fit(np.asarray(dataset_d[['d2','constant'] + list(co_vars_selected) + list(delDiseaseList)], dtype=int),
-                           np.asarray(dataset_d['d1'], dtype=int))
-    ii = np.flatnonzero(model.coef_)
-    ii_ = ii[np.where(ii>(np.asarray(dataset_d[['d2','constant'] + list(co_vars_selected)]).shape[1]-1))]
-    covar_lst_all_d1 = dataset_d[['d2','constant'] + list(co_vars_selected) + list(delDiseaseList)].iloc[:,ii_].columns
-
-    model1 = sm.Logit(np.asarray(dataset_d['d1'],dtype=int),
-                                np.asarray(dataset_d[['d2','constant'] + list(co_vars_selected) + list(covar_lst_all_d1)], dtype=int))
+    rows = eligibility.rows(d1, d2)
+    X_d, co_vars_selected, delDiseaseList = design.pair(rows, drop=[str(d1), str(d2)])
+    y = inpatient_index.has_any([d1], rows=rows).astype(int)
+    X = np.column_stack([inpatient_index.has_any([d2], rows=rows), np.ones(len(rows)), X_d])
+    covar_lst = ['d2','constant'] + co_vars_selected + delDiseaseList
+    n_fixed = len(co_vars_selected) + 2
+
+    if score_cutoff is not None:
+        #the null model (constant and covariates) is shared by all the d2 with the same eligible population
+        if compress:
+            y0_, X0_, _, weights0 = compress_patterns(y, X[:, :n_fixed])
+        else:
+            y0_, X0_, weights0 = y, X[:, :n_fixed], None
+        null_params = null_fits((d1, eligibility.signature(d1, d2)), lambda: logit_null(X0_, y0_, weights0))
+        statistic, p_score = logit_score_test(X0_, y0_, null_params, weights0)
+        if screened(p_score, score_cutoff):
+            return [[d1d2,c,np.nan,np.nan,np.nan,screen_note(statistic,p_score)] for c in coe], beta0
+
+    #the penalty path from the largest coe down, warm-started from the previous pair
+    if compress:
+        y_, X_, _, weights = compress_patterns(y, X)
+    else:
+        y_, X_, weights = y, X, None
+    alphas = []
+    for c in coe:
+        alpha = np.full(X.shape[1], c)
+        alpha[1] = 0 #constant, plays the role of the unpenalized intercept
+        alphas.append(alpha)
+    path_ = l1_logit_path(X_, y_, alphas, weights=weights, beta0=warm_start(beta0, covar_lst))
+    refits = {}
+    for c, (coef, _, _) in zip(coe, path_):
+        ii = np.flatnonzero(coef)
+        ii_ = ii[ii > n_fixed-1]
+        if tuple(ii_) not in refits:
+            refits[tuple(ii_)] = refit(X[:, np.r_[np.arange(n_fixed), ii_].astype(int)], y)
+        temp.append([d1d2,c] + refits[tuple(ii_)])
+    time2 = time.time()
+    print('Spent %0.2f s time' % (time2 - time1))
+    return temp, dict(zip(covar_lst, path_[int(np.argmax(coe))][0]))
+
+def refit(X1, y):
+    """
+    unpenalized logistic regression of d1 on d2, the covariates and the selected diseases
+    returns [coef, p, OR_CI, note]
+    """
+    if compress:
+        y1_, X1_, _, weights1 = compress_patterns(y, X1)
+        model1 = weighted_logit(y1_, X1_, weights1)
+    else:
+        model1 = sm.Logit(y, X1)
     try:
         try:
             result = model1.fit(maxiter=300)
-            temp += [d1d2, result.params[0], result.pvalues[0],'%.2f (%.2f-%.2f)' % (np.exp(result.params[0]),
-                                                                                     np.exp(result.conf_int()[0][0]),
-                                                                                     np.exp(result.conf_int()[0][1])), np.NaN]
+            return [result.params[0], result.pvalues[0],'%.2f (%.2f-%.2f)' % (np.exp(result.params[0]),
+                                                                             np.exp(result.conf_int()[0][0]),
+                                                                             np.exp(result.conf_int()[0][1])), np.nan]
         except:
             result = model1.fit(method='cg', maxiter=300)
-            temp += [d1d2, result.params[0], result.pvalues[0],'%.2f (%.2f-%.2f)' % (np.exp(result.params[0]),
-                                                                                     np.exp(result.conf_int()[0][0]),
-                                                                                     np.exp(result.conf_int()[0][1])), np.NaN]
+            return [result.params[0], result.pvalues[0],'%.2f (%.2f-%.2f)' % (np.exp(result.params[0]),
+                                                                             np.exp(result.conf_int()[0][0]),
+                                                                             np.exp(result.conf_int()[0][1])), np.nan]
     except Exception as e:
         print(e)
-        temp += [d1d2,np.NaN,np.NaN,np.NaN,e]
-    time2 = time.time()
-    print('Spent %0.2f s time' % (time2 - time1))
-    return temp
-
-array = np.load(path +'result/baseline_merged_main_group.npy', allow_pickle=True)
-array_columns = np.load(path + 'result/baseline_merged_columns_main_group.npy', allow_pickle=True)
-
-df_matched_group = pd.DataFrame(array,columns=array_columns)
+        return [np.nan,np.nan,np.nan,str(e)]
+
+def fit_group(key, heartbeat=None):
+    """
+    all pairs with the same d1, in order, each warm-started from the previous one;
+    heartbeat(key) after each pair when the task is fitted in the claiming process
+    returns (key, records)
+    """
+    beta0 = {}
+    records = []
+    for pair in pair_dict[key]:
+        #results are keyed by pair and coe
+        if all('%s_%s' % (pair,c) in persisted for c in coe):
+            continue
+        if pair in have_pair_unconlo_list:
+            record = have_pair_unconlo.loc[have_pair_unconlo['name']==pair][['coef_1','p_1','OR_CI_1','note1']].values[0]
+            records += [[pair,c] + list(record) for c in coe]
+        else:
+            records_, beta0 = logistic_unconditional(pair, beta0)
+            records += records_
+        if heartbeat is not None:
+            heartbeat(key)
+    return key, records
+
+df_matched_group = CohortStore(path + 'result/main_group_store').read(['age','civil','famIncome','education','sex',
+                                                                       'history_level1'])
+eligibility = EligibilityMatrix.load(path + 'result/eligibility_main_group.npz')
+inpatient_index = CohortIndex.load(path + 'result/inpatient_level1_index_main_group.npz')
 binomial_comorbidity = pd.read_csv(path + 'result/binomial_comorbidity.csv', index_col=0)
 have_binomial_comorbidity = pd.read_csv(path + 'result/have_binomial_comorbidity.csv', index_col=0)
 all_binomial_comorbidity = pd.concat([binomial_comorbidity, have_binomial_comorbidity])
@@ -112,42 +174,78 @@ for i in range(len(all_trajactory_list)):
     illnessList.append(str(all_trajactory_list[i].split('-')[1]))
 illnessList = list(set(illnessList))
 for ill in illnessList:    
-    df_matched_group[str(ill)] = df_matched_group.apply(lambda row: defination(ill, row['history_level1'], [value for key, value in enumerate(row['inpatient_level1'])]), axis=1)
+    df_matched_group[str(ill)] = defination(ill, df_matched_group['history_level1'], inpatient_index)
 
-new_dataset = df_matched_group[illnessList]
-new_dataset['constant'] = 1
-covar_lst_all_d = []
-for i in range(len(new_dataset.columns)-1):
-    try:
-        vif = variance_inflation_factor(new_dataset.values, i)
-        if vif < 5:
-            covar_lst_all_d.append(new_dataset.columns[i])
-    except:
-        covar_lst_all_d.append(new_dataset.columns[i])
+#all VIFs at once from the inverse correlation matrix of the disease columns
+covar_lst_all_d = vif_screen(df_matched_group[illnessList], threshold=5)
 
-np.random.seed(number)
-np.random.shuffle(trajactory_list)
-total_length = len(trajactory_list)
+#the covariate block shared by all pairs, built once
+design = SharedDesign(df_matched_group, co_vars, covar_lst_all_d)
+del df_matched_group
 
 have_pair_unconlo = pd.read_csv(path + 'result/have_unconlogistic.csv', index_col=0)
 have_pair_unconlo = have_pair_unconlo.loc[~have_pair_unconlo['p'].isna()]
 have_pair_unconlo_list = [x for x in have_pair_unconlo['name']]
 
-result_final = []
-for i in range(len(trajactory_list)):
-    pair = trajactory_list[i]
-    with open (path+'temp.cache','r') as f:
-        pair_exl = f.read()
-    if pair not in pair_exl.split(','):
-        with open (path+'temp.cache','a') as f:
-            f.write(',%s' % (pair))
-        progress = (len(pair_exl.split(','))+1)/len(trajactory_list)
-        print('%i: %.2f%% in uncondition logistic' % (number,progress*100))
-        if pair in have_pair_unconlo_list:
-            result_final.append(have_pair_unconlo.loc[have_pair_unconlo['name']==pair][['name','coef_1','p_1','OR_CI_1','note1']])
-        else:
-            result_final.append(logistic_unconditional(pair, df_matched_group, covar_lst_all_d))
-    else:
-        continue
-logistic_result = pd.DataFrame(result_final,columns=['name','coef_1','p_1','OR_CI_1','note1'])
-logistic_result.to_csv(path + 'result/unconlogistic/unconlogistic_%i.csv' % (number))
+#pairs with the same d1 share the outcome, so a task is one d1 and its pairs are warm-started in turn
+pair_dict = {}
+for pair in sorted(trajactory_list):
+    pair_dict.setdefault(pair.split('-')[0], []).append(pair)
+queue = WorkQueue(path + 'work_queue.db', 'unconlogistic')
+result_columns = ['name','coe','coef_1','p_1','OR_CI_1','note1']
+#a new run starts by itself when the pairs, the options or the inputs change; the shards of an
+#earlier run are started empty, a rerun of this run keeps its shard
+run = queue.start(pair_dict.keys(), input_signature((args.run, coe, score_cutoff, compress),
+                                                    [path + 'result/' + x for x in ['main_group_store',
+                                                     'eligibility_main_group.npz', 'inpatient_level1_index_main_group.npz',
+                                                     'binomial_comorbidity.csv', 'have_binomial_comorbidity.csv',
+                                                     'have_unconlogistic.csv']]))
+sink = ResultSink(path + 'result/unconlogistic/unconlogistic_%i.sqlite' % (number), result_columns, run=run)
+persisted = persisted_keys(path + 'result/unconlogistic/unconlogistic_*.sqlite', run=run) if resume else set()
+def write(key, records):
+    for record in records:
+        sink.append('%s_%s' % (record[0],record[1]), record)
+    if not queue.complete(key):
+        print('%i: lease of %s lost to another worker, its results here are dropped' % (number,key))
+        sink.discard(['%s_%s' % (record[0],record[1]) for record in records])
+    done, total = queue.progress()
+    print('%i: %.2f%% in uncondition logistic' % (number,done/total*100))
+
+def write_oldest(in_flight):
+    """
+    write the oldest task in flight, renewing the leases of all of them while it is fitted;
+    it leaves the deque once written, so a failed task is still there to be released
+    """
+    result = in_flight[0][1]
+    while not result.ready():
+        result.wait(queue.heartbeat_interval)
+        for key, _ in in_flight:
+            queue.heartbeat(key)
+    write(*result.get())
+    in_flight.popleft()
+
+#forked processes share the design; tasks are claimed, renewed and written by this process only,
+#with at most `processes` tasks in flight. A failed task is given back to the queue
+if processes > 1:
+    pool = multiprocessing.get_context('fork').Pool(processes)
+    in_flight = collections.deque()
+    try:
+        for key in queue.drain(number):
+            in_flight.append((key, pool.apply_async(fit_group, (key,))))
+            if len(in_flight) >= processes:
+                write_oldest(in_flight)
+        while in_flight:
+            write_oldest(in_flight)
+    except BaseException:
+        for key, _ in in_flight:
+            queue.release(key)
+        raise
+    finally:
+        pool.terminate()
+else:
+    for key in queue.drain(number):
+        with queue.holding(key):
+            write(*fit_group(key, queue.heartbeat))
+sink.close()
+logistic_result = read_shard(sink.file)
+logistic_result.to_csv(path + 'result/unconlogistic/unconlogistic_%i.csv' % (number))
\ No newline at end of file
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Binomial test of the temporal direction of all disease pairs at once.
+
+For a pair diagnosed together in n patients, k of them with the dominant
+order, the one-sided exact p-value P(X >= k), X ~ Binomial(n, 0.5), is the
+regularized incomplete beta function I_0.5(k, n - k + 1) (1 for k = 0), so
+the p-values of every pair come from one scipy.special.betainc call instead
+of a binom_test per pair. The dominant order is picked in the same pass, as
+d1d2_selection did: d1 -> d2 when forward >= reverse, d2 -> d1 otherwise.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.special import betainc
+
+result_columns = ['d1','d2','name','length','N','p']
+
+
+def binomial_greater(k, n, p=0.5):
+    """
+    P(X >= k) for X ~ Binomial(n, p), elementwise over the arrays k, n
+    """
+    k, n = np.broadcast_arrays(np.asarray(k, dtype=np.float64), np.asarray(n, dtype=np.float64))
+    with np.errstate(invalid='ignore'):
+        p_value = betainc(np.maximum(k, 1), n - k + 1, p)
+    return np.where(k <= 0, 1.0, np.where(k > n, 0.0, p_value))
+
+
+def direction_table(d1, d2, forward, reverse, full):
+    """
+    one row per pair in the dominant order: d1, d2, name "d1-d2", length (patients
+    with that order), N (patients with both), p
+    forward / reverse: patients with d1 before d2 / d2 before d1, full: with both
+    """
+    d1, d2 = np.asarray(d1), np.asarray(d2)
+    forward, reverse, full = [np.asarray(x, dtype=np.int64) for x in (forward, reverse, full)]
+    keep = forward >= reverse
+    first, second = np.where(keep, d1, d2), np.where(keep, d2, d1)
+    length = np.where(keep, forward, reverse)
+    result = pd.DataFrame({'d1':first, 'd2':second,
+                           'name':['%s-%s' % (str(x), str(y)) for x, y in zip(first, second)],
+                           'length':length, 'N':full, 'p':binomial_greater(length, full)})
+    return result[result_columns]
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse patient x phecode index of first diagnosis times.
+
+Row i of the index is row i of the cohort DataFrame it was built from, column j
+is one phecode. A stored value is the first diagnosis time of that phecode for
+that patient, encoded as an int32 day offset from the earliest time in the
+cohort (plus one, so that a diagnosis on the origin day is still an explicit
+entry). If the times are not whole days apart the offsets fall back to float64
+seconds, so decoding is always exact.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from shared_cohort import load_npz
+
+one_day = 24*3600
+
+
+def phecode_key(x):
+    """
+    integer key of a phecode, robust to float representation
+    examples：250.2 --> 25020
+    008.52 --> 852
+    """
+    return np.round(np.asarray(x, dtype=np.float64)*100).astype(np.int64)
+
+
+def encode_times(times):
+    """
+    encode absolute times (seconds) as offsets from the earliest time
+    returns (offsets, origin, unit); offsets start at 1
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int32), 0.0, float(one_day)
+    origin = float(times.min())
+    days = np.round((times - origin)/one_day)
+    if np.array_equal(origin + days*one_day, times) and days.max() < np.iinfo(np.int32).max:
+        return (days + 1).astype(np.int32), origin, float(one_day)
+    return times - origin + 1, origin, 1.0
+
+
+def _flatten(series):
+    """
+    flatten a column of dicts (phecode -> time) or lists (phecodes) into
+    row, code and time arrays; time is NaN for list entries
+    """
+    rows, codes, times = [], [], []
+    for i, x in enumerate(series):
+        if isinstance(x, dict):
+            for k, v in x.items():
+                if pd.isna(k) or pd.isna(v):
+                    continue
+                rows.append(i)
+                codes.append(k)
+                times.append(v)
+        elif isinstance(x, (list, tuple, set, np.ndarray)):
+            for k in x:
+                if pd.isna(k):
+                    continue
+                rows.append(i)
+                codes.append(k)
+                times.append(np.nan)
+    return (np.asarray(rows, dtype=np.int64), np.asarray(codes, dtype=np.float64),
+            np.asarray(times, dtype=np.float64))
+
+
+class CohortIndex(object):
+    """
+    First diagnosis time per (patient, phecode) stored as a CSC matrix.
+
+    Use from_series() on the 'inpatient' style dict column (or a list column
+    such as 'history', which gives a presence-only index), then query whole
+    phecode sets at once with first_time() / has_any().
+    """
+
+    def __init__(self, matrix, phecodes, origin=0.0, unit=float(one_day), timed=True):
+        self.matrix = sparse.csc_matrix(matrix)
+        self.matrix.sort_indices()
+        self.phecodes = np.asarray(phecodes, dtype=np.float64)
+        self.keys = phecode_key(self.phecodes)
+        self.origin = float(origin)
+        self.unit = float(unit)
+        self.timed = timed
+
+    @property
+    def n_patients(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def from_arrays(cls, rows, codes, times, n_patients):
+        """
+        build from flat (row, phecode, time) arrays; duplicated
+        (row, phecode) entries keep the earliest time
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        keys = phecode_key(codes)
+        times = np.asarray(times, dtype=np.float64)
+        timed = not np.all(np.isnan(times))
+        if not timed:
+            times = np.zeros(len(times))
+        #earliest time per (row, phecode)
+        order = np.lexsort((times, keys, rows))
+        rows, keys, times = rows[order], keys[order], times[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (keys[1:] != keys[:-1])
+        rows, keys, times = rows[first], keys[first], times[first]
+
+        uniq_keys, cols = np.unique(keys, return_inverse=True)
+        data, origin, unit = encode_times(times)
+        matrix = sparse.csc_matrix((data, (rows, cols)), shape=(n_patients, len(uniq_keys)))
+        return cls(matrix, uniq_keys/100, origin, unit, timed)
+
+    @classmethod
+    def from_series(cls, series):
+        """
+        build from a column of dicts (phecode -> first time) or lists
+        """
+        rows, codes, times = _flatten(series)
+        return cls.from_arrays(rows, codes, times, len(series))
+
+    #------------------------------------------------------------------
+    def columns(self, codes):
+        """
+        column positions of the given phecodes, codes not in the index are dropped
+        """
+        keys = np.atleast_1d(phecode_key(codes))
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.clip(pos, 0, max(len(self.keys)-1, 0))
+        if len(self.keys) == 0:
+            return pos[:0]
+        return np.unique(pos[self.keys[pos] == keys])
+
+    def columns_in_range(self, lower, upper):
+        """
+        column positions of all phecodes with lower <= phecode <= upper
+        """
+        start = np.searchsorted(self.keys, phecode_key(lower), side='left')
+        stop = np.searchsorted(self.keys, phecode_key(upper), side='right')
+        return np.arange(start, stop)
+
+    def _min_offset(self, cols):
+        """
+        per-patient minimum stored offset over the given columns, 0 if absent
+        """
+        out = np.zeros(self.n_patients, dtype=self.matrix.dtype)
+        if len(cols) == 0:
+            return out
+        sub = self.matrix[:, cols].tocsr()
+        has = np.diff(sub.indptr) > 0
+        if has.any():
+            out[has] = np.minimum.reduceat(sub.data, sub.indptr[:-1][has])
+        return out
+
+    def decode(self, offsets):
+        """
+        stored offsets back to absolute times (seconds), NaN where absent
+        """
+        offsets = np.asarray(offsets, dtype=np.float64)
+        return np.where(offsets > 0, self.origin + (offsets - 1)*self.unit, np.nan)
+
+    def first_time(self, codes, rows=None):
+        """
+        earliest diagnosis time over a set of phecodes, NaN if none of them occurred
+        """
+        result = self.decode(self._min_offset(self.columns(codes)))
+        return result if rows is None else result[rows]
+
+    def first_time_range(self, lower, upper, rows=None):
+        """
+        earliest diagnosis time over all phecodes in [lower, upper]
+        """
+        result = self.decode(self._min_offset(self.columns_in_range(lower, upper)))
+        return result if rows is None else result[rows]
+
+    def first_occurrences(self, code_sets):
+        """
+        first_time() for many phecode sets in one pass, as sparse triplets
+        (set position, patient row, earliest time) of the patients with an
+        occurrence, sorted by set and row
+        """
+        cols = [self.columns(codes) for codes in code_sets]
+        set_id = np.repeat(np.arange(len(cols)), [len(x) for x in cols])
+        cols = np.concatenate(cols) if len(cols) else np.zeros(0, dtype=np.int64)
+        #expand the columns to their stored entries
+        lower, upper = self.matrix.indptr[cols], self.matrix.indptr[cols+1]
+        counts = upper - lower
+        entry = np.repeat(lower - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        set_id = np.repeat(set_id, counts)
+        rows = self.matrix.indices[entry]
+        offsets = self.matrix.data[entry]
+        order = np.lexsort((offsets, rows, set_id))
+        set_id, rows, offsets = set_id[order], rows[order], offsets[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (set_id[1:] != set_id[:-1]) | (rows[1:] != rows[:-1])
+        return set_id[first], rows[first], self.decode(offsets[first])
+
+    def has_any(self, codes, rows=None):
+        """
+        whether any of the phecodes occurred
+        """
+        result = self._min_offset(self.columns(codes)) > 0
+        return result if rows is None else result[rows]
+
+    def take(self, rows):
+        """
+        index restricted to (and reordered by) the given patient rows
+        """
+        matrix = self.matrix.tocsr()[np.asarray(rows)]
+        return CohortIndex(matrix, self.phecodes, self.origin, self.unit, self.timed)
+
+    #------------------------------------------------------------------
+    def rollup(self, func):
+        """
+        merge phecode columns through func (e.g. level 3 -> level 2),
+        keeping the earliest time of the merged codes
+        """
+        coo = self.matrix.tocoo()
+        new_codes = np.array([func(x) for x in self.phecodes], dtype=np.float64)
+        times = self.decode(coo.data) if self.timed else np.full(coo.nnz, np.nan)
+        return CohortIndex.from_arrays(coo.row, new_codes[coo.col], times, self.n_patients)
+
+    def exclude(self, other):
+        """
+        drop every (patient, phecode) entry that is also present in other
+        """
+        coo = self.matrix.tocoo()
+        other_pos = np.searchsorted(other.keys, self.keys)
+        other_pos = np.clip(other_pos, 0, max(len(other.keys)-1, 0))
+        col_found = (other.keys[other_pos] == self.keys) if len(other.keys) else np.zeros(len(self.keys), bool)
+        keep = np.ones(coo.nnz, dtype=bool)
+        found = col_found[coo.col]
+        if found.any():
+            other_csr = other.matrix.tocsr()
+            hit = np.asarray(other_csr[coo.row[found], other_pos[coo.col[found]]]).ravel() != 0
+            keep[np.flatnonzero(found)[hit]] = False
+        matrix = sparse.csc_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])), shape=self.matrix.shape)
+        return CohortIndex(matrix, self.phecodes, self.origin, self.unit, self.timed)
+
+    def to_series(self, index=None):
+        """
+        back to the per-row dict column (keys ordered by diagnosis time)
+        """
+        csr = self.matrix.tocsr()
+        times = self.decode(csr.data)
+        result = []
+        for i in range(self.n_patients):
+            lower, upper = csr.indptr[i], csr.indptr[i+1]
+            order = np.argsort(csr.data[lower:upper], kind='stable')
+            cols = csr.indices[lower:upper][order]
+            result.append({float(self.phecodes[c]): float(t) for c, t in
+                           zip(cols, times[lower:upper][order])})
+        return pd.Series(result, index=index, dtype=object)
+
+    #------------------------------------------------------------------
+    def save(self, file):
+        np.savez(os.path.expanduser(file), data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                 shape=np.asarray(self.matrix.shape), phecodes=self.phecodes,
+                 meta=np.asarray([self.origin, self.unit, float(self.timed)]))
+
+    @classmethod
+    def load(cls, file):
+        with load_npz(file) as f:
+            matrix = sparse.csc_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            origin, unit, timed = f['meta']
+            return cls(matrix, f['phecodes'], origin, unit, bool(timed))
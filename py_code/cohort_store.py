@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar cohort storage replacing the pickled df_merged.npy object arrays.
+
+A store is a directory with meta.json and one or more .npy files per column:
+    numeric      typed array (int32/int64/float64)
+    time         int32 day offsets + origin (exact float64 fallback)
+    categorical  int32 codes + categories in meta.json
+    ragged       'inpatient' style dict columns: offsets, phecodes, times
+                 'history' style list columns: offsets, phecodes (or strings)
+Columns are read one by one with np.load(mmap_mode='r'), so the load time
+and memory of a stage scale with the columns it asks for; under the
+shared_cohort launcher they are views on shared memory instead.
+
+    python cohort_store.py --values df_merged.npy --columns df_merged_columns.npy --out df_merged_store
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from cohort_index import CohortIndex, encode_times
+from phecode_index import HistoryMatrix
+from shared_cohort import load_npy
+
+time_columns_default = ('dia_date', 'time_end', 'birth_date')
+
+
+def _kind(series):
+    values = [x for x in series.values if not (np.isscalar(x) and pd.isna(x))]
+    if len(values) == 0:
+        return 'numeric'
+    if all(isinstance(x, dict) for x in values):
+        return 'dict'
+    if all(isinstance(x, (list, tuple, set, np.ndarray)) for x in values):
+        return 'list'
+    try:
+        pd.to_numeric(series, errors='raise')
+        return 'numeric'
+    except (ValueError, TypeError):
+        return 'categorical'
+
+
+def _numeric(series):
+    values = pd.to_numeric(series).values.astype(np.float64)
+    if not np.isnan(values).any() and np.array_equal(values, np.round(values)):
+        if np.abs(values).max(initial=0) < np.iinfo(np.int32).max:
+            return values.astype(np.int32)
+        return values.astype(np.int64)
+    return values
+
+
+def _ragged(series, timed):
+    offsets, codes, times = [0], [], []
+    for x in series.values:
+        if isinstance(x, dict):
+            items = [(k, v) for k, v in x.items() if not (pd.isna(k) or pd.isna(v))]
+            codes += [k for k, _ in items]
+            times += [v for _, v in items]
+        elif isinstance(x, (list, tuple, set, np.ndarray)):
+            codes += [k for k in x if not pd.isna(k)]
+        offsets.append(len(codes))
+    offsets = np.asarray(offsets, dtype=np.int64)
+    try:
+        codes = np.asarray(codes, dtype=np.float64)
+    except ValueError:
+        #e.g. the 'd1d2' column of "d1-d2" strings
+        codes = np.asarray(codes, dtype=str)
+    if not timed:
+        return offsets, codes, None, 0.0, 1.0
+    values, origin, unit = encode_times(np.asarray(times, dtype=np.float64))
+    return offsets, codes, values, origin, unit
+
+
+def save_frame(df, out_dir, time_columns=time_columns_default):
+    """
+    write a cohort DataFrame as a column store
+    """
+    out_dir = os.path.expanduser(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    meta = {'n_rows':len(df), 'columns':[]}
+    for i, name in enumerate(df.columns):
+        series = df[name]
+        stem = os.path.join(out_dir, '%03i' % i)
+        kind = _kind(series)
+        info = {'name':str(name), 'file':'%03i' % i}
+        if kind == 'numeric' and name in time_columns:
+            values = pd.to_numeric(series).values.astype(np.float64)
+            present = ~np.isnan(values)
+            offsets, origin, unit = encode_times(values[present])
+            encoded = np.zeros(len(values), dtype=offsets.dtype)
+            encoded[present] = offsets
+            np.save(stem + '.npy', encoded)
+            info.update(kind='time', origin=origin, unit=unit)
+        elif kind == 'numeric':
+            np.save(stem + '.npy', _numeric(series))
+            info.update(kind='numeric')
+        elif kind == 'categorical':
+            categorical = pd.Categorical(series.values)
+            np.save(stem + '.npy', categorical.codes.astype(np.int32))
+            info.update(kind='categorical', categories=[x.item() if hasattr(x, 'item') else x
+                                                        for x in categorical.categories])
+        else:
+            offsets, codes, values, origin, unit = _ragged(series, kind == 'dict')
+            np.save(stem + '.offsets.npy', offsets)
+            np.save(stem + '.codes.npy', codes)
+            if values is not None:
+                np.save(stem + '.values.npy', values)
+            info.update(kind=kind, origin=origin, unit=unit)
+        meta['columns'].append(info)
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+def convert_npy(values_file, columns_file, out_dir, time_columns=time_columns_default):
+    """
+    convert an existing df_merged.npy / df_merged_columns.npy pair
+    """
+    values = np.load(os.path.expanduser(values_file), allow_pickle=True)
+    columns = np.load(os.path.expanduser(columns_file), allow_pickle=True)
+    save_frame(pd.DataFrame(values, columns=columns), out_dir, time_columns)
+
+
+class CohortStore(object):
+
+    def __init__(self, directory, mmap=True):
+        self.directory = os.path.expanduser(directory)
+        self.mmap_mode = 'r' if mmap else None
+        with open(os.path.join(self.directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.n_rows = meta['n_rows']
+        self.info = {x['name']:x for x in meta['columns']}
+        self.columns = [x['name'] for x in meta['columns']]
+
+    def _load(self, name, part=''):
+        file = os.path.join(self.directory, self.info[name]['file'] + part + '.npy')
+        return load_npy(file, mmap_mode=self.mmap_mode)
+
+    def ragged(self, name):
+        """
+        raw (offsets, phecodes, encoded times or None) of a dict/list column
+        """
+        info = self.info[name]
+        values = self._load(name, '.values') if info['kind'] == 'dict' else None
+        return self._load(name, '.offsets'), self._load(name, '.codes'), values
+
+    def column(self, name):
+        """
+        one column as an array (object array for ragged columns)
+        """
+        info = self.info[name]
+        kind = info['kind']
+        if kind == 'numeric':
+            return self._load(name)
+        if kind == 'time':
+            encoded = self._load(name)
+            return np.where(encoded > 0, info['origin'] + (encoded - 1.0)*info['unit'], np.nan)
+        if kind == 'categorical':
+            categories = np.asarray(info['categories'] + [np.nan], dtype=object)
+            codes = np.asarray(self._load(name))
+            return categories[np.where(codes >= 0, codes, -1)]
+        offsets, codes, values = self.ragged(name)
+        codes = np.asarray(codes).tolist()
+        result = np.empty(self.n_rows, dtype=object)
+        if kind == 'dict':
+            times = (info['origin'] + (np.asarray(values, dtype=np.float64) - 1)*info['unit']).tolist()
+            for i in range(self.n_rows):
+                result[i] = dict(zip(codes[offsets[i]:offsets[i+1]], times[offsets[i]:offsets[i+1]]))
+        else:
+            for i in range(self.n_rows):
+                result[i] = codes[offsets[i]:offsets[i+1]]
+        return result
+
+    def read(self, columns=None):
+        """
+        DataFrame with only the requested columns
+        """
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({name:self.column(name) for name in columns}, columns=columns, copy=False)
+
+    def cohort_index(self, name, rows=None):
+        """
+        CohortIndex of a dict (or list) column built straight from the ragged arrays
+        """
+        offsets, codes, values = self.ragged(name)
+        info = self.info[name]
+        row_id = np.repeat(np.arange(self.n_rows), np.diff(offsets))
+        if values is None:
+            times = np.full(len(codes), np.nan)
+        else:
+            times = info['origin'] + (np.asarray(values, dtype=np.float64) - 1)*info['unit']
+        index = CohortIndex.from_arrays(row_id, codes, times, self.n_rows)
+        return index if rows is None else index.take(rows)
+
+    def history_matrix(self, name, phecode_index, rows=None):
+        """
+        HistoryMatrix of a list column built straight from the ragged arrays
+        """
+        offsets, codes, _ = self.ragged(name)
+        row_id = np.repeat(np.arange(self.n_rows), np.diff(offsets))
+        if rows is not None:
+            new_position = np.full(self.n_rows, -1)
+            new_position[rows] = np.arange(len(rows))
+            row_id = new_position[row_id]
+            keep = row_id >= 0
+            return HistoryMatrix.from_arrays(row_id[keep], np.asarray(codes)[keep], len(rows), phecode_index)
+        return HistoryMatrix.from_arrays(row_id, codes, self.n_rows, phecode_index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='New_depression project')
+    parser.add_argument('--values', type=str)
+    parser.add_argument('--columns', type=str)
+    parser.add_argument('--out', type=str)
+    parser.add_argument('--time_columns', type=str, nargs='*', default=list(time_columns_default))
+    args = parser.parse_args()
+    convert_npy(args.values, args.columns, args.out, args.time_columns)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Variance inflation factors of all columns at once, replacing the loops over
+statsmodels variance_inflation_factor().
+
+The VIF of column i regressed on the other columns and a constant is
+1/(1 - R_i^2) = (R^-1)_ii, the diagonal of the inverse correlation matrix,
+so the p auxiliary regressions reduce to one p x p inversion. R comes from
+the sufficient statistics n, sum(x) and X'X, accumulated in one pass over
+row chunks (or by one sparse product for scipy sparse inputs).
+
+R is inverted through its eigendecomposition: columns involved in an
+exact linear dependency have R_i^2 = 1 and VIF = inf, the others are read
+from the pseudo-inverse. Zero-variance columns get NaN, so the VIF < 5
+filter drops both, as the statsmodels loop did.
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+def gram_statistics(X, weights=None, chunk=65536):
+    """
+    (n, sum(x), X'X) of the rows of X, weighted by optional frequency weights
+    """
+    w = None if weights is None else np.asarray(weights, dtype=np.float64)
+    if sparse.issparse(X):
+        X = sparse.csr_matrix(X, dtype=np.float64)
+        Xw = X if w is None else sparse.diags(w) @ X
+        n = X.shape[0] if w is None else w.sum()
+        return float(n), np.asarray(Xw.sum(axis=0)).ravel(), (Xw.T @ X).toarray()
+    X = np.asarray(X)
+    p = X.shape[1]
+    n, s, G = 0.0, np.zeros(p), np.zeros((p, p))
+    for start in range(0, X.shape[0], chunk):
+        block = np.asarray(X[start:start+chunk], dtype=np.float64)
+        block_w = block if w is None else block*w[start:start+chunk, None]
+        n += len(block) if w is None else w[start:start+chunk].sum()
+        s += block_w.sum(axis=0)
+        G += block_w.T @ block
+    return n, s, G
+
+
+def vif_from_statistics(n, s, G, tol=1e-10):
+    """
+    VIF of every column from the sufficient statistics, inf for collinear
+    columns and NaN for zero-variance columns
+    """
+    mean = s/n
+    cov = G/n - np.outer(mean, mean)
+    var = np.diag(cov).copy()
+    vif = np.full(len(var), np.nan)
+    varying = var > tol*np.maximum(np.abs(np.diag(G))/n, 1)
+    if not varying.any():
+        return vif
+    sd = np.sqrt(var[varying])
+    R = cov[np.ix_(varying, varying)]/np.outer(sd, sd)
+    #a Cholesky factorization of R can succeed on round-off, so exact
+    #dependencies are found from the eigenvalues: e_i is in the range of R
+    #iff column i is not involved in one
+    eigenvalues, V = np.linalg.eigh(R)
+    null = eigenvalues <= tol*max(eigenvalues.max(), 1)*len(eigenvalues)
+    involved = np.sum(V[:, null]**2, axis=1) > tol
+    vif_ = np.sum(V[:, ~null]**2/eigenvalues[~null], axis=1)
+    vif_[involved] = np.inf
+    vif[varying] = vif_
+    return vif
+
+
+def variance_inflation_factors(X, weights=None):
+    """
+    VIF of every column of X (dense, sparse or DataFrame), without a constant column
+    """
+    if hasattr(X, 'columns'):
+        X = X.values
+    return vif_from_statistics(*gram_statistics(X, weights))
+
+
+def vif_screen(frame, threshold=5):
+    """
+    the columns of frame with VIF < threshold
+    """
+    vif = variance_inflation_factors(frame)
+    return [x for x, v in zip(frame.columns, vif) if v < threshold]
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Comorbidity statistics of all disease pairs at once.
+
+With O the (patients x K) occurrence matrix, Ebar the sparse complement of
+the eligibility matrix (patients not eligible for a disease) and
+A = O restricted to eligible entries, the counts of pair (i, j) over the
+patients eligible for both are
+
+    n  = N - |Ebar_i| - |Ebar_j| + (Ebar'Ebar)_ij      eligible for both
+    c  = (A'A)_ij                                      both diseases
+    p1 = |A_i| - (A'Ebar)_ij                           disease i
+    p2 = p1'                                           disease j
+
+so a few sparse products give every pair, and RR / phi and their t-based
+p-values are evaluated on all pairs at once. Pairs are kept as compact
+upper-triangular arrays (i < j, np.triu_indices order). For panels too large
+for K x K intermediates, blocked_pair_counts() computes the same counts tile
+by tile over patient chunks within a memory budget.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import t
+from cohort_index import phecode_key
+
+result_columns = ['d1','d2','n_d1d2','N','RR','se','p_rr','phi','p_phi']
+
+
+def occurrence_matrix(inpatient_index, diseases):
+    """
+    (patients x diseases) 0/1 CSC matrix, column k = inpatient_index.has_any([diseases[k]])
+    """
+    indptr, indices = [0], []
+    matrix = inpatient_index.matrix
+    for d in diseases:
+        cols = inpatient_index.columns([d])
+        rows = matrix.indices[matrix.indptr[cols[0]]:matrix.indptr[cols[0]+1]] if len(cols) else []
+        indices.append(np.asarray(rows, dtype=np.int64))
+        indptr.append(indptr[-1] + len(rows))
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+    return sparse.csc_matrix((np.ones(len(indices), dtype=np.int64), indices, indptr),
+                             shape=(inpatient_index.n_patients, len(diseases)))
+
+
+def ineligible_matrix(eligibility, diseases):
+    """
+    (patients x diseases) 0/1 CSC matrix of the patients NOT eligible, the sparse side
+    """
+    indptr, indices = [0], []
+    for d in diseases:
+        rows = np.flatnonzero(~eligibility.mask(d))
+        indices.append(rows)
+        indptr.append(indptr[-1] + len(rows))
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+    return sparse.csc_matrix((np.ones(len(indices), dtype=np.int64), indices, indptr),
+                             shape=(eligibility.n_patients, len(diseases)))
+
+
+def pair_counts(occurrence, ineligible):
+    """
+    (n, c, p1, p2) of every pair i < j as compact upper-triangular arrays
+    in np.triu_indices order
+    """
+    occurrence = sparse.csc_matrix(occurrence, dtype=np.int64)
+    ineligible = sparse.csc_matrix(ineligible, dtype=np.int64)
+    N, K = occurrence.shape
+    #occurrences of eligible patients only
+    A = sparse.csc_matrix(occurrence - occurrence.multiply(ineligible))
+    A.eliminate_zeros()
+    n_ineligible = np.asarray(ineligible.sum(axis=0)).ravel()
+    n_occurrence = np.asarray(A.sum(axis=0)).ravel()
+
+    i, j = np.triu_indices(K, k=1)
+    n = N - n_ineligible[i] - n_ineligible[j] + (ineligible.T @ ineligible).toarray()[i, j]
+    c = (A.T @ A).toarray()[i, j]
+    AE = (A.T @ ineligible).toarray()
+    return n, c, n_occurrence[i] - AE[i, j], n_occurrence[j] - AE[j, i]
+
+
+def _eligible_block(eligibility, positions, start, stop):
+    """
+    (diseases x patients) boolean block of the eligibility rows at positions
+    for patient rows start:stop, start a multiple of 64
+    """
+    block = np.ascontiguousarray(eligibility.words[positions, start//64:-(-stop//64)], dtype='<u8')
+    return np.unpackbits(block.view(np.uint8), axis=1, count=stop-start, bitorder='little').astype(bool)
+
+
+def blocked_pair_counts(occurrence, eligibility, diseases, memory=2**30):
+    """
+    pair_counts() with bounded memory for large disease panels and cohorts
+
+    The disease axis is cut into row tiles; for each tile the cohort is
+    streamed in patient chunks and the tile x remaining-diseases products are
+    accumulated, then scattered into the compact upper-triangular result.
+    memory (bytes) is split between the tile accumulators and the dense
+    eligibility block of a chunk. Counts are integers, so the result equals
+    pair_counts() exactly.
+    """
+    occurrence = sparse.csr_matrix(occurrence, dtype=np.int64)
+    N, K = occurrence.shape
+    positions = np.array([eligibility.rows_[x] for x in phecode_key(diseases).tolist()], dtype=np.int64)
+    #4 int64 accumulators of tile x K, and a K x chunk boolean block plus its sparse copies
+    tile = int(min(K, max(1, memory//2//(4*8*K))))
+    chunk = int(max(64, memory//2//(4*K)//64*64))
+
+    size = K*(K-1)//2
+    n, c, p1, p2 = [np.zeros(size, dtype=np.int64) for _ in range(4)]
+    n_ineligible = np.zeros(K, dtype=np.int64)
+    n_occurrence = np.zeros(K, dtype=np.int64)
+    for lower in range(0, K, tile):
+        upper = min(K, lower + tile)
+        EE, AA, AE, EA = [np.zeros((upper-lower, K-lower), dtype=np.int64) for _ in range(4)]
+        for start in range(0, N, chunk):
+            stop = min(N, start + chunk)
+            ineligible = ~_eligible_block(eligibility, positions[lower:], start, stop)
+            ineligible = sparse.csr_matrix(ineligible.T, dtype=np.int64)
+            O = occurrence[start:stop, lower:]
+            A = sparse.csr_matrix(O - O.multiply(ineligible))
+            if lower == 0:
+                n_ineligible += np.asarray(ineligible.sum(axis=0)).ravel()
+                n_occurrence += np.asarray(A.sum(axis=0)).ravel()
+            E_tile, A_tile = ineligible[:, :upper-lower], A[:, :upper-lower]
+            EE += (E_tile.T @ ineligible).toarray()
+            AA += (A_tile.T @ A).toarray()
+            AE += (A_tile.T @ ineligible).toarray()
+            EA += (E_tile.T @ A).toarray()
+        #pairs i < j of the tile rows
+        li, lj = np.nonzero(np.arange(K-lower)[None, :] > np.arange(upper-lower)[:, None])
+        i, j = li + lower, lj + lower
+        index = i*K - i*(i+1)//2 + (j - i - 1)
+        n[index], c[index], p1[index], p2[index] = EE[li, lj], AA[li, lj], AE[li, lj], EA[li, lj]
+
+    i, j = np.triu_indices(K, k=1)
+    return N - n_ineligible[i] - n_ineligible[j] + n, c, n_occurrence[i] - p1, n_occurrence[j] - p2
+
+
+def pair_statistics(n, c, p1, p2):
+    """
+    RR, se(log RR), p_rr, phi, p_phi of count arrays of any shape (float64)
+    """
+    n, c, p1, p2 = [np.asarray(x, dtype=np.float64) for x in (n, c, p1, p2)]
+    with np.errstate(all='ignore'):
+        rr = (n*c)/(p1*p2)
+        theta = (1/c + 1/((p1*p2)/n) - 1/n - 1/n)**0.5
+        t_ = np.abs(np.log(rr)/theta)
+        p = (1-t.cdf(t_,n))*2
+        phi = (c*n-p1*p2)/(((p1*p2)*(n-p1)*(n-p2))**0.5)
+        z_phi = 0.5*np.log((1+phi)/(1-phi))
+        z_phi_theta = (1/(n-3))**0.5
+        z_phi_t = np.abs(z_phi/z_phi_theta)
+        p_phi = (1-t.cdf(z_phi_t,n))*2
+    return rr, theta, p, phi, p_phi
+
+
+def comorbidity_table(diseases, counts, threshold=20):
+    """
+    one row per pair (d1, d2), d1 before d2 in the disease list, from the
+    compact (n, c, p1, p2) counts; the statistics are NaN for pairs with
+    n_d1d2 <= threshold
+    """
+    diseases = np.asarray(diseases)
+    n, c, p1, p2 = counts
+    i, j = np.triu_indices(len(diseases), k=1)
+    statistics = np.column_stack(pair_statistics(n, c, p1, p2))
+    statistics[c <= threshold] = np.nan
+    result = pd.DataFrame(statistics, columns=result_columns[4:])
+    result.insert(0, 'N', n)
+    result.insert(0, 'n_d1d2', c)
+    result.insert(0, 'd2', diseases[j])
+    result.insert(0, 'd1', diseases[i])
+    return result
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Conditional logistic regression for 1:n matched sets (one case per stratum,
+the d_match() design), replacing statsmodels ConditionalLogit.
+
+The rows are reshaped once into a dense (strata x (n+1) x p) tensor, padded
+where a case has fewer controls. The conditional likelihood of a stratum is
+the softmax probability of its case, so the log likelihood, gradient and
+Hessian of all strata are evaluated with a few batched array operations.
+Strata without a case or with only cases carry no information and are
+dropped, as statsmodels does. collapse() merges identical strata into one
+with a frequency weight, the conditional-logit form of pattern compression.
+
+fit() is Newton-Raphson with step halving; fit_regularized() minimizes
+statsmodels' elastic-net objective
+
+    -loglik/nobs + alpha*((1 - L1_wt)*|beta|^2/2 + L1_wt*|beta|_1)
+
+with alpha per coefficient, by the proximal Newton solver of penalized.py;
+fit_regularized_path() does so for several penalties with warm starts.
+"""
+
+from collections import namedtuple
+import numpy as np
+from scipy.special import logsumexp
+from scipy.stats import norm
+from penalized import prox_newton, regularization_path
+
+ConditionalLogitResult = namedtuple('ConditionalLogitResult', ['params', 'bse', 'pvalues', 'loglik', 'n_iter',
+                                                               'converged', 'message'])
+
+
+class MatchedStrata(object):
+    """
+    (strata x (n+1) x p) covariate tensor of a 1:n matched design
+    weights: optional frequency weights of the strata, read from the case rows
+    """
+
+    def __init__(self, y, X, groups, weights=None):
+        y = np.asarray(y, dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[:, None]
+        groups = np.asarray(groups)
+        codes, group_id = np.unique(groups, return_inverse=True)
+        size = np.bincount(group_id, minlength=len(codes))
+        n_cases = np.bincount(group_id, weights=y, minlength=len(codes))
+        if np.any(n_cases > 1):
+            raise ValueError('more than one case in a stratum')
+        keep = (n_cases == 1) & (size > 1)
+        rows = np.flatnonzero(keep[group_id])
+        group_id = np.cumsum(keep)[group_id[rows]] - 1
+        order = np.lexsort((-y[rows], group_id))
+        rows, group_id = rows[order], group_id[order]
+
+        G, m = int(keep.sum()), int(size[keep].max()) if keep.any() else 0
+        start = np.searchsorted(group_id, np.arange(G))
+        slot = np.arange(len(rows)) - start[group_id]
+        self.X = np.zeros((G, m, X.shape[1]))
+        self.X[group_id, slot] = X[rows]
+        self.mask = np.zeros((G, m), dtype=bool)
+        self.mask[group_id, slot] = True
+        #the case is first in its stratum
+        self.weights = np.ones(G) if weights is None else np.asarray(weights, dtype=np.float64)[rows[start]]
+        self.nobs = float(np.sum(self.weights*self.mask.sum(axis=1)))
+
+    @property
+    def n_strata(self):
+        return self.X.shape[0]
+
+    def take(self, columns):
+        """
+        the same strata with a subset of the covariates
+        """
+        strata = MatchedStrata.__new__(MatchedStrata)
+        strata.X = self.X[:, :, np.asarray(columns, dtype=np.int64)]
+        strata.mask, strata.weights, strata.nobs = self.mask, self.weights, self.nobs
+        return strata
+
+    def collapse(self):
+        """
+        strata with the same case row and the same control rows (in any order)
+        merged into one, weighted by their number: the within-strata form of
+        compress_patterns(), with the same likelihood
+        """
+        G, m, p = self.X.shape
+        if G == 0 or m < 2:
+            return self
+        #controls sorted within each stratum (padding last) by the rank of their row
+        rows = np.concatenate([~self.mask[:, 1:, None], self.X[:, 1:]], axis=2).reshape(G*(m-1), p+1)
+        rank = np.unique(rows, axis=0, return_inverse=True)[1].reshape(G, m-1)
+        order = np.argsort(rank, axis=1, kind='stable')
+        controls = np.take_along_axis(rows.reshape(G, m-1, p+1), order[:, :, None], axis=1)
+        signature = np.concatenate([self.X[:, 0], controls.reshape(G, -1)], axis=1)
+        _, first, inverse = np.unique(signature, axis=0, return_index=True, return_inverse=True)
+        strata = MatchedStrata.__new__(MatchedStrata)
+        strata.X, strata.mask = self.X[first], self.mask[first]
+        strata.weights = np.bincount(inverse.ravel(), weights=self.weights, minlength=len(first))
+        strata.nobs = self.nobs
+        return strata
+
+    def loss(self):
+        """
+        negative conditional log likelihood as fun(beta) -> (value, gradient, hessian)
+        """
+        X, mask, w = self.X, self.mask, self.weights
+        G, m, p = X.shape
+        X_flat = X.reshape(G*m, p)
+
+        def fun(beta):
+            eta = np.where(mask, X @ beta, -np.inf)
+            log_denominator = logsumexp(eta, axis=1)
+            value = -np.sum(w*(eta[:, 0] - log_denominator))
+            P = np.exp(eta - log_denominator[:, None])
+            x_bar = np.einsum('gm,gmp->gp', P, X)
+            grad = -(w @ (X[:, 0] - x_bar))
+            hess = (X_flat*(w[:, None]*P).reshape(-1, 1)).T @ X_flat - (x_bar*w[:, None]).T @ x_bar
+            return value, grad, hess
+        return fun
+
+
+def _summary(beta, info):
+    try:
+        cov = np.linalg.inv(info)
+    except np.linalg.LinAlgError:
+        cov = np.linalg.pinv(info)
+    with np.errstate(invalid='ignore'):
+        bse = np.sqrt(np.diag(cov))
+        pvalues = 2*norm.sf(np.abs(beta/bse))
+    return bse, pvalues
+
+
+def fit(strata, beta0=None, maxiter=50, tol=1e-9, max_halving=20):
+    """
+    unpenalized conditional logit by Newton-Raphson with step halving
+    returns ConditionalLogitResult(params, bse, pvalues, loglik, n_iter, converged, message)
+    """
+    p = strata.X.shape[2]
+    if strata.n_strata == 0:
+        nan = np.full(p, np.nan)
+        return ConditionalLogitResult(nan, nan, nan, np.nan, 0, False, 'no informative strata')
+    fun = strata.loss()
+    beta = np.zeros(p) if beta0 is None else np.asarray(beta0, dtype=np.float64).copy()
+    value, g, H = fun(beta)
+    converged, message = False, ''
+    for n_iter in range(1, maxiter+1):
+        try:
+            step = np.linalg.solve(H, -g)
+        except np.linalg.LinAlgError:
+            step = -np.linalg.pinv(H) @ g
+        for _ in range(max_halving):
+            new_value, new_g, new_H = fun(beta + step)
+            if np.isfinite(new_value) and new_value <= value + 1e-12*abs(value):
+                break
+            step /= 2
+        else:
+            message = 'step halving failed'
+            break
+        beta, change = beta + step, value - new_value
+        value, g, H = new_value, new_g, new_H
+        if change <= tol*(abs(value) + tol) and np.max(np.abs(step), initial=0) < 1e-6:
+            converged = True
+            break
+    if not converged and not message:
+        message = 'maximum iterations reached'
+    bse, pvalues = _summary(beta, H)
+    return ConditionalLogitResult(beta, bse, pvalues, -value, n_iter, converged, message)
+
+
+def fit_regularized(strata, alpha, L1_wt=1.0, beta0=None, maxiter=100, tol=1e-9):
+    """
+    elastic-net conditional logit on statsmodels' scale, alpha per coefficient (0 = unpenalized)
+    returns (beta, n_iter, converged)
+    """
+    p = strata.X.shape[2]
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=np.float64), (p,))
+    if strata.n_strata == 0:
+        return np.zeros(p), 0, False
+    loss, nobs = strata.loss(), strata.nobs
+    ridge = nobs*alpha*(1 - L1_wt)
+
+    def fun(beta):
+        value, grad, hess = loss(beta)
+        return value + np.sum(ridge*beta**2)/2, grad + ridge*beta, hess + np.diag(ridge)
+    beta0 = np.zeros(p) if beta0 is None else beta0
+    return prox_newton(fun, beta0, nobs*alpha*L1_wt, maxiter=maxiter, tol=tol)
+
+
+def fit_regularized_path(strata, alphas, L1_wt=1.0, beta0=None, maxiter=100, tol=1e-9):
+    """
+    fit_regularized() for every alpha in alphas, warm-started from the strongest penalty
+    returns [(beta, n_iter, converged)] in the order of alphas
+    """
+    beta0 = np.zeros(strata.X.shape[2]) if beta0 is None else beta0
+    return regularization_path(lambda alpha, start: fit_regularized(strata, alpha, L1_wt=L1_wt, beta0=start,
+                                                                    maxiter=maxiter, tol=tol), alphas, beta0)
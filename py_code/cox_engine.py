@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Stratified Cox proportional hazards model for the matched cohort (strata =
+'match_2'), fitted by Newton-Raphson on the Breslow partial likelihood.
+
+Subjects are sorted by stratum and descending time once, so every risk set
+sum is a cumulative sum minus the value before the stratum start. The
+Hessian uses the identity sum_i S2(t_i)/S0(t_i) = sum_j r_j x_j x_j' C_j,
+with C_j the cumulative 1/S0 over the event times at which j is at risk, so
+no n x p x p array is ever formed.
+
+fit_batch() fits many outcomes (the phecodes of one PheWAS task) against the
+covariate block of the whole cohort, built once: every outcome gathers its
+rows of the block instead of re-selecting and re-typing DataFrame columns.
+"""
+
+from collections import namedtuple
+import numpy as np
+from scipy.stats import norm
+from pattern_compression import compress_patterns
+
+CoxResult = namedtuple('CoxResult', ['params', 'bse', 'pvalues', 'loglik', 'n_iter', 'converged', 'message'])
+
+
+class _RiskSets(object):
+    """
+    sort order and risk set bookkeeping of one (time, status, strata) outcome
+    """
+
+    def __init__(self, time, status, strata):
+        time = np.asarray(time, dtype=np.float64)
+        status = np.asarray(status) != 0
+        strata = np.unique(np.asarray(strata), return_inverse=True)[1].ravel()
+        #strata without any event do not contribute to the partial likelihood
+        keep = np.isin(strata, np.unique(strata[status]))
+        self.subset = np.flatnonzero(keep)
+        time, status, strata = time[keep], status[keep], strata[keep]
+
+        order = np.lexsort((-time, strata))
+        self.order = self.subset[order]
+        t, s, self.status = time[order], strata[order], status[order]
+        n = len(t)
+
+        new_stratum = np.r_[True, s[1:] != s[:-1]]
+        new_group = new_stratum | np.r_[True, t[1:] != t[:-1]]
+        stratum_id = np.cumsum(new_stratum) - 1
+        group_id = np.cumsum(new_group) - 1
+        stratum_first = np.flatnonzero(new_stratum)
+        stratum_last = np.r_[stratum_first[1:], n] - 1
+        group_first = np.flatnonzero(new_group)
+        group_last = np.r_[group_first[1:], n] - 1
+        #risk set of subject i: its stratum, positions [stratum_first, group_last]
+        self.risk_lower = stratum_first[stratum_id]
+        self.risk_upper = group_last[group_id]
+        #events at which subject j is at risk: positions [group_first, stratum_last]
+        self.at_risk_lower = group_first[group_id]
+        self.at_risk_upper = stratum_last[stratum_id]
+        self.events = np.flatnonzero(self.status)
+
+    def window_sum(self, cs, lower, upper):
+        """
+        sum over positions [lower, upper] from a cumulative sum cs
+        """
+        base = np.where((lower > 0)[(...,) + (None,)*(cs.ndim-1)], cs[np.maximum(lower-1, 0)], 0)
+        return cs[upper] - base
+
+
+def _loglik(risk, X, w, beta):
+    eta = X @ beta
+    c = eta.max() if len(eta) else 0.0
+    r = w*np.exp(eta - c)
+    cs0 = np.cumsum(r)
+    ev = risk.events
+    S0 = risk.window_sum(cs0, risk.risk_lower[ev], risk.risk_upper[ev])
+    return np.sum(w[ev]*(eta[ev] - c - np.log(S0))), eta, c, r, S0
+
+
+def _derivatives(risk, X, w, r, S0):
+    ev = risk.events
+    cs1 = np.cumsum(r[:, None]*X, axis=0)
+    S1 = risk.window_sum(cs1, risk.risk_lower[ev], risk.risk_upper[ev])
+    a = S1/S0[:, None]
+    grad = (w[ev][:, None]*(X[ev] - a)).sum(axis=0)
+
+    e = np.zeros(len(r))
+    e[ev] = w[ev]/S0
+    ce = np.cumsum(e)
+    C = risk.window_sum(ce, risk.at_risk_lower, risk.at_risk_upper)
+    info = (X*(r*C)[:, None]).T @ X - (a*w[ev][:, None]).T @ a
+    return grad, info
+
+
+def _fit(risk, X, w, beta=None, maxiter=50, tol=1e-9, max_halving=20):
+    p = X.shape[1]
+    beta = np.zeros(p) if beta is None else np.asarray(beta, dtype=np.float64).copy()
+    loglik, eta, c, r, S0 = _loglik(risk, X, w, beta)
+    converged, message, info = False, '', np.zeros((p, p))
+    for n_iter in range(1, maxiter+1):
+        grad, info = _derivatives(risk, X, w, r, S0)
+        try:
+            step = np.linalg.solve(info, grad)
+        except np.linalg.LinAlgError:
+            step = np.linalg.pinv(info) @ grad
+            message = 'singular information matrix'
+        step_size = 1.0
+        for _ in range(max_halving):
+            new_beta = beta + step_size*step
+            new_loglik, eta, c, r, S0 = _loglik(risk, X, w, new_beta)
+            if np.isfinite(new_loglik) and new_loglik >= loglik - tol*abs(loglik):
+                break
+            step_size /= 2
+        else:
+            message = 'step-halving failed'
+            loglik, eta, c, r, S0 = _loglik(risk, X, w, beta)
+            break
+        change = abs(new_loglik - loglik)
+        beta, loglik = new_beta, new_loglik
+        if change <= tol*(abs(loglik) + tol) or np.max(np.abs(step_size*step)) < 1e-8:
+            converged = True
+            grad, info = _derivatives(risk, X, w, r, S0)
+            break
+    if not converged and not message:
+        message = 'maximum iterations reached'
+    return beta, loglik, info, n_iter, converged, message
+
+
+def _summary(beta, info):
+    try:
+        cov = np.linalg.inv(info)
+    except np.linalg.LinAlgError:
+        cov = np.linalg.pinv(info)
+    with np.errstate(invalid='ignore'):
+        bse = np.sqrt(np.diag(cov))
+        pvalues = 2*norm.sf(np.abs(beta/bse))
+    return bse, pvalues
+
+
+def fit_stratified_cox(time, status, X, strata, weights=None, beta0=None, maxiter=50, tol=1e-9):
+    """
+    Breslow stratified Cox model; column 0 of X is usually the exposure.
+    weights are frequency weights (collapsed identical subjects), beta0 the start values.
+    returns CoxResult(params, bse, pvalues, loglik, n_iter, converged, message)
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    risk = _RiskSets(time, status, strata)
+    if len(risk.events) == 0:
+        nan = np.full(X.shape[1], np.nan)
+        return CoxResult(nan, nan, nan, np.nan, 0, False, 'no events')
+    w = np.ones(len(risk.order)) if weights is None else np.asarray(weights, dtype=np.float64)[risk.order]
+    beta, loglik, info, n_iter, converged, message = _fit(risk, X[risk.order], w, beta=beta0, maxiter=maxiter, tol=tol)
+    bse, pvalues = _summary(beta, info)
+    return CoxResult(beta, bse, pvalues, loglik, n_iter, converged, message)
+
+
+
+def fit_batch(X, strata, outcomes, exposure=None, compress=False, fit=None):
+    """
+    fit many outcomes against one shared covariate block
+
+    X: (n, p) covariates of the whole cohort, strata: (n,) matching ids
+    exposure: optional (n,) exposure placed in column 0 of every model
+    outcomes: iterable of (key, rows, time, status) with rows indexing the
+    cohort and time/status aligned with rows
+    compress: collapse identical subjects within strata into frequency weights
+    fit: fit(time, status, X, strata, weights) of one outcome, fit_stratified_cox by default
+    yields (key, fit result, kept_columns); zero-variance columns of a
+    population are dropped before fitting, kept_columns index [exposure]+X
+    """
+    fit = fit_stratified_cox if fit is None else fit
+    X = np.asarray(X, dtype=np.float64)
+    if exposure is not None:
+        X = np.column_stack([np.asarray(exposure, dtype=np.float64), X])
+    X = np.ascontiguousarray(X)
+    strata = np.asarray(strata)
+    for key, rows, time, status in outcomes:
+        rows = np.asarray(rows)
+        X_ = X[rows]
+        kept = np.flatnonzero(X_.max(axis=0, initial=-np.inf) != X_.min(axis=0, initial=np.inf))
+        if exposure is not None and 0 not in kept:
+            kept = np.r_[0, kept]
+        X_, strata_, weights = X_[:, kept], strata[rows], None
+        if compress:
+            time_status, X_, strata_, weights = compress_patterns(np.column_stack([time, status]), X_, strata_)
+            time, status = time_status[:, 0], time_status[:, 1]
+        yield key, fit(time, status, X_, strata_, weights), kept
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Temporal disease pairs of the exposed group as integer codes.
+
+A pair (d1, d2) of positions in the disease list is coded d1*K + d2. For
+every patient, the codes of the ordered pairs (d1 diagnosed strictly before
+d2, both diseases eligible for the patient) are stored in a flat array with
+per-patient offsets, the replacement of the 'd1d2' column of "d1-d2" strings.
+The pairs are generated without a Python loop over patients: the diagnoses
+are sorted by (patient, time) and every diagnosis is paired with the later
+diagnoses of the same patient by index arithmetic, in chunks of at most
+`chunk_pairs` pairs.
+
+Alongside, sparse K x K aggregates over all patients:
+    ordered      patients with d1 before d2
+    cooccurrence patients with both d1 and d2 (upper triangle, d1 < d2)
+    gap          summed time from d1 to d2 over the ordered pairs
+so the binomial test and the trajectory summary read pair counts directly.
+
+The inverted index (invert()) lists, for every pair code, the sorted rows of
+the patients having it. The patients with a multi-step trajectory d0 -> d1 ->
+... in order are the intersection of the posting lists of its edges (a
+disease has a single first diagnosis per patient), found by binary search of
+the shorter list in the longer one.
+"""
+
+import os
+import numpy as np
+from scipy import sparse
+from cohort_index import phecode_key
+from shared_cohort import load_npz
+
+
+def _within_group_pairs(group_end):
+    """
+    all (first, second) entry pairs with first < second < group_end[first]
+    """
+    counts = group_end - np.arange(len(group_end)) - 1
+    first = np.repeat(np.arange(len(group_end)), counts)
+    shift = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return first, first + 1 + shift
+
+
+def intersect_sorted(a, b):
+    """
+    intersection of two sorted arrays of unique values
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    pos = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[pos] == a]
+
+
+class PairIndex(object):
+
+    def __init__(self, diseases, offsets, codes, ordered, cooccurrence, gap, postings=None):
+        self.diseases = np.asarray(diseases, dtype=np.float64)
+        self.keys = phecode_key(self.diseases)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.codes = codes
+        self.ordered = sparse.csr_matrix(ordered)
+        self.cooccurrence = sparse.csr_matrix(cooccurrence)
+        self.gap = sparse.csr_matrix(gap)
+        #(posting codes, posting offsets, posting rows), built by invert()
+        self.postings = postings
+
+    @property
+    def K(self):
+        return len(self.diseases)
+
+    @property
+    def n_patients(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def build(cls, inpatient_index, diseases, eligible=None, chunk_pairs=20000000):
+        """
+        inpatient_index: CohortIndex of the exposed group (first diagnosis times)
+        diseases: the disease list, K phecodes
+        eligible: optional (patients x K) boolean matrix, diagnoses of diseases
+                  the patient is not eligible for are left out
+        """
+        #the disease list is kept sorted, so positions are found by binary search
+        disease_order = np.argsort(phecode_key(diseases), kind='stable')
+        diseases = np.asarray(diseases, dtype=np.float64)[disease_order]
+        if eligible is not None:
+            eligible = np.asarray(eligible, dtype=bool)[:, disease_order]
+        K, n = len(diseases), inpatient_index.n_patients
+        #diagnoses of the listed diseases as (patient, disease position, time)
+        cols = inpatient_index.columns(diseases)
+        position = np.searchsorted(phecode_key(diseases), inpatient_index.keys[cols])
+        sub = inpatient_index.matrix[:, cols].tocoo()
+        rows, d_pos, offsets_ = sub.row.astype(np.int64), position[sub.col], sub.data
+        if eligible is not None:
+            keep = eligible[rows, d_pos]
+            rows, d_pos, offsets_ = rows[keep], d_pos[keep], offsets_[keep]
+        order = np.lexsort((offsets_, rows))
+        rows, d_pos, times = rows[order], d_pos[order], inpatient_index.decode(offsets_[order])
+
+        counts = np.bincount(rows, minlength=n)
+        row_start = np.concatenate([[0], np.cumsum(counts)])
+        n_pairs = counts*(counts - 1)//2
+        #chunks of whole patients with at most chunk_pairs pairs (at least one patient)
+        bounds = [0]
+        cum_pairs = np.cumsum(n_pairs)
+        while bounds[-1] < n:
+            base = cum_pairs[bounds[-1]-1] if bounds[-1] > 0 else 0
+            stop = np.searchsorted(cum_pairs, base + chunk_pairs, side='right')
+            bounds.append(min(max(stop, bounds[-1]+1), n))
+
+        ordered = sparse.csr_matrix((K, K), dtype=np.int64)
+        cooccurrence = sparse.csr_matrix((K, K), dtype=np.int64)
+        gap = sparse.csr_matrix((K, K), dtype=np.float64)
+        pair_rows, pair_codes = [], []
+        for lower, upper in zip(bounds[:-1], bounds[1:]):
+            e0, e1 = row_start[lower], row_start[upper]
+            first, second = _within_group_pairs(row_start[rows[e0:e1]+1] - e0)
+            first, second = first + e0, second + e0
+            a, b = d_pos[first], d_pos[second]
+            cooccurrence = cooccurrence + sparse.csr_matrix(
+                (np.ones(len(a), dtype=np.int64), (np.minimum(a, b), np.maximum(a, b))), shape=(K, K))
+            before = times[first] < times[second]
+            first, a, b = first[before], a[before], b[before]
+            ordered = ordered + sparse.csr_matrix((np.ones(len(a), dtype=np.int64), (a, b)), shape=(K, K))
+            gap = gap + sparse.csr_matrix((times[second[before]] - times[first], (a, b)), shape=(K, K))
+            pair_rows.append(rows[first])
+            pair_codes.append(a*K + b)
+        pair_rows = np.concatenate(pair_rows) if pair_rows else np.zeros(0, dtype=np.int64)
+        pair_codes = np.concatenate(pair_codes) if pair_codes else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((pair_codes, pair_rows))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(pair_rows, minlength=n))])
+        return cls(diseases, offsets, pair_codes[order], ordered, cooccurrence, gap)
+
+    #------------------------------------------------------------------
+    def position(self, code):
+        """
+        position of a phecode in the disease list, -1 if not listed
+        """
+        key = phecode_key(code)
+        pos = np.searchsorted(self.keys, key)
+        if pos < len(self.keys) and self.keys[pos] == key:
+            return int(pos)
+        return -1
+
+    def code(self, d1, d2):
+        p1, p2 = self.position(d1), self.position(d2)
+        if p1 < 0 or p2 < 0:
+            return -1
+        return p1*self.K + p2
+
+    def ordered_count(self, d1, d2):
+        """
+        patients with d1 diagnosed before d2
+        """
+        p1, p2 = self.position(d1), self.position(d2)
+        if p1 < 0 or p2 < 0:
+            return 0
+        return int(self.ordered[p1, p2])
+
+    def cooccurrence_count(self, d1, d2):
+        """
+        patients with both d1 and d2
+        """
+        p1, p2 = self.position(d1), self.position(d2)
+        if p1 < 0 or p2 < 0:
+            return 0
+        return int(self.cooccurrence[min(p1, p2), max(p1, p2)])
+
+    def mean_gap(self, d1, d2):
+        """
+        mean time (seconds) from d1 to d2 over the patients with d1 before d2
+        """
+        n = self.ordered_count(d1, d2)
+        if n == 0:
+            return np.nan
+        return float(self.gap[self.position(d1), self.position(d2)])/n
+
+    def invert(self):
+        """
+        build the pair code -> patient rows posting lists, once
+        """
+        if self.postings is None:
+            row_id = np.repeat(np.arange(self.n_patients, dtype=np.int64), np.diff(self.offsets))
+            #stable, so the rows stay sorted within a code
+            order = np.argsort(self.codes, kind='stable')
+            codes, starts = np.unique(self.codes[order], return_index=True)
+            self.postings = (codes.astype(np.int64), np.r_[starts, len(order)].astype(np.int64), row_id[order])
+        return self
+
+    def patients(self, d1, d2):
+        """
+        sorted rows of the patients with d1 diagnosed before d2
+        """
+        code = self.code(d1, d2)
+        codes, offsets, rows = self.invert().postings
+        k = np.searchsorted(codes, code)
+        if k == len(codes) or codes[k] != code:
+            return np.zeros(0, dtype=np.int64)
+        return rows[offsets[k]:offsets[k+1]]
+
+    def path_patients(self, *diseases):
+        """
+        sorted rows of the patients with all the diseases diagnosed in this order
+        """
+        patients = self.patients(diseases[0], diseases[1])
+        for d1, d2 in zip(diseases[1:-1], diseases[2:]):
+            if len(patients) == 0:
+                break
+            patients = intersect_sorted(patients, self.patients(d1, d2))
+        return patients
+
+    def path_count(self, *diseases):
+        """
+        patients with all the diseases diagnosed in this order
+        """
+        return len(self.path_patients(*diseases))
+
+    def positions(self, codes):
+        """
+        vectorized position(), -1 for the phecodes not listed
+        """
+        keys = phecode_key(np.asarray(codes, dtype=np.float64))
+        if self.K == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), self.K - 1)
+        return np.where(self.keys[pos] == keys, pos, -1)
+
+    def pair_counts(self, d1, d2):
+        """
+        (d1 before d2, d2 before d1, both) patient counts of the pairs d1[k], d2[k]
+        as int64 arrays, 0 for pairs with an unlisted phecode
+        """
+        p1, p2 = self.positions(d1), self.positions(d2)
+        listed = (p1 >= 0) & (p2 >= 0)
+        a, b = p1[listed], p2[listed]
+        counts = np.zeros((3, len(p1)), dtype=np.int64)
+        counts[0, listed] = np.asarray(self.ordered[a, b]).ravel()
+        counts[1, listed] = np.asarray(self.ordered[b, a]).ravel()
+        counts[2, listed] = np.asarray(self.cooccurrence[np.minimum(a, b), np.maximum(a, b)]).ravel()
+        return counts[0], counts[1], counts[2]
+
+    #------------------------------------------------------------------
+    def save(self, file):
+        arrays = {'diseases':self.diseases, 'offsets':self.offsets, 'codes':self.codes}
+        if self.postings is not None:
+            arrays.update(zip(['posting_codes', 'posting_offsets', 'posting_rows'], self.postings))
+        for name in ['ordered', 'cooccurrence', 'gap']:
+            matrix = getattr(self, name)
+            arrays.update({name + '_data':matrix.data, name + '_indices':matrix.indices,
+                           name + '_indptr':matrix.indptr})
+        np.savez(os.path.expanduser(file), **arrays)
+
+    @classmethod
+    def load(cls, file):
+        with load_npz(file) as f:
+            K = len(f['diseases'])
+            matrices = [sparse.csr_matrix((f[name + '_data'], f[name + '_indices'], f[name + '_indptr']),
+                                          shape=(K, K)) for name in ['ordered', 'cooccurrence', 'gap']]
+            postings = None
+            if 'posting_rows' in f.files:
+                postings = tuple(f[x] for x in ['posting_codes', 'posting_offsets', 'posting_rows'])
+            return cls(f['diseases'], f['offsets'], f['codes'], *matrices, postings=postings)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Covariate-pattern compression: rows with identical (strata, outcome,
+covariates) are collapsed into one row with an integer frequency weight.
+The designs of this project are mostly binary dummies, so the number of
+distinct patterns is usually orders of magnitude below the number of rows.
+"""
+
+import numpy as np
+import statsmodels.api as sm
+
+
+def compress_patterns(y, X, strata=None):
+    """
+    collapse identical rows of (strata, y, X)
+    y may be 2-d, e.g. (time, status) for a Cox model
+    returns (y, X, strata, weights); strata is None if not given
+    """
+    y = np.asarray(y, dtype=np.float64)
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    y_2d = y.reshape(len(y), -1)
+    blocks = [y_2d, X]
+    if strata is not None:
+        strata_values, strata_codes = np.unique(np.asarray(strata), return_inverse=True)
+        blocks = [strata_codes.reshape(-1, 1).astype(np.float64)] + blocks
+    patterns, weights = np.unique(np.hstack(blocks), axis=0, return_counts=True)
+
+    start = 0
+    strata_ = None
+    if strata is not None:
+        strata_ = strata_values[patterns[:, 0].astype(np.int64)]
+        start = 1
+    y_ = patterns[:, start:start+y_2d.shape[1]]
+    X_ = patterns[:, start+y_2d.shape[1]:]
+    if y.ndim == 1:
+        y_ = y_[:, 0]
+    return y_, X_, strata_, weights
+
+
+def weighted_logit(y, X, weights):
+    """
+    unpenalized logistic regression with frequency weights; same estimates,
+    standard errors and confidence intervals as sm.Logit on the expanded rows
+    """
+    return sm.GLM(y, X, family=sm.families.Binomial(), freq_weights=np.asarray(weights, dtype=np.float64))
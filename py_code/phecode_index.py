@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Phecode metadata (hierarchy, exclusion ranges, sex restriction) parsed once
+from phecode_definitions1.2.csv into integer-coded arrays, and a bit-packed
+patient history matrix, so that the patients eligible for a phecode are one
+vectorized boolean mask.
+
+Run as a script to precompute both (and the inpatient CohortIndex) for the
+matched cohort; the .npz files load in milliseconds in the worker processes
+and can be shared between them with shared_cohort.py.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from cohort_index import phecode_key
+from shared_cohort import load_npz
+
+sex_code = {'Female':1, 'Male':2}
+
+
+def range_d(x):
+    """
+    phecode merge
+    examples：254.2 --> 254.29
+    241.0 --> 241.99
+    241.23 --> 241.23
+    """
+    x_str = str(x)
+    if x_str.split('.')[1] == '0':
+        return round(x+0.99,2)
+    elif len(x_str.split('.')[1]) == 1:
+        return round(x+0.09,2)
+    else:
+        return x
+
+
+def phecode_level(x):
+    x_str = str(x)
+    if x_str.split('.')[1] == '0':
+        return 1
+    elif len(x_str.split('.')[1]) == 1:
+        return 2
+    else:
+        return 3
+
+
+class PhecodeIndex(object):
+    """
+    Integer-coded phecode definitions.
+
+    phecodes are sorted by key (phecode*100); exclusion ranges are stored as
+    flat (lower, upper) key arrays with per-phecode offsets; sex is 0 for no
+    restriction, 1 for female-only and 2 for male-only phecodes.
+    """
+
+    def __init__(self, phecodes, level, upper, sex, excl_offsets, excl_lower, excl_upper, category):
+        self.phecodes = np.asarray(phecodes, dtype=np.float64)
+        self.keys = phecode_key(self.phecodes)
+        self.level = np.asarray(level, dtype=np.int8)
+        self.upper = np.asarray(upper, dtype=np.int64)
+        self.sex = np.asarray(sex, dtype=np.int8)
+        self.excl_offsets = np.asarray(excl_offsets, dtype=np.int64)
+        self.excl_lower = np.asarray(excl_lower, dtype=np.int64)
+        self.excl_upper = np.asarray(excl_upper, dtype=np.int64)
+        self.category = np.asarray(category, dtype=object)
+
+    @classmethod
+    def from_frame(cls, phecode_cate):
+        phecode_cate = phecode_cate.dropna(subset=['phecode'])
+        phecode_cate = phecode_cate.iloc[np.argsort(phecode_key(phecode_cate['phecode'].values), kind='stable')]
+        phecodes = phecode_cate['phecode'].values.astype(np.float64)
+
+        excl_offsets, excl_lower, excl_upper = [0], [], []
+        for exl_range in phecode_cate['phecode_exclude_range'].values:
+            if not pd.isna(exl_range):
+                for range_ in str(exl_range).split(','):
+                    bounds = range_.strip().split('-')
+                    excl_lower.append(float(bounds[0]))
+                    excl_upper.append(float(bounds[-1]))
+            excl_offsets.append(len(excl_lower))
+
+        return cls(phecodes,
+                   [phecode_level(x) for x in phecodes],
+                   phecode_key([range_d(x) for x in phecodes]),
+                   [sex_code.get(x, 0) for x in phecode_cate['sex'].values],
+                   excl_offsets, phecode_key(excl_lower), phecode_key(excl_upper),
+                   phecode_cate['category'].values)
+
+    @classmethod
+    def from_csv(cls, file):
+        return cls.from_frame(pd.read_csv(file))
+
+    #------------------------------------------------------------------
+    def position(self, code):
+        pos = np.searchsorted(self.keys, phecode_key(code))
+        if pos >= len(self.keys) or self.keys[pos] != phecode_key(code):
+            raise KeyError('phecode %s not in the phecode definitions' % code)
+        return pos
+
+    def children(self, code):
+        """
+        phecodes covered by code, i.e. code <= x <= range_d(code)
+        """
+        pos = self.position(code)
+        start = np.searchsorted(self.keys, self.keys[pos], side='left')
+        stop = np.searchsorted(self.keys, self.upper[pos], side='right')
+        return self.phecodes[start:stop]
+
+    def exclusion_columns(self, code):
+        """
+        positions of all phecodes within the exclusion ranges of code
+        """
+        pos = self.position(code)
+        lower = self.excl_lower[self.excl_offsets[pos]:self.excl_offsets[pos+1]]
+        upper = self.excl_upper[self.excl_offsets[pos]:self.excl_offsets[pos+1]]
+        cols = [np.arange(np.searchsorted(self.keys, l, side='left'),
+                          np.searchsorted(self.keys, u, side='right')) for l, u in zip(lower, upper)]
+        if len(cols) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(cols))
+
+    def exclusion_signature(self, code):
+        """
+        hashable description of the exclusion criteria of code; phecodes with
+        the same signature have the same eligible population
+        """
+        pos = self.position(code)
+        ranges = zip(self.excl_lower[self.excl_offsets[pos]:self.excl_offsets[pos+1]],
+                     self.excl_upper[self.excl_offsets[pos]:self.excl_offsets[pos+1]])
+        return (int(self.sex[pos]), tuple(sorted(ranges)))
+
+    def excluded_sex(self, code):
+        """
+        cohort sex value (0/1) excluded for code, None if not sex specific
+        exc_sex[0] holds the female-only phecodes, exc_sex[1] the male-only ones
+        """
+        restriction = self.sex[self.position(code)]
+        if restriction == 1:
+            return 0
+        elif restriction == 2:
+            return 1
+        return None
+
+    def eligible(self, code, history, sex):
+        """
+        boolean mask over patients: no history within the exclusion range of
+        code and not of the excluded sex
+        """
+        mask = ~history.any_of(self.exclusion_columns(code))
+        excluded_sex = self.excluded_sex(code)
+        if excluded_sex is not None:
+            mask &= np.asarray(sex, dtype=np.int64) != excluded_sex
+        return mask
+
+    #------------------------------------------------------------------
+    def save(self, file):
+        np.savez(os.path.expanduser(file), phecodes=self.phecodes, level=self.level, upper=self.upper, sex=self.sex,
+                 excl_offsets=self.excl_offsets, excl_lower=self.excl_lower, excl_upper=self.excl_upper,
+                 category=self.category.astype(str))
+
+    @classmethod
+    def load(cls, file):
+        with load_npz(file) as f:
+            return cls(f['phecodes'], f['level'], f['upper'], f['sex'], f['excl_offsets'],
+                       f['excl_lower'], f['excl_upper'], f['category'])
+
+
+class EligibilityCache(object):
+    """
+    eligible() masks of one cohort cached by exclusion signature, so a level 1
+    phecode and its level 2 children with the same exclusion criteria share
+    one mask; the least recently used masks are dropped beyond size
+    """
+
+    def __init__(self, phecode_index, history, sex, size=32):
+        self.phecode_index = phecode_index
+        self.history = history
+        self.sex = np.asarray(sex, dtype=np.int64)
+        self.size = size
+        self.masks = OrderedDict()
+
+    def __call__(self, code):
+        signature = self.phecode_index.exclusion_signature(code)
+        if signature in self.masks:
+            self.masks.move_to_end(signature)
+        else:
+            self.masks[signature] = self.phecode_index.eligible(code, self.history, self.sex)
+            if len(self.masks) > self.size:
+                self.masks.popitem(last=False)
+        return self.masks[signature]
+
+
+def _popcount(words):
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum())
+    return int(np.unpackbits(words.view(np.uint8)).sum())
+
+
+class EligibilityMatrix(object):
+    """
+    Bit-packed disease x patient eligibility, the replacement of the
+    'd_eligible' list column: one row of ceil(n/64) little-endian uint64
+    words per disease, patient i in bit i%64 of word i//64. The population
+    of a pair is the AND of two rows.
+    """
+
+    def __init__(self, words, diseases, n_patients):
+        self.words = words
+        self.diseases = np.asarray(diseases, dtype=np.float64)
+        self.n_patients = int(n_patients)
+        self.rows_ = {k:i for i, k in enumerate(phecode_key(self.diseases))}
+
+    @classmethod
+    def from_mask(cls, mask, diseases):
+        """
+        build from a (patients x diseases) boolean matrix
+        """
+        mask = np.asarray(mask, dtype=bool)
+        packed = np.packbits(mask.T, axis=1, bitorder='little')
+        padded = np.zeros((packed.shape[0], -(-packed.shape[1]//8)*8), dtype=np.uint8)
+        padded[:, :packed.shape[1]] = packed
+        return cls(padded.view('<u8'), diseases, mask.shape[0])
+
+    @classmethod
+    def from_phecodes(cls, phecode_index, diseases, history, sex):
+        eligible = EligibilityCache(phecode_index, history, sex)
+        return cls.from_mask(np.column_stack([eligible(x) for x in diseases]), diseases)
+
+    def _and(self, codes):
+        words = None
+        for code in codes:
+            row = self.words[self.rows_[phecode_key(code)]]
+            words = row.copy() if words is None else np.bitwise_and(words, row, out=words)
+        return words
+
+    def count(self, *codes):
+        """
+        number of patients eligible for all the given diseases
+        """
+        return _popcount(self._and(codes))
+
+    def mask(self, *codes):
+        """
+        boolean mask over patients eligible for all the given diseases
+        """
+        return np.unpackbits(self._and(codes).view(np.uint8), count=self.n_patients,
+                             bitorder='little').astype(bool)
+
+    def rows(self, *codes):
+        """
+        rows of the patients eligible for all the given diseases
+        """
+        return np.flatnonzero(self.mask(*codes))
+
+    def signature(self, *codes):
+        """
+        digest of the population eligible for all the given diseases, equal for
+        equal populations
+        """
+        return hashlib.blake2b(self._and(codes).tobytes(), digest_size=16).hexdigest()
+
+    def to_mask(self):
+        """
+        the (patients x diseases) boolean matrix
+        """
+        return np.column_stack([self.mask(x) for x in self.diseases])
+
+    def save(self, file):
+        np.savez(os.path.expanduser(file), words=self.words, diseases=self.diseases, n_patients=self.n_patients)
+
+    @classmethod
+    def load(cls, file):
+        with load_npz(file) as f:
+            return cls(f['words'], f['diseases'], f['n_patients'])
+
+
+class HistoryMatrix(object):
+    """
+    Bit-packed phecode x patient matrix of medical history: one row of
+    ceil(n/8) bytes per phecode of a PhecodeIndex, patient i in bit i
+    (little bit order). Codes missing from the definitions are ignored.
+    """
+
+    def __init__(self, bits, keys, n_patients):
+        self.bits = bits
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.n_patients = int(n_patients)
+
+    @classmethod
+    def from_arrays(cls, rows, codes, n_patients, phecode_index):
+        keys = phecode_key(codes)
+        cols = np.searchsorted(phecode_index.keys, keys)
+        cols = np.clip(cols, 0, len(phecode_index.keys)-1)
+        found = phecode_index.keys[cols] == keys
+        rows, cols = np.asarray(rows, dtype=np.int64)[found], cols[found]
+        bits = np.zeros((len(phecode_index.keys), (n_patients+7)//8), dtype=np.uint8)
+        np.bitwise_or.at(bits, (cols, rows >> 3), np.left_shift(1, rows & 7).astype(np.uint8))
+        return cls(bits, phecode_index.keys, n_patients)
+
+    @classmethod
+    def from_series(cls, series, phecode_index):
+        """
+        build from a column of phecode lists such as 'history'
+        """
+        rows, codes = [], []
+        for i, x in enumerate(series):
+            if isinstance(x, (list, tuple, set, np.ndarray)):
+                for k in x:
+                    if not pd.isna(k):
+                        rows.append(i)
+                        codes.append(k)
+        return cls.from_arrays(rows, np.asarray(codes, dtype=np.float64), len(series), phecode_index)
+
+    def any_of(self, cols):
+        """
+        boolean mask over patients with any of the phecode columns in history
+        """
+        if len(cols) == 0:
+            return np.zeros(self.n_patients, dtype=bool)
+        packed = np.bitwise_or.reduce(self.bits[cols], axis=0)
+        return np.unpackbits(packed, count=self.n_patients, bitorder='little').astype(bool)
+
+    def save(self, file):
+        np.savez(os.path.expanduser(file), bits=self.bits, keys=self.keys, n_patients=self.n_patients)
+
+    @classmethod
+    def load(cls, file):
+        with load_npz(file) as f:
+            return cls(f['bits'], f['keys'], f['n_patients'])
+
+
+if __name__ == "__main__":
+    path = r'~/depression/'
+    phecode_index = PhecodeIndex.from_csv(path + 'originData/phecode_definitions1.2.csv')
+    phecode_index.save(path + 'age/phecode_index.npz')
+
+    from cohort_store import CohortStore
+    cohort_store = CohortStore(path + 'age/df_merged_store')
+    history_matrix = cohort_store.history_matrix('history', phecode_index)
+    history_matrix.save(path + 'age/history_matrix.npz')
+    cohort_store.cohort_index('inpatient').save(path + 'age/inpatient_index.npz')
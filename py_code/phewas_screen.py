@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-screen of the PheWAS: exposed/unexposed case counts and person-years of
+every candidate phecode in one pass over the cohort, so that cox() is only
+dispatched for the phecodes with at least `threshold` exposed cases.
+
+The first occurrence of each phecode (the earliest over its children in the
+phecode tree, so level 1 covers its level 2/3 codes) comes from
+CohortIndex.first_occurrences() as sparse (phecode, patient, time)
+triplets. Person-time is the follow-up to time_end of every eligible
+patient, minus the part after the outcome for the patients with one.
+Eligibility masks are built once per exclusion signature.
+
+The rows are those cox() returns: 'Sex specific' (no eligible patient),
+'less than threshold' with the exp/unexp strings, or describe = None for the
+phecodes to fit.
+"""
+
+import numpy as np
+import pandas as pd
+
+year = 365.25*24*3600
+
+
+def _exp_string(n, time):
+    return '%i/%.2f (%.2f)' % (n, time, n/time)
+
+
+def screen(phecodes, dataset, date_start_variable, threshold, inpatient_index, phecode_index,
+           history_matrix, exposure_variable='outcome', date_end_variable='time_end'):
+    """
+    one row per phecode: disease, number, describe, exp, unexp
+    dataset rows must be the rows of inpatient_index and history_matrix
+    """
+    phecodes = np.asarray(phecodes, dtype=np.float64)
+    exposure = dataset[exposure_variable].values.astype(np.float64)
+    groups = {1:exposure == 1, 0:exposure == 0}
+    start = dataset[date_start_variable].values.astype(np.float64)
+    end = dataset[date_end_variable].values.astype(np.float64)
+    base = (end - start)/year
+
+    code_sets = [phecode_index.children(x) for x in phecodes]
+    set_id, rows, d_time = inpatient_index.first_occurrences(code_sets)
+    set_bounds = np.searchsorted(set_id, np.arange(len(phecodes)+1))
+    #follow-up of the patients with the outcome: np.nanmin(d_time, time_end) - start
+    event_time = (np.fmin(d_time, end[rows]) - start[rows])/year
+    correction = np.nan_to_num(event_time) - np.nan_to_num(base[rows])
+
+    signatures = {}
+    for i, x in enumerate(phecodes):
+        signatures.setdefault(phecode_index.exclusion_signature(x), []).append(i)
+
+    result = [None]*len(phecodes)
+    for members in signatures.values():
+        eligible = phecode_index.eligible(phecodes[members[0]], history_matrix, dataset['sex'].values)
+        if not eligible.any():
+            for i in members:
+                result[i] = [phecodes[i], 'Sex specific']
+            continue
+        base_time = {g:np.nansum(base[eligible & mask]) for g, mask in groups.items()}
+        for i in members:
+            lower, upper = set_bounds[i], set_bounds[i+1]
+            case_rows = rows[lower:upper]
+            keep = eligible[case_rows]
+            case_rows, case_correction = case_rows[keep], correction[lower:upper][keep]
+            n = {g:int(mask[case_rows].sum()) for g, mask in groups.items()}
+            time = {g:(base_time[g] + case_correction[mask[case_rows]].sum())/1000 for g, mask in groups.items()}
+            describe = 'less than threshold' if n[1] < threshold else None
+            result[i] = [phecodes[i], n[1], describe, _exp_string(n[1], time[1]), _exp_string(n[0], time[0])]
+    return pd.DataFrame(result, columns=['disease', 'number', 'describe', 'exp', 'unexp'])
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog of the result shards of a stage, replacing the os.walk loops with
+`phe = pd.concat([csv, phe])` of the summary scripts, which re-parsed every
+shard on every run and were quadratic in the number of shards.
+
+The shards matching a glob pattern (per-worker CSVs or ResultSink SQLite
+files) are registered in catalog.json with their size, modification time,
+row count and column dtypes. Unregistered or changed shards are read in
+parallel threads with the given dtypes and concatenated once. The merged
+table is cached as a cohort_store column store next to the shards:
+
+    unchanged shards          the cached table, no shard is parsed
+    only new shards           the cached table + the new shards
+    changed or removed shard  full rebuild
+
+The cached table is restored with the registered dtypes, so a summary reads
+the same frame from the cache as from the shards. The merged frame has a
+fresh RangeIndex; the shard indexes were per-worker row numbers.
+
+    python result_catalog.py --directory ~/depression/age/result/phewas --pattern "**/*L1L2*.csv" --name cox_result_L1L2
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from cohort_store import CohortStore, save_frame
+from result_sink import read_shard
+
+
+def read_table(file, dtype=None):
+    """
+    one shard, a ResultSink .sqlite file or a CSV written with its index
+    """
+    if file.endswith('.sqlite'):
+        df = read_shard(file)
+        return df.astype({x:y for x, y in (dtype or {}).items() if x in df.columns})
+    return pd.read_csv(file, index_col=0, dtype=dtype)
+
+
+class ResultCatalog(object):
+
+    def __init__(self, directory, pattern, name, dtype=None, threads=8):
+        """
+        directory: the result directory, pattern: glob of the shards below it
+        ('**' matches subdirectories), name: the cache of this pattern,
+        kept in directory/.catalog/name
+        dtype: {column: dtype} of the shards, the other columns are inferred
+        """
+        self.directory = os.path.expanduser(directory)
+        self.pattern = pattern
+        self.dtype = dtype
+        self.threads = threads
+        self.cache = os.path.join(self.directory, '.catalog', name)
+        self.catalog_file = os.path.join(self.cache, 'catalog.json')
+
+    def files(self):
+        return sorted(glob.glob(os.path.join(self.directory, self.pattern), recursive=True))
+
+    def _stat(self, file):
+        stat = os.stat(file)
+        return {'file':os.path.relpath(file, self.directory), 'size':stat.st_size, 'mtime':stat.st_mtime_ns}
+
+    def _load_catalog(self):
+        try:
+            with open(self.catalog_file) as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(os.path.join(self.cache, catalog['table'], 'meta.json')):
+            return None
+        return catalog
+
+    def shards(self):
+        """
+        the registered shards as a table (file, size, mtime, rows, columns)
+        """
+        catalog = self._load_catalog()
+        shards = [] if catalog is None else catalog['shards']
+        return pd.DataFrame(shards, columns=['file','size','mtime','rows','columns'])
+
+    def _read_shards(self, files):
+        with ThreadPoolExecutor(max(1, min(self.threads, len(files)))) as pool:
+            return list(pool.map(lambda x: read_table(x, self.dtype), files))
+
+    def read(self):
+        """
+        the merged table of all the shards, from the cache where possible
+        """
+        stats = [self._stat(x) for x in self.files()]
+        catalog = self._load_catalog()
+        registered = {} if catalog is None else {x['file']:x for x in catalog['shards']}
+        current = set(x['file'] for x in stats)
+        unchanged = [x for x in stats if x['file'] in registered and
+                     (registered[x['file']]['size'], registered[x['file']]['mtime']) == (x['size'], x['mtime'])]
+        if catalog is not None and len(unchanged) == len(registered) and set(registered) <= current:
+            new = [x for x in stats if x['file'] not in registered]
+            shards = catalog['shards']
+            frames = [self._restore(catalog)]
+        else:
+            new, shards, frames = stats, [], []
+        if len(new) == 0:
+            return frames[0] if frames else pd.DataFrame()
+
+        new_frames = self._read_shards([os.path.join(self.directory, x['file']) for x in new])
+        for stat, frame in zip(new, new_frames):
+            shards.append(dict(stat, rows=len(frame), columns=[str(x) for x in frame.columns]))
+        merged = pd.concat(frames + new_frames, ignore_index=True)
+        self._store(merged, shards, catalog)
+        return merged
+
+    def _restore(self, catalog):
+        merged = CohortStore(os.path.join(self.cache, catalog['table']), mmap=False).read()
+        return merged.astype(catalog['dtypes'])
+
+    def _store(self, merged, shards, catalog):
+        """
+        write the merged table, then point catalog.json at it (atomic), then drop the old table
+        """
+        table = 'table_%i' % (os.getpid())
+        if catalog is not None and catalog['table'] == table:
+            table += '_'
+        save_frame(merged, os.path.join(self.cache, table), time_columns=())
+        new_catalog = {'pattern':self.pattern, 'table':table, 'shards':shards,
+                       'dtypes':{str(x):str(y) for x, y in merged.dtypes.items()}}
+        with open(self.catalog_file + '.tmp', 'w') as f:
+            json.dump(new_catalog, f, indent=1)
+        os.replace(self.catalog_file + '.tmp', self.catalog_file)
+        if catalog is not None:
+            shutil.rmtree(os.path.join(self.cache, catalog['table']), ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.cache, ignore_errors=True)
+
+
+def read_catalog(directory, pattern, name, dtype=None):
+    """
+    the merged shards of pattern below directory, an empty frame if there is none
+    """
+    return ResultCatalog(directory, pattern, name, dtype=dtype).read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='New_depression project')
+    parser.add_argument('--directory', type=str)
+    parser.add_argument('--pattern', type=str)
+    parser.add_argument('--name', type=str)
+    parser.add_argument('--clear', action='store_true', help='drop the cached table and the registry')
+    args = parser.parse_args()
+    catalog = ResultCatalog(args.directory, args.pattern, args.name)
+    if args.clear:
+        catalog.clear()
+    catalog.read()
+    print(catalog.shards())
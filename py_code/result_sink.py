@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Crash-safe result shards: every finished record is appended to a per-worker
+SQLite file and committed (fsync) in small batches, so a killed job loses at
+most the records of the current batch instead of the whole run.
+
+Each record carries the task key it answers (the work queue key), which lets
+a restarted worker skip everything already persisted in any shard.
+
+A shard is tied to the run of its work queue stage (WorkQueue.run_id()). A
+worker restarted within the same run keeps its shard. A shard of an earlier
+run (the stage was reset with `work_queue.py --reset`) is started empty, so
+a plain rerun never loses the results of tasks the queue already marks done,
+and a fresh run after a reset does not mix in stale records.
+"""
+
+import glob
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+
+def _to_sql(value):
+    if value is None:
+        return None
+    if isinstance(value, (np.integer, np.bool_)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, (int, str, bytes)):
+        return value
+    return str(value)
+
+
+def _shard_run(conn):
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE name='run'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return None if row is None else row[0]
+
+
+class ResultSink(object):
+    """
+    append-only result shard
+
+    mode 'a' keeps what is already there, mode 'w' starts the shard empty;
+    run: the work queue run the records belong to, a shard written by another
+    run is started empty; records with a key that is already stored are ignored
+    batch / max_wait: commit after this many records or seconds
+    """
+
+    def __init__(self, file, columns, mode='a', run=None, batch=1, max_wait=60, timeout=600):
+        self.file = os.path.expanduser(file)
+        self.columns = list(columns)
+        self.batch = batch
+        self.max_wait = max_wait
+        self.buffer = []
+        self.last_flush = time.time()
+        self.conn = sqlite3.connect(self.file, timeout=timeout)
+        self.conn.execute('PRAGMA synchronous=FULL')
+        stored_run = _shard_run(self.conn)
+        with self.conn:
+            if mode == 'w' or (run is not None and stored_run is not None and stored_run != run):
+                self.conn.execute('DROP TABLE IF EXISTS results')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS results (_key TEXT PRIMARY KEY, %s)' %
+                              ', '.join('"%s"' % x for x in self.columns))
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            if run is not None:
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)", (str(run),))
+
+    def append(self, key, record):
+        if len(record) > len(self.columns):
+            raise ValueError('record has %i values, expected %i' % (len(record), len(self.columns)))
+        #short records are padded like pd.DataFrame(list_of_lists) does
+        record = list(record) + [None]*(len(self.columns) - len(record))
+        self.buffer.append([str(key)] + [_to_sql(x) for x in record])
+        if len(self.buffer) >= self.batch or time.time() - self.last_flush >= self.max_wait:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            with self.conn:
+                self.conn.executemany('INSERT OR IGNORE INTO results VALUES (%s)' %
+                                      ', '.join(['?']*(len(self.columns)+1)), self.buffer)
+            self.buffer = []
+        self.last_flush = time.time()
+
+    def discard(self, keys):
+        """
+        drop the records of keys, e.g. of a task whose lease was lost
+        """
+        self.flush()
+        with self.conn:
+            self.conn.executemany('DELETE FROM results WHERE _key=?', [(str(x),) for x in keys])
+
+    def keys(self):
+        self.flush()
+        return set(x[0] for x in self.conn.execute('SELECT _key FROM results'))
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def read_shard(file, with_key=False):
+    conn = sqlite3.connect(os.path.expanduser(file))
+    try:
+        df = pd.read_sql_query('SELECT * FROM results ORDER BY rowid', conn)
+    finally:
+        conn.close()
+    return df if with_key else df.drop(columns=['_key'])
+
+
+def shard_files(pattern):
+    return sorted(glob.glob(os.path.expanduser(pattern)))
+
+
+def persisted_keys(pattern, run=None):
+    """
+    keys already stored in any shard matching pattern, only the shards of run if given
+    """
+    keys = set()
+    for file in shard_files(pattern):
+        conn = sqlite3.connect(file)
+        try:
+            if run is not None and _shard_run(conn) != str(run):
+                continue
+            keys.update(x[0] for x in conn.execute('SELECT _key FROM results'))
+        except sqlite3.OperationalError:
+            continue
+        finally:
+            conn.close()
+    return keys
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Incidence-density (risk-set) matching of the conditional-logistic stage.
+
+A control for a case with event time t has the same exact-match keys (sex,
+famIncome), a birth date within the caliper (one year) and is still at risk
+at t: not dead (time_end <= t) and not yet a case (event time <= t). The
+candidates are bucketed by the exact keys and sorted by birth date once, so
+the caliper window of a case is a slice found by binary search. Controls are
+drawn from the window by rejection sampling on the exit time (the earlier of
+time_end and the event time), which falls back to filtering the whole window
+when most of it is no longer at risk. Each case has its own generator seeded
+with (seed, eid), so the draws do not depend on the order of the cases or on
+the other pairs processed.
+
+The output is the d_match() table: eid, outcome_conlo, date_start_conlo,
+match_2_conlo, one row for the case followed by its controls.
+
+The matched sets of a pair depend only on the outcome (d2) event times and
+the eligible population, so MatchedSetCache keeps them for the other pairs
+with the same outcome disease, which only differ in the exposure column.
+"""
+
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+one_year = 365.25*24*3600
+match_columns = ['eid','outcome_conlo','date_start_conlo','match_2_conlo']
+
+
+def _no_nan(x):
+    x = np.asarray(x, dtype=np.float64)
+    return np.where(np.isnan(x), np.inf, x)
+
+
+class RiskSetMatcher(object):
+
+    def __init__(self, dataset, time_var, exact=('sex','famIncome'), caliper_var='birth_date',
+                 caliper=one_year, end_var='time_end'):
+        """
+        dataset: one row per candidate with eid, the exact keys, caliper_var, end_var
+                 and time_var (event time, NaN for non-cases)
+        """
+        self.eid = dataset['eid'].values
+        self.index = dataset.index
+        self.event = dataset[time_var].values.astype(np.float64)
+        self.birth = dataset[caliper_var].values.astype(np.float64)
+        self.caliper = caliper
+        #rows with a missing key never match, as NaN == NaN is False
+        self.bucket = dataset.groupby(list(exact), sort=False, dropna=True).ngroup().values
+        self.bucket = np.where(np.isnan(self.bucket.astype(np.float64)), -1, self.bucket).astype(np.int64)
+        exit_ = np.fmin(_no_nan(dataset[end_var].values), _no_nan(self.event))
+
+        valid = self.bucket >= 0
+        order = np.flatnonzero(valid)[np.lexsort((self.birth[valid], self.bucket[valid]))]
+        self.order = order
+        self.sorted_birth = self.birth[order]
+        self.sorted_exit = exit_[order]
+        n_buckets = int(self.bucket.max()) + 1 if valid.any() else 0
+        self.bucket_start = np.searchsorted(self.bucket[order], np.arange(n_buckets + 1))
+
+    def windows(self, rows):
+        """
+        (lower, upper) positions in the sorted candidates of the caliper window of rows
+        """
+        lower = np.zeros(len(rows), dtype=np.int64)
+        upper = np.zeros(len(rows), dtype=np.int64)
+        bucket, birth = self.bucket[rows], self.birth[rows]
+        for b in np.unique(bucket[(bucket >= 0) & ~np.isnan(birth)]):
+            members = np.flatnonzero((bucket == b) & ~np.isnan(birth))
+            start, stop = self.bucket_start[b], self.bucket_start[b+1]
+            births = self.sorted_birth[start:stop]
+            lower[members] = start + np.searchsorted(births, birth[members] - self.caliper, side='left')
+            upper[members] = start + np.searchsorted(births, birth[members] + self.caliper, side='right')
+        return lower, upper
+
+    def _draw(self, rng, lower, upper, time_, n, tries):
+        """
+        up to n positions in [lower, upper) at risk at time_, uniformly without replacement
+        """
+        size = upper - lower
+        if size > 4*n:
+            chosen = []
+            for k in lower + rng.integers(size, size=tries):
+                if self.sorted_exit[k] > time_ and k not in chosen:
+                    chosen.append(k)
+                    if len(chosen) == n:
+                        return np.array(chosen, dtype=np.int64)
+        at_risk = lower + np.flatnonzero(self.sorted_exit[lower:upper] > time_)
+        if len(at_risk) <= n:
+            return at_risk
+        return rng.choice(at_risk, n, replace=False)
+
+    def match(self, n=2, seed=0, tries=None):
+        """
+        the match table of all cases, in dataset order, indexed by the dataset
+        index labels of the matched rows
+        """
+        cases = np.flatnonzero(~np.isnan(self.event))
+        lower, upper = self.windows(cases)
+        tries = 8*n if tries is None else tries
+        rows, outcome, group = [], [], []
+        for iter_, (j, lo, hi) in enumerate(zip(cases, lower, upper)):
+            rng = np.random.default_rng([seed, int(self.eid[j])])
+            controls = self.order[self._draw(rng, lo, hi, self.event[j], n, tries)]
+            rows.append([j])
+            rows.append(controls)
+            outcome.append(np.arange(len(controls) + 1) == 0)
+            group.append(np.full(len(controls) + 1, iter_, dtype=np.int64))
+        if len(rows) == 0:
+            return pd.DataFrame(columns=match_columns, index=self.index[:0])
+        rows, group = np.concatenate(rows).astype(np.int64), np.concatenate(group)
+        return pd.DataFrame({'eid':self.eid[rows],
+                             'outcome_conlo':np.concatenate(outcome).astype(np.int64),
+                             'date_start_conlo':self.event[cases][group],
+                             'match_2_conlo':group}, index=self.index[rows])[match_columns]
+
+
+class MatchedSetCache(object):
+    """
+    match tables cached by key, e.g. (outcome disease, eligibility signature,
+    matching spec, seed); the least recently used tables are dropped once
+    their total size exceeds memory (bytes), the newest is always kept
+    """
+
+    def __init__(self, memory=2**30):
+        self.memory = memory
+        self.tables = OrderedDict()
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+
+    def __call__(self, key, build):
+        """
+        the table of key, build() on a miss
+        """
+        if key in self.tables:
+            self.hits += 1
+            self.tables.move_to_end(key)
+            return self.tables[key]
+        self.misses += 1
+        table = build()
+        self.tables[key] = table
+        self.nbytes += int(table.memory_usage(index=True).sum())
+        while self.nbytes > self.memory and len(self.tables) > 1:
+            _, dropped = self.tables.popitem(last=False)
+            self.nbytes -= int(dropped.memory_usage(index=True).sum())
+        return table
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Shared design of the unconditional RPCN stage (9_unconlo.py).
+
+The covariate block of every comorbid pair is the same matrix: the
+demographic dummies and the VIF-screened disease columns of the whole
+cohort. SharedDesign materializes it once as a float64 matrix, the dtype of
+the fits; a pair takes its eligible rows and drops its own two diseases and
+the columns without variance on those rows, instead of re-slicing and
+re-typing the DataFrame. The variance check reads the rows in chunks, so
+the pair block is the only copy, gathered rows and columns at once (a view
+when the rows are contiguous and no column is dropped).
+
+warm_start() maps the coefficients of the previous pair onto the columns of
+the next one, so consecutive pairs with the same d1 (the same outcome) start
+the L1 path near their solution.
+"""
+
+import numpy as np
+
+
+class SharedDesign(object):
+
+    def __init__(self, frame, fixed, candidates, chunk=1<<16):
+        """
+        frame: cohort DataFrame, fixed: covariates kept in every model,
+        candidates: disease columns subject to the L1 selection
+        chunk: rows per read of the variance check
+        """
+        self.fixed = list(fixed)
+        self.candidates = list(candidates)
+        self.columns = self.fixed + self.candidates
+        self.X = np.ascontiguousarray(frame[self.columns].values, dtype=np.float64)
+        self.chunk = chunk
+
+    @property
+    def n_rows(self):
+        return self.X.shape[0]
+
+    def _rows(self, rows):
+        """
+        rows as a slice if they are contiguous, else as sorted indices
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows) and np.all(np.diff(rows) == 1):
+            return slice(int(rows[0]), int(rows[-1]) + 1)
+        return rows
+
+    def _varies(self, rows):
+        """
+        columns that are not constant on rows
+        """
+        if isinstance(rows, slice):
+            block = self.X[rows]
+            return block.max(axis=0, initial=-np.inf) != block.min(axis=0, initial=np.inf)
+        high = np.full(self.X.shape[1], -np.inf)
+        low = np.full(self.X.shape[1], np.inf)
+        for i in range(0, len(rows), self.chunk):
+            block = self.X[rows[i:i+self.chunk]]
+            np.maximum(high, block.max(axis=0), out=high)
+            np.minimum(low, block.min(axis=0), out=low)
+        return high != low
+
+    def pair(self, rows, drop=()):
+        """
+        float64 design of rows (indices or boolean mask) without the columns in
+        drop and the columns without variance on rows
+        returns (X, fixed columns kept, candidate columns kept)
+        """
+        rows = self._rows(rows)
+        keep = self._varies(rows)
+        drop = set(drop)
+        keep &= np.array([x not in drop for x in self.columns], dtype=bool)
+        kept = [x for x, k in zip(self.columns, keep) if k]
+        n_fixed = int(keep[:len(self.fixed)].sum())
+        if isinstance(rows, slice):
+            X = self.X[rows] if keep.all() else self.X[rows][:, keep]
+        else:
+            X = self.X[np.ix_(rows, np.flatnonzero(keep))]
+        return X, kept[:n_fixed], kept[n_fixed:]
+
+def warm_start(coefficients, columns):
+    """
+    start values for columns from a {column: coefficient} dict of a previous fit, 0 if absent
+    """
+    return np.array([coefficients.get(x, 0.0) for x in columns], dtype=np.float64)
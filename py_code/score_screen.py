@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Score (Rao) test pre-screen of the exposure coefficient for the PheWAS Cox
+models (0_phewas.py) and the conditional and unconditional RPCN models
+(8_conlo.py, 9_unconlo.py).
+
+The score test only needs the gradient and the information of the full
+model at the null estimate (exposure coefficient 0, nuisance coefficients
+fitted without the exposure):
+
+    U = grad_e,  V = I_ee - I_eZ I_ZZ^-1 I_Ze,  U^2/V ~ chi2(1)
+
+so a pair or phecode whose null model is already available costs one
+derivative evaluation instead of an iterative fit. Candidates with a score
+p-value above a liberal cutoff skip the full (penalized path + Wald refit)
+analysis. They are reported with a NaN p and the score statistic and p-value
+in the note, so the BH step of the summaries ranks Wald p-values only.
+
+The null model does not depend on the exposure, so it is fitted once per
+population and outcome and kept in a NullFitCache: per matched set in the
+conditional model (all d1 of one d2), per eligible population in the
+unconditional model (all d2 of one d1). In the Cox model the outcome changes
+with every phecode, so the covariate-only null is fitted per phecode; the
+full fit of a candidate passing the screen starts from it, so the null fit
+is not wasted, but the Cox screen saves less than the logistic ones.
+"""
+
+from collections import OrderedDict
+import numpy as np
+from scipy.stats import chi2
+from cox_engine import _RiskSets, _loglik, _derivatives, fit_stratified_cox
+from penalized import logit_loss, l1_logit
+from conditional_logit import fit
+
+
+def efficient_score(grad, info, column=0):
+    """
+    score statistic and chi2(1) p-value of one coefficient from the gradient
+    and the information at the null estimate; NaN if its efficient information
+    vanishes (the exposure is constant or collinear with the covariates)
+    """
+    grad, info = np.asarray(grad, dtype=np.float64), np.asarray(info, dtype=np.float64)
+    others = np.delete(np.arange(len(grad)), column)
+    I_eZ = info[column, others]
+    V = info[column, column]
+    if len(others):
+        V -= I_eZ @ np.linalg.pinv(info[np.ix_(others, others)]) @ I_eZ
+    if not V > 1e-12*max(abs(info[column, column]), 1):
+        return np.nan, np.nan
+    statistic = grad[column]**2/V
+    return statistic, chi2.sf(statistic, 1)
+
+
+def cox_score_test(time, status, X, strata, null_params=None, weights=None):
+    """
+    score test of column 0 of X in the stratified Cox model, the other columns
+    at null_params; without null_params only column 0 is used (log-rank test)
+    returns (statistic, pvalue)
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    if null_params is None:
+        X, null_params = X[:, :1], np.zeros(0)
+    risk = _RiskSets(time, status, strata)
+    if len(risk.events) == 0:
+        return np.nan, np.nan
+    w = np.ones(len(risk.order)) if weights is None else np.asarray(weights, dtype=np.float64)[risk.order]
+    X = X[risk.order]
+    _, _, _, r, S0 = _loglik(risk, X, w, np.r_[0, null_params])
+    return efficient_score(*_derivatives(risk, X, w, r, S0))
+
+
+def conditional_logit_null(strata):
+    """
+    coefficients of the covariates (columns 1: of strata) without the exposure
+    """
+    p = strata.X.shape[2]
+    if p == 1 or strata.n_strata == 0:
+        return np.zeros(p - 1)
+    return fit(strata.take(np.arange(1, p)), maxiter=300).params
+
+
+def conditional_logit_score_test(strata, null_params):
+    """
+    score test of column 0 of the MatchedStrata, the other columns at null_params
+    returns (statistic, pvalue)
+    """
+    if strata.n_strata == 0:
+        return np.nan, np.nan
+    _, grad, hess = strata.loss()(np.r_[0, null_params])
+    return efficient_score(grad, hess)
+
+
+def logit_null(X, y, weights=None):
+    """
+    coefficients of the covariates (columns 1: of X, with the constant) without the exposure
+    """
+    X = np.asarray(X, dtype=np.float64)
+    return l1_logit(X[:, 1:], y, 0, weights=weights, maxiter=300)[0]
+
+
+def cox_null(time, status, X, strata, weights=None):
+    """
+    coefficients of the covariates (columns 1: of X) in the stratified Cox model without the exposure
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1 or X.shape[1] == 1:
+        return np.zeros(0)
+    return fit_stratified_cox(time, status, X[:, 1:], strata, weights=weights).params
+
+
+def logit_score_test(X, y, null_params, weights=None):
+    """
+    score test of column 0 of X in the logistic model, the other columns at null_params
+    returns (statistic, pvalue)
+    """
+    _, grad, hess = logit_loss(X, y, weights)(np.r_[0, null_params])
+    return efficient_score(grad, hess)
+
+
+def screened(pvalue, cutoff):
+    """
+    True if the candidate is screened out, never for a NaN score test
+    """
+    return cutoff is not None and pvalue > cutoff
+
+
+def screen_note(statistic, pvalue):
+    return 'score test screened: chi2=%.3f, p=%.3g' % (statistic, pvalue)
+
+
+class NullFitCache(object):
+    """
+    null model coefficients by key, e.g. (outcome, eligibility signature);
+    the least recently used are dropped beyond maxsize entries
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.params = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def __call__(self, key, build):
+        """
+        the coefficients of key, build() on a miss
+        """
+        if key in self.params:
+            self.hits += 1
+            self.params.move_to_end(key)
+            return self.params[key]
+        self.misses += 1
+        params = self.params[key] = build()
+        while len(self.params) > self.maxsize:
+            self.params.popitem(last=False)
+        return params
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Shared-memory launcher for the parallel '--number' workers.
+
+The launcher copies the arrays a stage reads (the .npy files of a column store
+and the precomputed .npz indexes) into multiprocessing.shared_memory segments
+once, writes their names to a manifest whose path is passed to the workers in
+the COHORT_SHM environment variable, and starts the workers. In a worker,
+load_npy / load_npz return read-only views on those segments instead of
+private copies, so N workers hold one copy of the cohort. Without COHORT_SHM
+they fall back to np.load and the scripts run stand-alone as before.
+
+    python shared_cohort.py --script 0_phewas.py --workers 30 --compress
+    python shared_cohort.py --script 8_conlo.py --workers 30 --coe 1 0.5 0.1
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+path = r'~/depression/'
+env_name = 'COHORT_SHM'
+
+#files shared for each stage, relative to path
+stage_files = {'0_phewas.py':['age/df_merged_store', 'age/phecode_index.npz', 'age/history_matrix.npz',
+                              'age/inpatient_index.npz'],
+               '8_conlo.py':['result/main_group_store', 'result/inpatient_level1_index_main_group.npz',
+                             'result/eligibility_main_group.npz'],
+               '9_unconlo.py':['result/main_group_store', 'result/inpatient_level1_index_main_group.npz',
+                               'result/eligibility_main_group.npz']}
+
+_manifest = None
+_segments = {}
+
+
+def _key(file, member=None):
+    key = os.path.abspath(os.path.expanduser(file))
+    return key if member is None else key + '::' + member
+
+
+def _arrays(file):
+    """
+    (key, array) of every array in a .npy/.npz file or a store directory
+    """
+    file = os.path.expanduser(file)
+    if os.path.isdir(file):
+        for name in sorted(os.listdir(file)):
+            if name.endswith('.npy'):
+                yield _key(os.path.join(file, name)), np.load(os.path.join(file, name), mmap_mode='r')
+    elif file.endswith('.npz'):
+        with np.load(file) as f:
+            for member in f.files:
+                yield _key(file, member), f[member]
+    else:
+        yield _key(file), np.load(file, mmap_mode='r')
+
+
+def publish(files):
+    """
+    copy the arrays of files into shared memory
+    returns (manifest, segments); the caller unlinks the segments
+    """
+    manifest, segments = {}, []
+    try:
+        for file in files:
+            for key, array in _arrays(file):
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                segments.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                manifest[key] = [shm.name, array.dtype.str, list(array.shape)]
+    except BaseException:
+        release(segments)
+        raise
+    return manifest, segments
+
+
+def release(segments):
+    for shm in segments:
+        shm.close()
+        shm.unlink()
+
+
+def _attach(name):
+    if name not in _segments:
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            #before python 3.13 an attaching process registers the segment with its
+            #resource tracker, which would unlink it when the worker exits
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        _segments[name] = shm
+    return _segments[name]
+
+
+def manifest():
+    global _manifest
+    if _manifest is None:
+        file = os.environ.get(env_name)
+        _manifest = {}
+        if file:
+            with open(file) as f:
+                _manifest = json.load(f)
+    return _manifest
+
+
+def shared_array(file, member=None):
+    """
+    read-only view on the published array of file (npz member), None if not published
+    """
+    entry = manifest().get(_key(file, member))
+    if entry is None:
+        return None
+    name, dtype, shape = entry
+    array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=_attach(name).buf)
+    array.flags.writeable = False
+    return array
+
+
+def load_npy(file, mmap_mode=None):
+    array = shared_array(file)
+    if array is None:
+        return np.load(os.path.expanduser(file), mmap_mode=mmap_mode)
+    return array
+
+
+class _SharedNpz(object):
+
+    def __init__(self, file, members):
+        self.file = file
+        self.files = members
+
+    def __getitem__(self, member):
+        return shared_array(self.file, member)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def load_npz(file):
+    """
+    np.load of an .npz file, answered from shared memory when published
+    """
+    prefix = _key(file) + '::'
+    members = [x[len(prefix):] for x in manifest() if x.startswith(prefix)]
+    if len(members) == 0:
+        return np.load(os.path.expanduser(file))
+    return _SharedNpz(file, members)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='New_depression project')
+    parser.add_argument('--script', type=str)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--share', type=str, nargs='*', help='files to share instead of the stage defaults')
+    args, extra = parser.parse_known_args()
+
+    files = args.share if args.share else [path + x for x in stage_files[os.path.basename(args.script)]]
+    manifest_, segments = publish(files)
+    print('%i arrays, %.1f MB in shared memory' % (len(segments), sum(x.size for x in segments)/2**20))
+    manifest_file = None
+    try:
+        with tempfile.NamedTemporaryFile('w', suffix='.json', prefix='cohort_shm_', delete=False) as f:
+            json.dump(manifest_, f)
+            manifest_file = f.name
+        env = dict(os.environ, **{env_name:manifest_file})
+        workers = [subprocess.Popen([sys.executable, args.script, '--number', str(i)] + extra, env=env)
+                   for i in range(args.workers)]
+        codes = [x.wait() for x in workers]
+    finally:
+        release(segments)
+        if manifest_file is not None:
+            os.remove(manifest_file)
+    for i, code in enumerate(codes):
+        if code != 0:
+            print('worker %i exited with %i' % (i, code))
+    sys.exit(max(codes, key=abs, default=0))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+py_code = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, py_code)
@@ -0,0 +1,40 @@
+import numpy as np
+from scipy.stats import binomtest
+from binomial_direction import binomial_greater, direction_table
+
+
+def d1d2_selection(d1, d2, len_d1d2, len_d2d1, length_full):
+    """
+    the old per-pair choice of the dominant order of 6_bino_test.py
+    """
+    d1_d2 = '%s-%s' % (str(d1),str(d2))
+    d2_d1 = '%s-%s' % (str(d2),str(d1))
+    if len_d1d2 >= len_d2d1:
+        p_value = binomtest(len_d1d2,length_full,alternative='greater').pvalue
+        return [d1,d2,d1_d2,len_d1d2,length_full,p_value]
+    else:
+        p_value = binomtest(len_d2d1,length_full,alternative='greater').pvalue
+        return [d2,d1,d2_d1,len_d2d1,length_full,p_value]
+
+
+def test_binomial_greater_matches_binomtest():
+    for n in [1, 2, 7, 40, 513, 5000]:
+        k = np.unique(np.linspace(0, n, 25).astype(int))
+        expected = [binomtest(x, n, alternative='greater').pvalue for x in k]
+        np.testing.assert_allclose(binomial_greater(k, n), expected, rtol=1e-10, atol=1e-300)
+
+
+def test_direction_table_matches_the_pair_loop():
+    rng = np.random.default_rng(0)
+    size = 200
+    full = rng.integers(1, 300, size)
+    forward = rng.binomial(full, rng.uniform(0.2, 0.5, size))
+    reverse = rng.binomial(full - forward, 0.6)
+    #ties keep the d1 -> d2 order
+    reverse[:5] = forward[:5]
+    d1 = rng.choice([10.0, 20.0, 30.1, 250.2], size)
+    d2 = rng.choice([40.0, 290.11, 401.1], size)
+    result = direction_table(d1, d2, forward, reverse, full)
+    expected = [d1d2_selection(*x) for x in zip(d1, d2, forward.tolist(), reverse.tolist(), full.tolist())]
+    assert result[['d1','d2','name','length','N']].values.tolist() == [x[:5] for x in expected]
+    np.testing.assert_allclose(result['p'], [x[5] for x in expected], rtol=1e-10, atol=1e-300)
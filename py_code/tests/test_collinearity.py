@@ -0,0 +1,68 @@
+import warnings
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from statsmodels.stats.outliers_influence import variance_inflation_factor
+from collinearity import gram_statistics, vif_from_statistics, variance_inflation_factors, vif_screen
+
+
+def vif_loop(frame):
+    """
+    the old per-column loop of 8_conlo.py, with the constant column appended
+    """
+    new_dataset = frame.copy()
+    new_dataset['constant'] = 1
+    covar_lst_all_d1 = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for i in range(len(new_dataset.columns)-1):
+            try:
+                vif = variance_inflation_factor(new_dataset.values, i)
+                if vif < 5:
+                    covar_lst_all_d1.append(new_dataset.columns[i])
+            except:
+                covar_lst_all_d1.append(new_dataset.columns[i])
+    return covar_lst_all_d1
+
+
+def diseases(n=3000, p=8, seed=0):
+    rng = np.random.default_rng(seed)
+    latent = rng.normal(size=(n, 1))
+    X = (rng.normal(size=(n, p)) + np.linspace(0, 2.5, p)*latent > 1).astype(float)
+    #a near copy of another column
+    X[:, -1] = np.abs(X[:, -2] - (rng.random(n) < 0.03))
+    return pd.DataFrame(X, columns=['d%i' % i for i in range(p)])
+
+
+def test_vif_matches_statsmodels():
+    frame = diseases()
+    constant = np.column_stack([frame.values, np.ones(len(frame))])
+    expected = [variance_inflation_factor(constant, i) for i in range(frame.shape[1])]
+    np.testing.assert_allclose(variance_inflation_factors(frame), expected, rtol=1e-8)
+    assert max(expected) > 5 > min(expected)
+    assert vif_screen(frame) == vif_loop(frame)
+
+
+def test_sparse_chunked_and_weighted_statistics():
+    frame = diseases(seed=1)
+    X = frame.values
+    vif = variance_inflation_factors(X)
+    np.testing.assert_allclose(variance_inflation_factors(sparse.csr_matrix(X)), vif, rtol=1e-10)
+    np.testing.assert_allclose(vif_from_statistics(*gram_statistics(X, chunk=100)), vif, rtol=1e-10)
+    #frequency weights equal repeated rows
+    counts = np.random.default_rng(1).integers(1, 4, len(X))
+    repeated = variance_inflation_factors(np.repeat(X, counts, axis=0))
+    np.testing.assert_allclose(variance_inflation_factors(X, weights=counts), repeated, rtol=1e-10)
+    np.testing.assert_allclose(variance_inflation_factors(sparse.csr_matrix(X), weights=counts), repeated,
+                               rtol=1e-10)
+
+
+def test_dependent_and_constant_columns_are_dropped():
+    frame = diseases(seed=2)
+    frame['sum'] = frame['d0'] + frame['d1']
+    frame['never'] = 0.0
+    vif = variance_inflation_factors(frame)
+    assert np.all(np.isinf(vif[[0, 1, 8]])) and np.isnan(vif[9])
+    #the other columns keep their VIF, 'sum' adds nothing to the span of d0 and d1
+    np.testing.assert_allclose(vif[2:8], variance_inflation_factors(frame.iloc[:, :8])[2:], rtol=1e-8)
+    assert vif_screen(frame) == vif_loop(frame)
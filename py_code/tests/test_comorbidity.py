@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import t
+from cohort_index import CohortIndex
+from phecode_index import EligibilityMatrix
+from comorbidity import occurrence_matrix, ineligible_matrix, pair_counts, blocked_pair_counts, comorbidity_table
+
+
+def com_ana(diseases, inpatient, eligible, threshold):
+    """
+    the old per-pair loop of 4_com_ana.py
+    """
+    result = []
+    for j, d1 in enumerate(diseases):
+        for d2 in diseases[j+1:]:
+            df_ = [x for x, e in zip(inpatient, eligible) if d1 in e and d2 in e]
+            n = len(df_)
+            c = sum([d1 in x and d2 in x for x in df_])
+            if c<=threshold:
+                result.append([d1,d2,c,n,np.nan,np.nan,np.nan,np.nan,np.nan])
+                continue
+            p1 = sum([d1 in x for x in df_])
+            p2 = sum([d2 in x for x in df_])
+            rr = (n*c)/(p1*p2)
+            theta = (1/c + 1/((p1*p2)/n) - 1/n - 1/n)**0.5
+            t_ = abs(np.log(rr)/theta)
+            p = (1-t.cdf(t_,n))*2
+            phi = (c*n-p1*p2)/(((p1*p2)*(n-p1)*(n-p2))**0.5)
+            z_phi = 0.5*np.log((1+phi)/(1-phi))
+            z_phi_theta = (1/(n-3))**0.5
+            z_phi_t = abs(z_phi/z_phi_theta)
+            p_phi = (1-t.cdf(z_phi_t,n))*2
+            result.append([d1,d2,c,n,rr,theta,p,phi,p_phi])
+    return pd.DataFrame(result,columns=['d1','d2','n_d1d2','N','RR','se','p_rr','phi','p_phi'])
+
+
+def cohort(n=700, seed=0):
+    rng = np.random.default_rng(seed)
+    diseases = [10.0, 20.0, 30.1, 40.0, 250.2, 290.11]
+    prevalence = [0.4, 0.3, 0.25, 0.2, 0.05, 0.02]
+    inpatient, eligible = [], []
+    for _ in range(n):
+        inpatient.append({x:float(rng.integers(0, 100)) for x, q in zip(diseases, prevalence) if rng.random() < q})
+        eligible.append([x for x in diseases if rng.random() < 0.85])
+    return diseases, inpatient, eligible
+
+
+def test_counts_and_statistics_match_the_pair_loop():
+    diseases, inpatient, eligible = cohort()
+    occurrence = occurrence_matrix(CohortIndex.from_series(pd.Series(inpatient)), diseases)
+    eligibility = EligibilityMatrix.from_mask([[x in e for x in diseases] for e in eligible], diseases)
+    expected = com_ana(diseases, inpatient, eligible, threshold=10)
+    assert expected['RR'].isna().any() and expected['RR'].notna().any()
+    counts = pair_counts(occurrence, ineligible_matrix(eligibility, diseases))
+    #a small memory budget cuts both the diseases and the patients into several blocks
+    blocked = blocked_pair_counts(occurrence, eligibility, diseases, memory=2**10)
+    for n, c, p1, p2 in [counts, blocked]:
+        result = comorbidity_table(diseases, (n, c, p1, p2), threshold=10)
+        pd.testing.assert_frame_equal(result[['d1','d2']], expected[['d1','d2']])
+        np.testing.assert_array_equal(result[['n_d1d2','N']].to_numpy(), expected[['n_d1d2','N']].to_numpy())
+        np.testing.assert_allclose(result.iloc[:, 4:].to_numpy(float), expected.iloc[:, 4:].to_numpy(float),
+                                   rtol=1e-12)
+    for x, y in zip(counts, blocked):
+        np.testing.assert_array_equal(x, y)
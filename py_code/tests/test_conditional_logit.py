@@ -0,0 +1,79 @@
+import numpy as np
+from statsmodels.discrete.conditional_models import ConditionalLogit
+from conditional_logit import MatchedStrata, fit, fit_regularized, fit_regularized_path
+
+
+def matched_sets(seed=0, G=800, m=4, p=3, continuous=False):
+    """
+    1:(m-1) matched sets, the case drawn from the conditional logit model
+    """
+    rng = np.random.default_rng(seed)
+    X = (rng.random((G*m, p)) < 0.3).astype(float)
+    if continuous:
+        X[:, -1] = rng.normal(size=G*m)
+    groups = np.repeat(np.arange(G), m)
+    eta = (X @ np.linspace(0.8, -0.4, p)).reshape(G, m)
+    P = np.exp(eta)/np.exp(eta).sum(axis=1, keepdims=True)
+    y = np.zeros((G, m))
+    y[np.arange(G), [rng.choice(m, p=x) for x in P]] = 1
+    return y.ravel(), X, groups
+
+
+def test_collapse_keeps_the_likelihood():
+    y, X, groups = matched_sets()
+    strata = MatchedStrata(y, X, groups)
+    collapsed = strata.collapse()
+    assert collapsed.n_strata < strata.n_strata/2
+    assert collapsed.weights.sum() == strata.n_strata and collapsed.nobs == strata.nobs
+    beta = np.array([0.3, -0.2, 0.1])
+    for a, b in zip(strata.loss()(beta), collapsed.loss()(beta)):
+        np.testing.assert_allclose(a, b, rtol=1e-10)
+    full, compressed = fit(strata), fit(collapsed)
+    np.testing.assert_allclose(full.params, compressed.params, rtol=1e-8)
+    np.testing.assert_allclose(full.bse, compressed.bse, rtol=1e-8)
+    alpha = [0, 0.01, 0.01]
+    np.testing.assert_allclose(fit_regularized(strata, alpha)[0], fit_regularized(collapsed, alpha)[0], atol=1e-8)
+
+
+def test_collapse_of_distinct_strata_is_a_no_op():
+    y, X, groups = matched_sets(continuous=True)
+    strata = MatchedStrata(y, X, groups)
+    assert strata.collapse().n_strata == strata.n_strata
+
+
+def ragged_sets(seed=0):
+    """
+    matched_sets() with some controls dropped, a stratum without a case and a
+    stratum of a single case
+    """
+    y, X, groups = matched_sets(seed, G=500, continuous=True)
+    rng = np.random.default_rng(seed)
+    keep = (y == 1) | (rng.random(len(y)) < 0.8)
+    keep[(groups == 0) & (y == 1)] = False
+    keep[(groups == 1) & (y == 0)] = False
+    return y[keep], X[keep], groups[keep]
+
+
+def test_fit_matches_statsmodels():
+    y, X, groups = ragged_sets()
+    result = fit(MatchedStrata(y, X, groups))
+    expected = ConditionalLogit(y, X, groups=groups).fit(method='newton', disp=False)
+    assert result.converged
+    np.testing.assert_allclose(result.params, expected.params, rtol=1e-6)
+    np.testing.assert_allclose(result.bse, expected.bse, rtol=1e-5)
+    np.testing.assert_allclose(result.pvalues, expected.pvalues, rtol=1e-4)
+    np.testing.assert_allclose(result.loglik, expected.llf, rtol=1e-10)
+
+
+def test_fit_regularized_matches_statsmodels():
+    y, X, groups = ragged_sets(1)
+    strata = MatchedStrata(y, X, groups)
+    alpha = np.array([0, 0.01, 0.05])
+    for L1_wt in [1.0, 0.5]:
+        beta, _, converged = fit_regularized(strata, alpha, L1_wt=L1_wt)
+        expected = ConditionalLogit(y, X, groups=groups).fit_regularized(alpha=alpha, L1_wt=L1_wt).params
+        assert converged
+        np.testing.assert_allclose(beta, expected, atol=1e-5)
+    #the strongest penalty of a path drops the penalized coefficients
+    path_ = fit_regularized_path(strata, [[0, c, c] for c in [1.0, 0.01]])
+    assert np.all(path_[0][0][1:] == 0) and np.all(path_[1][0][1:] != 0)
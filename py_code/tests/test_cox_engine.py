@@ -0,0 +1,43 @@
+import numpy as np
+from statsmodels.duration.hazard_regression import PHReg
+from cox_engine import fit_stratified_cox, fit_batch
+
+
+def matched_cohort(seed=0, n_groups=400, size=5):
+    rng = np.random.default_rng(seed)
+    n = n_groups*size
+    strata = np.repeat(np.arange(n_groups), size)
+    exposure = (np.arange(n) % size == 0).astype(float)
+    X = np.column_stack([rng.normal(size=n), rng.random(n) < 0.4, np.ones(n)])
+    return rng, strata, exposure, X
+
+
+def test_fit_matches_statsmodels():
+    rng, strata, exposure, X = matched_cohort()
+    X_ = np.column_stack([exposure, X[:, :2]])
+    t = rng.exponential(1/np.exp(X_ @ [0.5, 0.3, -0.2]))
+    c = rng.exponential(2, len(t))
+    time, status = np.minimum(t, c), (t <= c).astype(float)
+    result = fit_stratified_cox(time, status, X_, strata)
+    reference = PHReg(time, X_, status=status, strata=strata, ties='breslow').fit()
+    assert result.converged
+    np.testing.assert_allclose(result.params, reference.params, rtol=1e-6)
+    np.testing.assert_allclose(result.bse, reference.bse, rtol=1e-6)
+
+
+def test_fit_batch_equals_the_single_fits():
+    rng, strata, exposure, X = matched_cohort(1)
+    outcomes = []
+    for key in range(3):
+        rows = np.flatnonzero(rng.random(len(strata)) < 0.8)
+        t = rng.exponential(1/np.exp(0.4*exposure[rows] + 0.3*X[rows, 0]))
+        time, status = np.minimum(t, 1.5), (t <= 1.5).astype(float)
+        outcomes.append((key, rows, time, status))
+    for compress in [False, True]:
+        batch = list(fit_batch(X, strata, outcomes, exposure=exposure, compress=compress))
+        for (key, rows, time, status), (key_, result, kept) in zip(outcomes, batch):
+            #the constant column is dropped
+            assert key == key_ and list(kept) == [0, 1, 2]
+            single = fit_stratified_cox(time, status, np.column_stack([exposure, X])[rows][:, kept], strata[rows])
+            np.testing.assert_allclose(result.params, single.params, rtol=1e-8)
+            np.testing.assert_allclose(result.bse, single.bse, rtol=1e-8)
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from cohort_index import CohortIndex
+from pair_index import PairIndex
+
+day = 24*3600.
+
+
+def d1_d2(inpatient, eligible):
+    """
+    the old string pairs of 3_tra_identify.py, from dicts in diagnosis order
+    """
+    result = []
+    for dict_temp, eligible_ in zip(inpatient, eligible):
+        d_list = [x for x in dict_temp.keys() if x in eligible_]
+        result.append(['%s-%s' % (d_list[j], d_list[k]) for j in range(len(d_list)-1)
+                       for k in range(j+1, len(d_list)) if dict_temp[d_list[k]] > dict_temp[d_list[j]]])
+    return result
+
+
+def cohort(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    diseases = [10.0, 20.0, 30.1, 40.0, 250.2]
+    inpatient, eligible = [], []
+    for _ in range(n):
+        codes = [x for x in diseases if rng.random() < 0.4]
+        times = np.sort(rng.integers(0, 60, len(codes)))*day
+        inpatient.append(dict(zip(codes, times)))
+        eligible.append([x for x in diseases if rng.random() < 0.9])
+    return diseases, inpatient, eligible
+
+
+def test_pairs_match_the_strings():
+    diseases, inpatient, eligible = cohort()
+    mask = np.array([[x in e for x in diseases] for e in eligible])
+    index = PairIndex.build(CohortIndex.from_series(pd.Series(inpatient)), diseases, eligible=mask).invert()
+    strings = d1_d2(inpatient, eligible)
+    for d1 in diseases:
+        for d2 in diseases:
+            if d1 == d2:
+                continue
+            pair = '%s-%s' % (d1, d2)
+            having = [i for i, x in enumerate(strings) if pair in x]
+            assert index.ordered_count(d1, d2) == len(having)
+            assert list(index.patients(d1, d2)) == having
+            both = sum(d1 in x and d2 in x and d1 in e and d2 in e for x, e in zip(inpatient, eligible))
+            assert index.cooccurrence_count(d1, d2) == both
+            gaps = [inpatient[i][d2] - inpatient[i][d1] for i in having]
+            np.testing.assert_allclose(index.mean_gap(d1, d2), np.mean(gaps) if gaps else np.nan)
+    d1, d2, d3 = 10.0, 20.0, 30.1
+    expected = sum('%s-%s' % (d1, d2) in x and '%s-%s' % (d2, d3) in x for x in strings)
+    assert index.path_count(d1, d2, d3) == expected
+
+
+def test_save_load(tmp_path):
+    diseases, inpatient, _ = cohort(seed=1)
+    index = PairIndex.build(CohortIndex.from_series(pd.Series(inpatient)), diseases).invert()
+    index.save(str(tmp_path / 'pairs.npz'))
+    loaded = PairIndex.load(str(tmp_path / 'pairs.npz'))
+    for name in ['ordered', 'cooccurrence', 'gap']:
+        assert (getattr(loaded, name) != getattr(index, name)).nnz == 0
+    np.testing.assert_array_equal(loaded.codes, index.codes)
+    np.testing.assert_array_equal(loaded.postings[2], index.postings[2])
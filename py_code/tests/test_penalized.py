@@ -0,0 +1,31 @@
+import numpy as np
+from penalized import _quadratic_cd, l1_logit, logit_loss
+
+
+def test_quadratic_cd_satisfies_the_optimality_conditions():
+    rng = np.random.default_rng(1)
+    for p in [1, 5, 40]:
+        A = rng.normal(size=(3*p, p)) + rng.normal(size=(3*p, 1))
+        H = A.T @ A
+        g, beta = rng.normal(size=p)*5, rng.normal(size=p)
+        alpha = np.full(p, 2.0)
+        alpha[0] = 0
+        z = _quadratic_cd(g, H, beta, alpha, 500, 1e-12)
+        grad = g + H @ (z - beta)
+        nonzero = z != 0
+        np.testing.assert_allclose(grad[nonzero], -alpha[nonzero]*np.sign(z[nonzero]), atol=1e-8)
+        assert np.all(np.abs(grad[~nonzero]) <= alpha[~nonzero] + 1e-8)
+
+
+def test_l1_logit_is_optimal():
+    rng = np.random.default_rng(2)
+    X = np.column_stack([np.ones(2000), rng.normal(size=(2000, 3)), rng.random((2000, 20)) < 0.1])
+    y = rng.random(2000) < 1/(1 + np.exp(-(X[:, :4] @ [-1, 0.5, -0.5, 0.2] + X[:, 4:8].sum(axis=1))))
+    alpha = np.full(X.shape[1], 5.0)
+    alpha[0] = 0
+    beta, _, converged = l1_logit(X, y, alpha)
+    assert converged
+    _, grad, _ = logit_loss(X, y)(beta)
+    nonzero = beta != 0
+    np.testing.assert_allclose(grad[nonzero], -alpha[nonzero]*np.sign(beta[nonzero]), atol=1e-5)
+    assert np.all(np.abs(grad[~nonzero]) <= alpha[~nonzero] + 1e-5)
@@ -0,0 +1,95 @@
+"""
+end-to-end run of 0_phewas.py on a small synthetic cohort
+"""
+
+import os
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import py_code
+from cohort_index import CohortIndex
+from cohort_store import save_frame
+from phecode_index import PhecodeIndex, HistoryMatrix
+
+day = 24*3600.
+
+
+def phecode_definitions():
+    rows = [[10.0, 'catA'], [10.1, 'catA'], [10.2, 'catA'], [20.0, 'catB'], [30.1, 'catB'], [40.0, 'symptoms']]
+    return pd.DataFrame([[code, 'p%s' % (code), '%03i-%03i.99' % (int(code), int(code)), 'Both', category]
+                         for code, category in rows],
+                        columns=['phecode', 'phenotype', 'phecode_exclude_range', 'sex', 'category'])
+
+
+def cohort(n_groups=600, n_controls=4, seed=0):
+    """
+    matched groups of one exposed and n_controls unexposed subjects, the
+    exposed at higher risk of 10.1 and 20.0
+    """
+    rng = np.random.default_rng(seed)
+    risk = {10.1:(0.5, 0.2), 10.2:(0.4, 0.4), 20.0:(0.6, 0.3), 30.1:(0.45, 0.3), 40.0:(0.5, 0.5)}
+    records = []
+    for group in range(n_groups):
+        for k in range(n_controls + 1):
+            exposed = int(k == 0)
+            start = (10000 + rng.integers(0, 3000))*day
+            inpatient = {code:start + rng.integers(-500, 4000)*day for code, p in risk.items()
+                         if rng.random() < p[1 - exposed]}
+            records.append({'eid':len(records), 'outcome':exposed, 'sex':int(rng.integers(0, 2)),
+                            'age':float(rng.integers(40, 70)), 'dia_date':start,
+                            'time_end':start + rng.integers(3000, 5000)*day, 'match_2':group,
+                            'civil':int(rng.integers(1, 4)), 'famIncome':int(rng.integers(1, 4)),
+                            'education':int(rng.integers(1, 4)), 'inpatient':inpatient, 'history':[]})
+    return pd.DataFrame(records)
+
+
+@pytest.fixture(scope='module')
+def home(tmp_path_factory):
+    home = tmp_path_factory.mktemp('home')
+    base = os.path.join(home, 'depression')
+    os.makedirs(os.path.join(base, 'originData'))
+    os.makedirs(os.path.join(base, 'age'))
+    definitions = phecode_definitions()
+    definitions.to_csv(os.path.join(base, 'originData', 'phecode_definitions1.2.csv'), index=False)
+    df = cohort()
+    phecode_index = PhecodeIndex.from_frame(definitions)
+    phecode_index.save(os.path.join(base, 'age', 'phecode_index.npz'))
+    HistoryMatrix.from_series(df['history'], phecode_index).save(os.path.join(base, 'age', 'history_matrix.npz'))
+    CohortIndex.from_series(df['inpatient']).save(os.path.join(base, 'age', 'inpatient_index.npz'))
+    save_frame(df.drop(columns=['inpatient', 'history']), os.path.join(base, 'age', 'df_merged_store'))
+    return str(home)
+
+
+def run_phewas(home, *args):
+    for file in ['work_queue.db', 'result/phewas/cox_result_L1L2_del_0.sqlite']:
+        file = os.path.join(home, 'depression', 'age', file)
+        if os.path.exists(file):
+            os.remove(file)
+    subprocess.run([sys.executable, '0_phewas.py', '--number', '0'] + list(args), cwd=py_code,
+                   env=dict(os.environ, HOME=home), check=True, capture_output=True)
+    return pd.read_csv(os.path.join(home, 'depression', 'age', 'result', 'phewas', 'cox_result_L1L2_del_0.csv'),
+                       index_col=0).set_index('disease').sort_index()
+
+
+def test_cox_fits_after_the_screen(home):
+    result = run_phewas(home)
+    #10.0 has level 2 children and 40.0 is a symptom, neither is fitted
+    assert list(result.index) == [10.1, 10.2, 20.0, 30.1]
+    assert (result['describe'] == 'fitted').all()
+    assert np.isfinite(result[['coef', 'se', 'p']].values).all()
+    assert result.loc[10.1, 'coef'] > 0 and result.loc[10.1, 'p'] < 1e-6
+    assert result.loc[10.2, 'p'] > 1e-3
+
+
+def test_score_cutoff_skips_only_the_screened_fits(home):
+    fitted = run_phewas(home)
+    result = run_phewas(home, '--score_cutoff', '1e-3')
+    screened = result['describe'].str.startswith('score test screened')
+    assert screened.any() and not screened.all()
+    #the score p-value is only in the note, the p column is left to the Wald fits
+    p_score = result.loc[screened, 'describe'].str.extract(r'p=(\S+)$')[0].astype(float)
+    assert (p_score > 1e-3).all()
+    assert result.loc[screened, ['coef', 'se', 'p']].isna().all().all()
+    pd.testing.assert_frame_equal(result.loc[~screened], fitted.loc[~screened])
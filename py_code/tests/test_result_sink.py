@@ -0,0 +1,56 @@
+import os
+from result_sink import ResultSink, read_shard, persisted_keys
+from work_queue import WorkQueue
+
+
+def write(file, run, records, **kwargs):
+    sink = ResultSink(file, ['name', 'p'], run=run, **kwargs)
+    for record in records:
+        sink.append(record[0], record)
+    sink.close()
+    return read_shard(file)
+
+
+def test_rerun_keeps_the_shard_until_the_stage_is_reset(tmp_path):
+    db, file = str(tmp_path / 'queue.db'), str(tmp_path / 'result_0.sqlite')
+    queue = WorkQueue(db, 'stage')
+    queue.add(['a', 'b'])
+    run = queue.run_id()
+    for key in queue.drain(0):
+        write(file, run, [[key, 0.5]])
+        queue.complete(key)
+
+    #a plain rerun claims nothing and must not lose the results of the done tasks
+    rerun = WorkQueue(db, 'stage')
+    assert rerun.run_id() == run
+    rerun.add(['a', 'b'])
+    assert list(rerun.drain(0)) == []
+    assert sorted(write(file, rerun.run_id(), [])['name']) == ['a', 'b']
+
+    #a reset starts a new run, the stale shard is started empty
+    rerun.reset()
+    assert rerun.run_id() != run
+    assert len(write(file, rerun.run_id(), [])) == 0
+
+
+def test_persisted_keys_of_the_current_run(tmp_path):
+    write(str(tmp_path / 'result_0.sqlite'), 'old', [['a', 0.1]])
+    write(str(tmp_path / 'result_1.sqlite'), 'new', [['b', 0.2]])
+    pattern = os.path.join(str(tmp_path), 'result_*.sqlite')
+    assert persisted_keys(pattern) == {'a', 'b'}
+    assert persisted_keys(pattern, run='new') == {'b'}
+
+
+def test_mode_w_starts_empty(tmp_path):
+    file = str(tmp_path / 'result_0.sqlite')
+    write(file, 'run', [['a', 0.1]])
+    assert len(write(file, 'run', [], mode='w')) == 0
+
+
+def test_discard(tmp_path):
+    sink = ResultSink(str(tmp_path / 'result_0.sqlite'), ['name', 'p'])
+    for name in ['a', 'b', 'c']:
+        sink.append(name, [name, 0.5])
+    sink.discard(['a', 'c'])
+    assert sink.keys() == {'b'}
+    sink.close()
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import chisquare
+from risk_set import RiskSetMatcher, MatchedSetCache, one_year, match_columns
+
+
+def candidates(dataset, j, time_var):
+    """
+    the control condition of the old d_match() of 8_conlo.py
+    """
+    case = dataset.loc[j]
+    time_ = case[time_var]
+    return set(dataset.loc[(dataset['sex']==case['sex']) &
+                           (np.abs(dataset['birth_date']-case['birth_date'])<=one_year) &
+                           (dataset['famIncome']==case['famIncome']) &
+                           ~(dataset['time_end']<=time_) &
+                           ~(dataset[time_var]<=time_)].eid.values)
+
+
+def cohort(n=1500, seed=0):
+    rng = np.random.default_rng(seed)
+    dataset = pd.DataFrame({'eid':rng.permutation(n) + 1000,
+                            'sex':rng.integers(0, 2, n).astype(float),
+                            'famIncome':rng.integers(0, 3, n).astype(float),
+                            'birth_date':rng.uniform(0, 8*one_year, n),
+                            'time_end':rng.uniform(40, 60, n)*one_year,
+                            'd2_time':np.where(rng.random(n) < 0.1, rng.uniform(30, 60, n)*one_year, np.nan)},
+                           index=rng.permutation(n) + 5)
+    dataset.loc[dataset.index[:20], 'famIncome'] = np.nan
+    dataset.loc[dataset.index[20:30], 'birth_date'] = np.nan
+    dataset.loc[dataset.index[30:200], 'time_end'] = np.nan
+    #a control exactly one year apart is within the caliper
+    dataset.loc[dataset.index[200:202], ['sex','famIncome']] = 1.0
+    dataset.loc[dataset.index[200:202], 'birth_date'] = [0, one_year]
+    dataset.loc[dataset.index[200:202], 'd2_time'] = [35*one_year, np.nan]
+    return dataset
+
+
+def test_controls_are_drawn_from_the_risk_set():
+    dataset = cohort()
+    table = RiskSetMatcher(dataset, 'd2_time').match(n=2, seed=3)
+    assert list(table.columns) == match_columns
+    cases = dataset.index[~dataset['d2_time'].isna()]
+    assert (table.loc[table['outcome_conlo']==1].index == cases).all()
+    sizes = []
+    for group, set_ in table.groupby('match_2_conlo', sort=True):
+        j = set_.index[0]
+        assert list(set_['outcome_conlo']) == [1] + [0]*(len(set_)-1)
+        assert (set_['date_start_conlo'] == dataset.loc[j, 'd2_time']).all()
+        assert (set_['eid'].values == dataset.loc[set_.index, 'eid'].values).all()
+        controls = set(set_['eid'].values[1:])
+        expected = candidates(dataset, j, 'd2_time')
+        assert len(controls) == len(set_) - 1 == min(2, len(expected))
+        assert controls <= expected
+        sizes.append(len(expected))
+    #both the rejection sampling and the filtering of small windows are used
+    assert max(sizes) > 8 and min(sizes) <= 2
+
+
+def test_caliper_is_inclusive():
+    dataset = cohort()
+    matcher = RiskSetMatcher(dataset, 'd2_time')
+    (lower,), (upper,) = matcher.windows(np.array([200]))
+    assert dataset.loc[dataset.index[201], 'eid'] in candidates(dataset, dataset.index[200], 'd2_time')
+    assert 201 in matcher.order[lower:upper]
+
+
+def test_draws_are_reproducible_and_roughly_uniform():
+    dataset = cohort(n=400, seed=1)
+    matcher = RiskSetMatcher(dataset, 'd2_time')
+    pd.testing.assert_frame_equal(matcher.match(n=2, seed=0), RiskSetMatcher(dataset, 'd2_time').match(n=2, seed=0))
+    #over many seeds every candidate of a case is drawn about equally often
+    j = max(dataset.index[~dataset['d2_time'].isna()], key=lambda x: len(candidates(dataset, x, 'd2_time')))
+    expected = sorted(candidates(dataset, j, 'd2_time'))
+    counts = pd.Series(0, index=expected)
+    for seed in range(1000):
+        table = matcher.match(n=2, seed=seed)
+        group = table.loc[(table.index==j) & (table['outcome_conlo']==1), 'match_2_conlo'].iloc[0]
+        counts[table.loc[table['match_2_conlo']==group, 'eid'].values[1:]] += 1
+    assert counts.sum() == 2000
+    assert chisquare(counts.values).pvalue > 1e-3
+
+
+def test_matched_set_cache():
+    cache = MatchedSetCache(memory=1)
+    built = []
+    build = lambda: built.append(1) or pd.DataFrame({'x':np.arange(10)})
+    a = cache('a', build)
+    assert cache('a', build) is a
+    cache('b', build)
+    #over the budget only the newest table is kept
+    assert list(cache.tables) == ['b'] and (cache.hits, cache.misses) == (1, 2)
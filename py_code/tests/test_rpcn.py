@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+from rpcn import SharedDesign
+
+
+def reference(frame, columns, rows, drop):
+    block = frame.iloc[rows][columns]
+    return block[[x for x in columns if x not in drop and block[x].nunique() > 1]]
+
+
+def test_pair_matches_the_frame():
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({'age':rng.normal(50, 10, 1000), 'sex_1':rng.random(1000) < 0.5,
+                          '1.0':rng.random(1000) < 0.1, '2.0':rng.random(1000) < 0.1,
+                          '3.0':np.r_[np.zeros(500), rng.random(500) < 0.1]})
+    design = SharedDesign(frame, ['age','sex_1'], ['1.0','2.0','3.0'], chunk=64)
+    for rows in [np.arange(1000), np.arange(100, 400), np.flatnonzero(rng.random(1000) < 0.3),
+                 rng.random(1000) < 0.3]:
+        X, fixed, candidates = design.pair(rows, drop=['2.0'])
+        expected = reference(frame, design.columns, np.flatnonzero(rows) if rows.dtype == bool else rows, ['2.0'])
+        assert fixed + candidates == list(expected.columns)
+        assert X.dtype == np.float64
+        np.testing.assert_array_equal(X, expected.values.astype(np.float64))
+
+
+def test_contiguous_rows_are_a_view():
+    frame = pd.DataFrame({'a':np.arange(10.0), 'b':np.arange(10.0)**2})
+    design = SharedDesign(frame, ['a'], ['b'])
+    X, _, _ = design.pair(np.arange(2, 8))
+    assert np.shares_memory(X, design.X)
+    X, _, _ = design.pair(np.arange(2, 8), drop=['b'])
+    assert not np.shares_memory(X, design.X)
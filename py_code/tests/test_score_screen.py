@@ -0,0 +1,106 @@
+import numpy as np
+import statsmodels.api as sm
+from scipy.stats import chi2
+from statsmodels.discrete.conditional_models import ConditionalLogit
+from statsmodels.duration.hazard_regression import PHReg
+from statsmodels.duration.survfunc import survdiff
+from conditional_logit import MatchedStrata
+from score_screen import (cox_score_test, cox_null, conditional_logit_null, conditional_logit_score_test,
+                          logit_null, logit_score_test, screened, screen_note, NullFitCache)
+
+
+def reference_score(grad, info):
+    """
+    U^2/V from the statsmodels gradient and information at the null estimate
+    """
+    V = info[0, 0] - info[0, 1:] @ np.linalg.solve(info[1:, 1:], info[1:, 0])
+    statistic = grad[0]**2/V
+    return statistic, chi2.sf(statistic, 1)
+
+
+def survival(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([rng.random(n) < 0.4, rng.normal(size=n), rng.random(n) < 0.5]).astype(float)
+    time = rng.exponential(np.exp(-X @ [0.15, 0.3, -0.2]))
+    status = (rng.random(n) < 0.7).astype(float)
+    return time, status, X, rng.integers(0, 40, n)
+
+
+def test_cox_score_test_matches_statsmodels():
+    time, status, X, strata = survival()
+    null_params = cox_null(time, status, X, strata)
+    np.testing.assert_allclose(null_params, PHReg(time, X[:, 1:], status=status, strata=strata,
+                                                  ties='breslow').fit().params, rtol=1e-8)
+    model = PHReg(time, X, status=status, strata=strata, ties='breslow')
+    params = np.r_[0, null_params]
+    expected = reference_score(model.score(params), -model.hessian(params))
+    np.testing.assert_allclose(cox_score_test(time, status, X, strata, null_params), expected, rtol=1e-8)
+    #without covariates it is the stratified log-rank test (no tied times)
+    np.testing.assert_allclose(cox_score_test(time, status, X[:, 0], strata),
+                               survdiff(time, status, X[:, 0], strata=strata), rtol=1e-8)
+
+
+def test_cox_weights_are_repeated_rows():
+    time, status, X, strata = survival(300, seed=1)
+    counts = np.random.default_rng(1).integers(1, 4, len(time))
+    repeat = lambda x: np.repeat(x, counts, axis=0)
+    null_params = cox_null(time, status, X, strata, weights=counts)
+    np.testing.assert_allclose(null_params, cox_null(*map(repeat, (time, status, X, strata))), rtol=1e-8)
+    np.testing.assert_allclose(cox_score_test(time, status, X, strata, null_params, weights=counts),
+                               cox_score_test(*map(repeat, (time, status, X, strata)), null_params), rtol=1e-8)
+
+
+def test_logit_score_test_matches_statsmodels():
+    rng = np.random.default_rng(2)
+    n = 800
+    Z = sm.add_constant(rng.normal(size=(n, 2)))
+    x = (rng.random(n) < 0.4).astype(float)
+    y = (rng.random(n) < 1/(1 + np.exp(-(Z @ [-1, 0.5, -0.3] + 0.2*x)))).astype(float)
+    X = np.column_stack([x, Z])
+    null_params = logit_null(X, y)
+    reference = sm.Logit(y, Z).fit(disp=False)
+    np.testing.assert_allclose(null_params, reference.params, rtol=1e-6)
+    expected = reference.score_test(exog_extra=x[:, None])
+    np.testing.assert_allclose(logit_score_test(X, y, null_params), [expected[0][0], expected[1][0]], rtol=1e-6)
+    #frequency weights equal repeated rows
+    counts = rng.integers(1, 4, n)
+    np.testing.assert_allclose(logit_score_test(X, y, logit_null(X, y, weights=counts), weights=counts),
+                               logit_score_test(np.repeat(X, counts, axis=0), np.repeat(y, counts),
+                                                logit_null(np.repeat(X, counts, axis=0), np.repeat(y, counts))),
+                               rtol=1e-6)
+
+
+def test_conditional_logit_score_test_matches_statsmodels():
+    rng = np.random.default_rng(3)
+    G, m = 600, 3
+    X = np.column_stack([rng.random(G*m) < 0.3, rng.normal(size=G*m), rng.random(G*m) < 0.5]).astype(float)
+    groups = np.repeat(np.arange(G), m)
+    eta = (X @ [0.3, 0.5, -0.4]).reshape(G, m)
+    P = np.exp(eta)/np.exp(eta).sum(axis=1, keepdims=True)
+    y = np.zeros((G, m))
+    y[np.arange(G), [rng.choice(m, p=x) for x in P]] = 1
+    y = y.ravel()
+    strata = MatchedStrata(y, X, groups)
+    null_params = conditional_logit_null(strata)
+    np.testing.assert_allclose(null_params, ConditionalLogit(y, X[:, 1:], groups=groups).fit(
+        method='newton', disp=False).params, rtol=1e-6)
+    model = ConditionalLogit(y, X, groups=groups)
+    params = np.r_[0, null_params]
+    expected = reference_score(model.score(params), -model.hessian(params))
+    np.testing.assert_allclose(conditional_logit_score_test(strata, null_params), expected, rtol=1e-5)
+
+
+def test_constant_exposure_is_never_screened():
+    time, status, X, strata = survival(seed=4)
+    X[:, 0] = 1
+    statistic, pvalue = cox_score_test(time, status, X, strata, cox_null(time, status, X, strata))
+    assert np.isnan(statistic) and np.isnan(pvalue)
+    assert not screened(pvalue, 0.5) and screened(0.6, 0.5) and not screened(0.6, None)
+    assert screen_note(3.2, 0.0736) == 'score test screened: chi2=3.200, p=0.0736'
+
+
+def test_null_fit_cache():
+    cache = NullFitCache(maxsize=2)
+    for key in ['a', 'b', 'a', 'c']:
+        cache(key, lambda: np.zeros(1))
+    assert list(cache.params) == ['a', 'c'] and (cache.hits, cache.misses) == (1, 3)
@@ -0,0 +1,33 @@
+import itertools
+import numpy as np
+import pytest
+from trajectory_graph import TrajectoryGraph
+
+
+def enumerated(graph, max_length=None):
+    return {x:len(list(graph.paths([x], max_length=max_length))) for x in graph.nodes}
+
+
+@pytest.mark.parametrize('max_length', [None, 0, 1, 2, 3, 5])
+def test_path_counts_on_a_two_cycle(max_length):
+    graph = TrajectoryGraph([(1, 2), (2, 1), (0, 1), (2, 3), (3, 4)])
+    assert graph.cycles() == [[1.0, 2.0]]
+    assert graph.path_counts(max_length) == enumerated(graph, max_length)
+
+
+def test_path_counts_on_a_dag():
+    graph = TrajectoryGraph([(0, 1), (0, 2), (1, 2), (2, 3), (1, 3)])
+    assert graph.path_counts() == {0.0:3, 1.0:2, 2.0:1, 3.0:0}
+    assert graph.path_counts(1) == {0.0:2, 1.0:2, 2.0:1, 3.0:0}
+
+
+def test_path_counts_match_the_enumeration():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        n = int(rng.integers(2, 8))
+        edges = [x for x in itertools.product(range(n), repeat=2) if rng.random() < 0.3]
+        if not edges:
+            continue
+        graph = TrajectoryGraph(edges)
+        for max_length in [None, 1, 3]:
+            assert graph.path_counts(max_length) == enumerated(graph, max_length)
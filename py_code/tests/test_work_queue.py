@@ -0,0 +1,92 @@
+import time
+import pytest
+from work_queue import WorkQueue, input_signature
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    file = str(tmp_path / 'queue.db')
+    a = WorkQueue(file, 'stage', lease=0.5, heartbeat=0)
+    b = WorkQueue(file, 'stage', lease=0.5, heartbeat=0)
+    a.add(['x'])
+    assert a.claim(1) == 'x'
+    for _ in range(4):
+        time.sleep(0.2)
+        a.heartbeat('x')
+        assert b.claim(2) is None
+    #without renewals the claim expires and another worker takes it over
+    time.sleep(0.6)
+    assert b.claim(2) == 'x'
+    #the old worker can no longer renew or release it
+    a.renew('x')
+    a.release('x')
+    assert b.status() == {'pending':0, 'leased':1, 'expired':0, 'done':0}
+
+
+def test_heartbeat_is_rate_limited(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), 'stage', heartbeat=3600)
+    queue.add(['x'])
+    queue.claim(1)
+    claimed = queue.renewed['x']
+    queue.heartbeat('x')
+    assert queue.renewed['x'] == claimed
+
+
+def test_holding_releases_a_failed_task(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), 'stage')
+    queue.add(['x', 'y'])
+    with pytest.raises(RuntimeError):
+        for key in queue.drain(1):
+            with queue.holding(key):
+                raise RuntimeError(key)
+    assert queue.status() == {'pending':2, 'leased':0, 'expired':0, 'done':0}
+    for key in queue.drain(1):
+        with queue.holding(key):
+            queue.complete(key)
+    assert queue.status()['done'] == 2
+
+
+def test_complete_after_a_lost_lease(tmp_path):
+    file = str(tmp_path / 'queue.db')
+    a = WorkQueue(file, 'stage', lease=0.2)
+    b = WorkQueue(file, 'stage', lease=0.2)
+    a.add(['x'])
+    a.claim(1)
+    time.sleep(0.3)
+    assert b.claim(2) == 'x'
+    assert not a.complete('x')
+    assert b.status()['leased'] == 1
+    assert b.complete('x')
+    assert b.status()['done'] == 1
+
+
+def test_start_joins_or_begins_a_run(tmp_path):
+    file = str(tmp_path / 'queue.db')
+    a = WorkQueue(file, 'stage')
+    b = WorkQueue(file, 'stage')
+    run = a.start(['x', 'y'], 'inputs')
+    a.claim(1)
+    #a second worker with the same tasks and inputs joins the run
+    assert b.start(['y', 'x'], 'inputs') == run
+    assert b.status() == {'pending':1, 'leased':1, 'expired':0, 'done':0}
+    #changed inputs or tasks start a new run with the new tasks only
+    new_run = b.start(['x', 'y'], 'changed inputs')
+    assert new_run != run
+    assert b.status() == {'pending':2, 'leased':0, 'expired':0, 'done':0}
+    assert a.start(['x', 'z'], 'changed inputs') not in (run, new_run)
+    assert [a.claim(1), a.claim(1), a.claim(1)] == ['x', 'z', None]
+    #reset() forces a new run for the same inputs
+    run = a.start(['x', 'z'], 'changed inputs')
+    a.reset()
+    assert a.start(['x', 'z'], 'changed inputs') != run
+
+
+def test_input_signature(tmp_path):
+    (tmp_path / 'store').mkdir()
+    (tmp_path / 'store' / 'part').write_text('a')
+    (tmp_path / 'input.csv').write_text('a')
+    files = [str(tmp_path / 'store'), str(tmp_path / 'input.csv')]
+    signature = input_signature(('run', 0.5), files)
+    assert input_signature(('run', 0.5), files) == signature
+    assert input_signature(('run', 0.1), files) != signature
+    (tmp_path / 'store' / 'part').write_text('ab')
+    assert input_signature(('run', 0.5), files) != signature
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Graph of the significant directed (conditional-logistic) edges, replacing the
+recursive long_tra() of 11_tra_sum.py.
+
+The edges are indexed once as successor lists of integer node ids. The graph
+is checked for cycles (Tarjan's strongly connected components), the number
+of maximal paths from every node is counted by dynamic programming over a
+topological order (by search from the nodes that reach a cycle), and the
+paths themselves are enumerated lazily by an explicit-stack depth-first
+search, so nothing exponential is materialized.
+A path is maximal when its last node has no successor, when it reaches
+max_length edges, or when every extension falls below min_support, as in
+long_tra(), which extended a trajectory until its last disease had no
+outgoing edge. A node is never revisited within a path, so the enumeration
+also terminates on a graph with cycles.
+
+The support of a path is the number of patients with its diseases diagnosed
+in order. Each disease has a single first diagnosis per patient, so these are
+the patients in the posting lists of all its edges, and the enumerator
+intersects them incrementally along the current path (one intersection per
+edge, shared by all the paths through the same prefix) by binary search, as
+PairIndex.path_patients() does.
+"""
+
+import numpy as np
+from pair_index import intersect_sorted
+
+
+class TrajectoryGraph(object):
+
+    def __init__(self, edges):
+        """
+        edges: iterable of (d1, d2), d1 diagnosed before d2
+        """
+        edges = list(dict.fromkeys((float(a), float(b)) for a, b in edges))
+        self.nodes = sorted(set(x for edge in edges for x in edge))
+        self.node_id = {x:i for i, x in enumerate(self.nodes)}
+        self.successors = [[] for _ in self.nodes]
+        self.n_predecessors = np.zeros(len(self.nodes), dtype=np.int64)
+        for a, b in edges:
+            self.successors[self.node_id[a]].append(self.node_id[b])
+            self.n_predecessors[self.node_id[b]] += 1
+        self.n_edges = len(edges)
+
+    @classmethod
+    def from_frame(cls, frame, source='d1', target='d2'):
+        return cls(frame[[source, target]].values)
+
+    def roots(self):
+        """
+        nodes without incoming edges
+        """
+        return [self.nodes[i] for i in np.flatnonzero(self.n_predecessors == 0)]
+
+    #------------------------------------------------------------------
+    def cycles(self):
+        """
+        the strongly connected components with a cycle (more than one node or
+        a self-loop), as lists of nodes; empty for a DAG
+        """
+        n = len(self.nodes)
+        index, low = np.full(n, -1), np.zeros(n, dtype=np.int64)
+        on_stack = np.zeros(n, dtype=bool)
+        stack, components, counter = [], [], 0
+        for start in range(n):
+            if index[start] >= 0:
+                continue
+            #iterative Tarjan: frames of (node, next successor position)
+            frames = [(start, 0)]
+            index[start] = low[start] = counter
+            counter += 1
+            stack.append(start)
+            on_stack[start] = True
+            while frames:
+                v, k = frames[-1]
+                if k < len(self.successors[v]):
+                    frames[-1] = (v, k + 1)
+                    w = self.successors[v][k]
+                    if index[w] < 0:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        frames.append((w, 0))
+                    elif on_stack[w]:
+                        low[v] = min(low[v], index[w])
+                    continue
+                frames.pop()
+                if frames:
+                    low[frames[-1][0]] = min(low[frames[-1][0]], low[v])
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component.append(w)
+                        if w == v:
+                            break
+                    if len(component) > 1 or v in self.successors[v]:
+                        components.append([self.nodes[x] for x in sorted(component)])
+        return components
+
+    def is_dag(self):
+        return len(self.cycles()) == 0
+
+    def topological_order(self):
+        """
+        node ids in topological order (Kahn), ValueError listing the cycles if there is none
+        """
+        remaining = self.n_predecessors.copy()
+        order = list(np.flatnonzero(remaining == 0))
+        for v in order:
+            for w in self.successors[v]:
+                remaining[w] -= 1
+                if remaining[w] == 0:
+                    order.append(w)
+        if len(order) < len(self.nodes):
+            raise ValueError('trajectory graph has cycles: %s' % (self.cycles()))
+        return order
+
+    def _acyclic_counts(self, max_length=None):
+        """
+        the nodes that reach no cycle, every walk from them is a simple path,
+        and {remaining edges: [number of maximal paths from each of them]}
+        (key None without max_length), by dynamic programming from the sinks
+        """
+        n = len(self.nodes)
+        predecessors = [[] for _ in range(n)]
+        for v in range(n):
+            for w in self.successors[v]:
+                predecessors[w].append(v)
+        #peel the sinks: a node is peeled once all its successors are, never on a cycle or upstream of one
+        remaining = [len(x) for x in self.successors]
+        peeled = [v for v in range(n) if remaining[v] == 0]
+        for w in peeled:
+            for v in predecessors[w]:
+                remaining[v] -= 1
+                if remaining[v] == 0:
+                    peeled.append(v)
+        counts = {}
+        previous = None
+        for k in ([None] if max_length is None else range(max_length + 1)):
+            count = [0]*n
+            for v in peeled:
+                if not self.successors[v] or k == 0:
+                    count[v] = 1
+                else:
+                    count[v] = sum((count if k is None else previous)[w] for w in self.successors[v])
+            counts[k] = previous = count
+        return set(peeled), counts
+
+    def path_counts(self, max_length=None):
+        """
+        {node: number of maximal paths starting at node}, the number of paths
+        paths([node], max_length) yields without postings (0 for a sink)
+
+        by dynamic programming where no cycle is reachable; from a node that
+        reaches a cycle, the paths are counted by the depth-first search of
+        paths(), down to the first node that reaches none
+        """
+        acyclic, counts = self._acyclic_counts(max_length)
+
+        def count(s):
+            total = 0
+            on_path = {s}
+            #frames of (node, successors not tried yet, any extension, edges left)
+            frames = [[s, iter(self.successors[s]), False, max_length]]
+            while frames:
+                frame = frames[-1]
+                v, k = frame[0], frame[3]
+                w = None
+                if k is None or k > 0:
+                    for w_ in frame[1]:
+                        if w_ not in on_path:
+                            w = w_
+                            break
+                if w is not None:
+                    frame[2] = True
+                    k_ = None if k is None else k - 1
+                    if w in acyclic:
+                        total += counts[k_][w]
+                    else:
+                        on_path.add(w)
+                        frames.append([w, iter(self.successors[w]), False, k_])
+                    continue
+                frames.pop()
+                if not frame[2] and frames:
+                    total += 1
+                on_path.discard(v)
+            return total
+        return {self.nodes[v]:count(v) for v in range(len(self.nodes))}
+
+    #------------------------------------------------------------------
+    def paths(self, sources=None, max_length=None, min_support=None, postings=None):
+        """
+        lazily yield (path, support) for the maximal paths from sources (the roots by default)
+
+        postings(d1, d2): sorted patient ids with d1 before d2, or None for an edge
+        that does not restrict the patients (e.g. from the group node); support is
+        None for a path without any restricting edge. Without postings, min_support
+        is ignored and support is always None
+        """
+        memo = {}
+
+        def edge_postings(v, w):
+            if (v, w) not in memo:
+                memo[(v, w)] = postings(self.nodes[v], self.nodes[w])
+            return memo[(v, w)]
+
+        def extend(patients, v, w):
+            if postings is None:
+                return None
+            edge = edge_postings(v, w)
+            if edge is None:
+                return patients
+            if patients is None:
+                return edge
+            return intersect_sorted(patients, edge)
+
+        def supported(patients):
+            return min_support is None or patients is None or len(patients) >= min_support
+
+        sources = self.roots() if sources is None else sources
+        for source in sources:
+            if source not in self.node_id:
+                continue
+            s = self.node_id[source]
+            path, on_path = [s], {s}
+            #frames of (patients of the path so far, successors not tried yet, any extension yielded)
+            frames = [[None, iter(self.successors[s]), False]]
+            while frames:
+                frame = frames[-1]
+                w = None
+                if max_length is None or len(path) - 1 < max_length:
+                    for w_ in frame[1]:
+                        if w_ in on_path:
+                            continue
+                        patients = extend(frame[0], path[-1], w_)
+                        if supported(patients):
+                            w = w_
+                            break
+                if w is not None:
+                    frame[2] = True
+                    path.append(w)
+                    on_path.add(w)
+                    frames.append([patients, iter(self.successors[w]), False])
+                    continue
+                frames.pop()
+                if not frame[2] and len(path) > 1:
+                    yield tuple(self.nodes[x] for x in path), (None if frame[0] is None else len(frame[0]))
+                on_path.discard(path.pop())
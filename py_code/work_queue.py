@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite-backed task queue for the parallel '--number' workers, replacing the
+shared temp.cache file.
+
+Every task is a (stage, key) row; a worker claims one pending task inside a
+write transaction (BEGIN IMMEDIATE), so two workers can never claim the same
+key. A claim is a lease: the worker renews it while it works on the task
+(heartbeat(), at most once per heartbeat interval), gives it back when the
+task fails (holding()), and if the worker crashes, its task becomes claimable
+again once the lease expires. Only the worker holding the lease can complete
+a task; a worker that lost it (too long between heartbeats) is told so by
+complete() and drops its results of the task, so no key lands in two shards. The lease only has to cover the longest gap
+between two heartbeats, one pair or phecode, not a whole task. Stages are
+namespaces, so PheWAS phecodes and logistic pairs can share one database file.
+
+Each stage has a run token (run_id()), renewed by reset(). The result
+shards are tied to it. A stage registers its tasks with start(), together
+with a signature of its options and input files (input_signature()): when
+the tasks or the signature differ from those of the current run, the stage
+is reset in the same transaction and a new run begins, so nothing has to be
+deleted by hand between runs. Workers started with the same inputs join the
+run instead of resetting each other, and a rerun only picks up the tasks
+that are not done yet and keeps the results already written. --reset still
+forces a new run.
+
+The database uses the default rollback journal rather than WAL, so it also
+works on a shared filesystem with working POSIX locks.
+
+    python work_queue.py --db ~/depression/work_queue.db --stage conlogistic
+    python work_queue.py --db ~/depression/work_queue.db --stage conlogistic --reset
+"""
+
+import argparse
+import contextlib
+import hashlib
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+PENDING, LEASED, DONE = 0, 1, 2
+
+
+def input_signature(options, files=()):
+    """
+    digest of the options of a run and the size and modification time of its
+    input files (of the files directly in it, for a directory)
+    """
+    digest = hashlib.blake2b(repr(options).encode(), digest_size=16)
+    for file in files:
+        file = os.path.expanduser(file)
+        entries = sorted(os.path.join(file, x) for x in os.listdir(file)) if os.path.isdir(file) else [file]
+        for entry in entries:
+            stat = os.stat(entry)
+            digest.update(repr((os.path.relpath(entry, file), stat.st_size, stat.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+
+class WorkQueue(object):
+
+    def __init__(self, file, stage, lease=3600, heartbeat=60, timeout=600):
+        """
+        lease: seconds a claim is held without a renewal
+        heartbeat: seconds between two renewals of heartbeat()
+        """
+        self.file = os.path.expanduser(file)
+        self.stage = stage
+        self.lease = lease
+        self.heartbeat_interval = heartbeat
+        self.worker = None
+        self.renewed = {}
+        self.conn = sqlite3.connect(self.file, timeout=timeout, isolation_level=None)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
+                             stage TEXT NOT NULL, key TEXT NOT NULL, status INTEGER NOT NULL DEFAULT 0,
+                             worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0,
+                             PRIMARY KEY (stage, key))""")
+        self.conn.execute('CREATE TABLE IF NOT EXISTS runs (stage TEXT PRIMARY KEY, run TEXT NOT NULL)')
+
+    def _transaction(self, func):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func()
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+        return result
+
+    def run_id(self):
+        """
+        token of the current run of the stage, a new one after reset()
+        """
+        def _run():
+            self.conn.execute('INSERT OR IGNORE INTO runs (stage, run) VALUES (?, ?)', (self.stage, uuid.uuid4().hex))
+            return self.conn.execute('SELECT run FROM runs WHERE stage=?', (self.stage,)).fetchone()[0]
+        return self._transaction(_run)
+
+    def start(self, keys, signature=''):
+        """
+        register the tasks of a run, resetting the stage first if its current
+        run has other tasks or another signature; returns the run token
+        """
+        keys = [str(key) for key in keys]
+        digest = hashlib.blake2b(repr((sorted(set(keys)), signature)).encode(), digest_size=16).hexdigest()
+
+        def _start():
+            row = self.conn.execute('SELECT run FROM runs WHERE stage=?', (self.stage,)).fetchone()
+            if row is None or row[0].split(':')[0] != digest:
+                self.conn.execute('DELETE FROM tasks WHERE stage=?', (self.stage,))
+                self.conn.execute('INSERT OR REPLACE INTO runs (stage, run) VALUES (?, ?)',
+                                  (self.stage, '%s:%s' % (digest, uuid.uuid4().hex)))
+            self.conn.executemany('INSERT OR IGNORE INTO tasks (stage, key) VALUES (?, ?)',
+                                  [(self.stage, key) for key in keys])
+            return self.conn.execute('SELECT run FROM runs WHERE stage=?', (self.stage,)).fetchone()[0]
+        return self._transaction(_start)
+
+    def add(self, keys):
+        """
+        register tasks, keys that already exist in the stage are left untouched
+        """
+        rows = [(self.stage, str(key)) for key in keys]
+        self._transaction(lambda: self.conn.executemany(
+            'INSERT OR IGNORE INTO tasks (stage, key) VALUES (?, ?)', rows))
+
+    def claim(self, worker):
+        """
+        lease the next pending (or expired) task, None when the stage is drained
+        """
+        worker = self.worker = '%s:%s:%s' % (socket.gethostname(), os.getpid(), worker)
+
+        def _claim():
+            now = time.time()
+            row = self.conn.execute("""SELECT key FROM tasks WHERE stage=? AND
+                                       (status=? OR (status=? AND lease_until<?))
+                                       ORDER BY rowid LIMIT 1""",
+                                    (self.stage, PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("""UPDATE tasks SET status=?, worker=?, lease_until=?, attempts=attempts+1
+                                 WHERE stage=? AND key=?""",
+                              (LEASED, worker, now + self.lease, self.stage, row[0]))
+            self.renewed[row[0]] = now
+            return row[0]
+        return self._transaction(_claim)
+
+    def renew(self, key):
+        """
+        extend the lease of a task claimed by this worker
+        """
+        now = time.time()
+        self._transaction(lambda: self.conn.execute(
+            'UPDATE tasks SET lease_until=? WHERE stage=? AND key=? AND status=? AND worker=?',
+            (now + self.lease, self.stage, str(key), LEASED, self.worker)))
+        self.renewed[str(key)] = now
+
+    def heartbeat(self, key):
+        """
+        renew(key) if the last renewal is older than the heartbeat interval,
+        cheap enough to call after every pair or phecode
+        """
+        if time.time() - self.renewed.get(str(key), 0) >= self.heartbeat_interval:
+            self.renew(key)
+
+    def complete(self, key):
+        """
+        mark a task claimed by this worker done; False if the lease was lost
+        (it expired and another worker claimed the task), which then owns it
+        """
+        cursor = self._transaction(lambda: self.conn.execute(
+            'UPDATE tasks SET status=?, lease_until=NULL WHERE stage=? AND key=? AND status=? AND worker=?',
+            (DONE, self.stage, str(key), LEASED, self.worker)))
+        self.renewed.pop(str(key), None)
+        return cursor.rowcount == 1
+
+    def release(self, key):
+        """
+        give a task claimed by this worker back without completing it
+        """
+        self._transaction(lambda: self.conn.execute(
+            'UPDATE tasks SET status=?, worker=NULL, lease_until=NULL WHERE stage=? AND key=? AND status=? AND worker=?',
+            (PENDING, self.stage, str(key), LEASED, self.worker)))
+        self.renewed.pop(str(key), None)
+
+    @contextlib.contextmanager
+    def holding(self, key):
+        """
+        release(key) if the block raises, so the task is pending again at once
+        instead of after the lease
+        """
+        try:
+            yield key
+        except BaseException:
+            self.release(key)
+            raise
+
+    def drain(self, worker):
+        """
+        yield claimed keys until the stage is drained; the caller completes them
+        """
+        while True:
+            key = self.claim(worker)
+            if key is None:
+                return
+            yield key
+
+    def progress(self):
+        """
+        (finished or in progress, total) tasks of the stage
+        """
+        counts = dict(self.conn.execute('SELECT status, COUNT(*) FROM tasks WHERE stage=? GROUP BY status',
+                                        (self.stage,)).fetchall())
+        return counts.get(DONE, 0) + counts.get(LEASED, 0), sum(counts.values())
+
+    def status(self):
+        counts = dict(self.conn.execute('SELECT status, COUNT(*) FROM tasks WHERE stage=? GROUP BY status',
+                                        (self.stage,)).fetchall())
+        expired = self.conn.execute('SELECT COUNT(*) FROM tasks WHERE stage=? AND status=? AND lease_until<?',
+                                    (self.stage, LEASED, time.time())).fetchone()[0]
+        return {'pending':counts.get(PENDING, 0), 'leased':counts.get(LEASED, 0),
+                'expired':expired, 'done':counts.get(DONE, 0)}
+
+    def reset(self):
+        """
+        drop every task of the stage (the old 'delete temp.cache' step) and start a new run
+        """
+        def _reset():
+            self.conn.execute('DELETE FROM tasks WHERE stage=?', (self.stage,))
+            self.conn.execute('DELETE FROM runs WHERE stage=?', (self.stage,))
+        self._transaction(_reset)
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='New_depression project')
+    parser.add_argument('--db', type=str)
+    parser.add_argument('--stage', type=str)
+    parser.add_argument('--reset', action='store_true')
+    args = parser.parse_args()
+    queue = WorkQueue(args.db, args.stage)
+    if args.reset:
+        queue.reset()
+    print(args.stage, queue.status())